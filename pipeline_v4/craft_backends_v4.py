@@ -0,0 +1,506 @@
+"""
+CRAFT Inference Backends V4
+===========================
+Pluggable runtimes for the CRAFT network behind CraftTextDetector:
+
+- eager       : PyTorch nn.Module (default)
+- torchscript : torch.jit.trace'd graph, no Python module construction at load
+- onnx        : ONNX Runtime on CPU (CPUExecutionProvider, full graph optimizations)
+- int8        : static post-training int8 quantization (FX graph mode), calibrated
+                on the sample creatives in image/, saved as TorchScript (CPU only)
+
+Every backend takes a normalized NCHW float32 numpy batch and returns the raw
+CRAFT output as numpy with shape (N, H/2, W/2, 2) = [score_text, score_link].
+Compiled artifacts live next to the weights (craft_mlt_25k.onnx,
+craft_mlt_25k.torchscript.pt, craft_mlt_25k.int8.torchscript.pt) and are
+exported on first use if missing.
+
+Usage:
+    python craft_backends_v4.py export --format onnx
+    python craft_backends_v4.py export --format torchscript --output craft.ts.pt
+    python craft_backends_v4.py parity --format onnx --images image/
+    python craft_backends_v4.py export --format int8 --calibration-images image/
+    python craft_backends_v4.py parity --format int8 --images image/   # recall / IoU vs fp32
+"""
+
+import os
+import sys
+import json
+import argparse
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+CRAFT_DIR = Path(__file__).parent.parent / "CRAFT-pytorch"
+sys.path.insert(0, str(CRAFT_DIR))
+
+import torch
+import torch.backends.cudnn as cudnn
+
+from craft import CRAFT
+
+BACKENDS = ("eager", "torchscript", "onnx", "int8")
+DEFAULT_MODEL_PATH = str(CRAFT_DIR / "craft_mlt_25k.pth")
+DEFAULT_CALIBRATION_DIR = str(Path(__file__).parent.parent / "image")
+CRAFT_WEIGHTS_URL = "https://github.com/faustomorales/keras-ocr/releases/download/v0.8.4/craft_mlt_25k.pth"
+
+# Example input used for tracing/export. Height/width stay dynamic in the
+# exported graphs; only the traced code path depends on this.
+EXPORT_SIZE = (768, 768)
+ONNX_OPSET = 13
+
+
+# -----------------------------------------------------------------------------
+# EAGER MODEL
+# -----------------------------------------------------------------------------
+
+def download_weights(model_path: str):
+    """Download CRAFT weights to model_path (public keras-ocr release mirror)."""
+    print(f"Model not found at {model_path}. Downloading...")
+    try:
+        import requests
+        print(f"Downloading from {CRAFT_WEIGHTS_URL}...")
+        response = requests.get(CRAFT_WEIGHTS_URL, stream=True)
+        response.raise_for_status()
+
+        os.makedirs(os.path.dirname(model_path), exist_ok=True)
+
+        with open(model_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=8192):
+                f.write(chunk)
+        print(f"Downloaded model to {model_path}")
+    except Exception as e:
+        raise RuntimeError(f"Failed to download model: {e}")
+
+
+def build_craft_model(model_path: str, cuda: bool = False) -> torch.nn.Module:
+    """Construct CRAFT, load weights from disk and put it in eval mode."""
+    print("Loading CRAFT model...")
+    net = CRAFT()
+
+    print(f"Loading weights from: {model_path}")
+    if not os.path.exists(model_path):
+        download_weights(model_path)
+
+    # Load state dict
+    if cuda:
+        state_dict = torch.load(model_path)
+    else:
+        state_dict = torch.load(model_path, map_location='cpu')
+
+    # Handle DataParallel saved weights (remove 'module.' prefix)
+    new_state_dict = OrderedDict()
+    for k, v in state_dict.items():
+        if k.startswith('module.'):
+            name = k[7:]  # remove 'module.' prefix
+        else:
+            name = k
+        new_state_dict[name] = v
+
+    net.load_state_dict(new_state_dict)
+
+    if cuda:
+        net = net.cuda()
+        net = torch.nn.DataParallel(net)
+        cudnn.benchmark = False
+
+    net.eval()
+    print("CRAFT model loaded successfully!")
+    return net
+
+
+class _ScoreMapsOnly(torch.nn.Module):
+    """Export wrapper: drop the `feature` output, keep only the score maps."""
+
+    def __init__(self, net: torch.nn.Module):
+        super().__init__()
+        self.net = net
+
+    def forward(self, x):
+        y, _ = self.net(x)
+        return y
+
+
+# -----------------------------------------------------------------------------
+# EXPORT
+# -----------------------------------------------------------------------------
+
+def default_artifact_path(model_path: str, backend: str) -> str:
+    """Compiled-model path next to the weights file for a given backend."""
+    base = os.path.splitext(model_path)[0]
+    if backend == "torchscript":
+        return base + ".torchscript.pt"
+    if backend == "onnx":
+        return base + ".onnx"
+    if backend == "int8":
+        return base + ".int8.torchscript.pt"
+    raise ValueError(f"Backend '{backend}' has no compiled artifact")
+
+
+def _example_input(example_size=EXPORT_SIZE) -> torch.Tensor:
+    h, w = example_size
+    return torch.randn(1, 3, h, w, dtype=torch.float32)
+
+
+def export_torchscript(net: torch.nn.Module, output_path: str, example_size=EXPORT_SIZE) -> str:
+    """Trace the eager CRAFT model and save it as TorchScript."""
+    wrapper = _ScoreMapsOnly(net).eval()
+    with torch.no_grad():
+        traced = torch.jit.trace(wrapper, _example_input(example_size), check_trace=False)
+    traced = torch.jit.freeze(traced)
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    traced.save(output_path)
+    print(f"Exported TorchScript model: {output_path}")
+    return output_path
+
+
+def export_onnx(net: torch.nn.Module, output_path: str, example_size=EXPORT_SIZE, opset: int = ONNX_OPSET) -> str:
+    """Export the eager CRAFT model to ONNX with dynamic batch/height/width."""
+    wrapper = _ScoreMapsOnly(net).eval()
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with torch.no_grad():
+        torch.onnx.export(
+            wrapper,
+            _example_input(example_size),
+            output_path,
+            input_names=["input"],
+            output_names=["score_maps"],
+            dynamic_axes={
+                "input": {0: "batch", 2: "height", 3: "width"},
+                "score_maps": {0: "batch", 1: "map_height", 2: "map_width"},
+            },
+            opset_version=opset,
+            do_constant_folding=True,
+        )
+    print(f"Exported ONNX model: {output_path}")
+    return output_path
+
+
+def _quantized_engine() -> str:
+    engines = torch.backends.quantized.supported_engines
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in engines:
+            return engine
+    raise RuntimeError(f"No int8 quantized engine available (supported: {engines})")
+
+
+def load_calibration_batches(image_dir: str = DEFAULT_CALIBRATION_DIR, limit: int = 16,
+                             canvas_size: int = 1280, mag_ratio: float = 1.5) -> List[np.ndarray]:
+    """
+    Preprocess sample creatives exactly like CraftTextDetector (resize to canvas,
+    normalize, NCHW) for int8 calibration.
+    """
+    import cv2
+    from imgproc import resize_aspect_ratio, normalizeMeanVariance
+
+    batches = []
+    for path in list_images(image_dir, limit):
+        image = cv2.imread(str(path))
+        if image is None:
+            continue
+        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        img_resized, _, _ = resize_aspect_ratio(image_rgb, canvas_size, interpolation=cv2.INTER_LINEAR, mag_ratio=mag_ratio)
+        batches.append(normalizeMeanVariance(img_resized).transpose(2, 0, 1)[None].copy())
+    if not batches:
+        raise RuntimeError(f"No calibration images found in {image_dir}")
+    return batches
+
+
+def quantize_static_int8(net: torch.nn.Module, calibration_batches: List[np.ndarray]) -> torch.nn.Module:
+    """
+    Post-training static int8 quantization of the whole CRAFT graph (VGG16-BN
+    backbone + U-net head) via FX graph mode. Conv/BN/ReLU are fused, observers
+    are calibrated on `calibration_batches`, then the graph is converted.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    engine = _quantized_engine()
+    torch.backends.quantized.engine = engine
+
+    wrapper = _ScoreMapsOnly(net).eval()
+    example = (torch.from_numpy(calibration_batches[0]),)
+    prepared = prepare_fx(wrapper, get_default_qconfig_mapping(engine), example)
+
+    print(f"Calibrating int8 observers on {len(calibration_batches)} images ({engine})...")
+    with torch.no_grad():
+        for batch in calibration_batches:
+            prepared(torch.from_numpy(batch))
+
+    return convert_fx(prepared)
+
+
+def export_int8(net: torch.nn.Module, output_path: str, calibration_dir: str = DEFAULT_CALIBRATION_DIR,
+                calibration_limit: int = 16) -> str:
+    """Calibrate + quantize CRAFT and save it as TorchScript (no recalibration at load)."""
+    quantized = quantize_static_int8(net, load_calibration_batches(calibration_dir, calibration_limit))
+    with torch.no_grad():
+        traced = torch.jit.trace(quantized, _example_input(), check_trace=False)
+    traced = torch.jit.freeze(traced)
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    traced.save(output_path)
+    print(f"Exported int8 TorchScript model: {output_path}")
+    return output_path
+
+
+def export_backend(backend: str, model_path: str = DEFAULT_MODEL_PATH, output_path: str = None,
+                   calibration_dir: str = None) -> str:
+    """Export the compiled artifact for `backend` from the eager weights."""
+    output_path = output_path or default_artifact_path(model_path, backend)
+    net = build_craft_model(model_path, cuda=False)
+    if backend == "torchscript":
+        return export_torchscript(net, output_path)
+    if backend == "onnx":
+        return export_onnx(net, output_path)
+    if backend == "int8":
+        calibration_dir = calibration_dir or os.getenv("CRAFT_CALIBRATION_DIR", DEFAULT_CALIBRATION_DIR)
+        return export_int8(net, output_path, calibration_dir)
+    raise ValueError(f"Cannot export backend '{backend}'")
+
+
+# -----------------------------------------------------------------------------
+# RUNTIMES
+# -----------------------------------------------------------------------------
+
+class EagerBackend:
+    """Plain PyTorch module."""
+    name = "eager"
+
+    def __init__(self, net: torch.nn.Module, cuda: bool = False):
+        self.net = net
+        self.cuda = cuda
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        t = torch.from_numpy(x)
+        if self.cuda:
+            t = t.cuda()
+        with torch.inference_mode():
+            y, _ = self.net(t)
+        return y.cpu().numpy()
+
+
+class TorchScriptBackend:
+    """Traced + frozen TorchScript graph."""
+    name = "torchscript"
+
+    def __init__(self, artifact_path: str, cuda: bool = False):
+        self.cuda = cuda
+        self.module = torch.jit.load(artifact_path, map_location="cuda" if cuda else "cpu")
+        self.module.eval()
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        t = torch.from_numpy(x)
+        if self.cuda:
+            t = t.cuda()
+        with torch.inference_mode():
+            y = self.module(t)
+        return y.cpu().numpy()
+
+
+class OnnxRuntimeBackend:
+    """ONNX Runtime session on the CPU execution provider."""
+    name = "onnx"
+
+    def __init__(self, artifact_path: str, num_threads: int = None):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise RuntimeError("onnxruntime is not installed. Run: pip install onnxruntime")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        num_threads = num_threads or int(os.getenv("CRAFT_ORT_THREADS", "0"))
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+
+        self.session = ort.InferenceSession(artifact_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_name = self.session.get_outputs()[0].name
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        return self.session.run([self.output_name], {self.input_name: x})[0]
+
+
+def load_backend(backend: str, model_path: str, cuda: bool = False, artifact_path: str = None):
+    """
+    Build the runtime for `backend`, exporting its artifact from the eager
+    weights first if it does not exist yet.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown CRAFT backend '{backend}'. Choose from {BACKENDS}")
+
+    if backend == "eager":
+        return EagerBackend(build_craft_model(model_path, cuda), cuda)
+
+    artifact_path = artifact_path or default_artifact_path(model_path, backend)
+    if not os.path.exists(artifact_path):
+        print(f"[CRAFT] No {backend} artifact at {artifact_path}, exporting from eager weights...")
+        export_backend(backend, model_path, artifact_path)
+
+    print(f"Loading CRAFT {backend} backend from: {artifact_path}")
+    if backend == "torchscript":
+        return TorchScriptBackend(artifact_path, cuda)
+    if backend == "int8":
+        # Quantized kernels are CPU-only; the engine must match the one used at export
+        torch.backends.quantized.engine = _quantized_engine()
+        return TorchScriptBackend(artifact_path, cuda=False)
+    return OnnxRuntimeBackend(artifact_path)
+
+
+# -----------------------------------------------------------------------------
+# PARITY CHECK
+# -----------------------------------------------------------------------------
+
+def _bbox_iou(a: Dict[str, int], b: Dict[str, int]) -> float:
+    ix = max(0, min(a["x"] + a["width"], b["x"] + b["width"]) - max(a["x"], b["x"]))
+    iy = max(0, min(a["y"] + a["height"], b["y"] + b["height"]) - max(a["y"], b["y"]))
+    inter = ix * iy
+    union = a["width"] * a["height"] + b["width"] * b["height"] - inter
+    return inter / union if union > 0 else 0.0
+
+
+def compare_regions(reference: List[Dict], candidate: List[Dict], iou_threshold: float = 0.5) -> Dict[str, float]:
+    """
+    Greedy one-to-one bbox matching of candidate regions against reference ones.
+
+    Returns recall (matched reference regions / reference regions) and the mean
+    IoU of the matched pairs.
+    """
+    used = set()
+    ious = []
+    for ref in reference:
+        best_j, best_iou = None, 0.0
+        for j, cand in enumerate(candidate):
+            if j in used:
+                continue
+            iou = _bbox_iou(ref["bbox"], cand["bbox"])
+            if iou > best_iou:
+                best_j, best_iou = j, iou
+        if best_j is not None and best_iou >= iou_threshold:
+            used.add(best_j)
+            ious.append(best_iou)
+
+    recall = len(ious) / len(reference) if reference else 1.0
+    mean_iou = float(np.mean(ious)) if ious else (1.0 if not reference else 0.0)
+    return {
+        "reference_regions": len(reference),
+        "candidate_regions": len(candidate),
+        "recall": recall,
+        "mean_iou": mean_iou,
+    }
+
+
+def list_images(folder: str, limit: int = None) -> List[Path]:
+    exts = {".png", ".jpg", ".jpeg", ".webp", ".bmp"}
+    files = sorted(p for p in Path(folder).iterdir() if p.suffix.lower() in exts)
+    return files[:limit] if limit else files
+
+
+def check_parity(backend: str, image_paths: List[Path], model_path: str = DEFAULT_MODEL_PATH,
+                 artifact_path: str = None, **detector_kwargs) -> Dict[str, Any]:
+    """
+    Compare a backend against eager PyTorch on sample images.
+
+    Reports per-image max abs difference of the score maps plus region
+    recall / mean bbox IoU of the final detections (eager = reference).
+    """
+    import cv2
+    try:
+        from text_detector_craft_v4 import CraftTextDetector
+    except ImportError:
+        from pipeline_v4.text_detector_craft_v4 import CraftTextDetector
+
+    common = dict(model_path=model_path, use_heatmap_cache=False, **detector_kwargs)
+    reference = CraftTextDetector(backend="eager", **common)
+    candidate = CraftTextDetector(backend=backend, backend_path=artifact_path, **common)
+
+    per_image = []
+    for path in image_paths:
+        image = cv2.imread(str(path))
+        if image is None:
+            print(f"  ! Skipping unreadable image: {path}")
+            continue
+        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+        ref_text, ref_link, _ = reference._compute_heatmaps([image_rgb])[0]
+        cand_text, cand_link, _ = candidate._compute_heatmaps([image_rgb])[0]
+        max_diff = float(max(np.abs(ref_text - cand_text).max(), np.abs(ref_link - cand_link).max()))
+
+        stats = compare_regions(
+            reference.detect_text(image)["regions"],
+            candidate.detect_text(image)["regions"],
+        )
+        stats.update({"image": path.name, "max_abs_diff": max_diff})
+        per_image.append(stats)
+        print(f"  {path.name}: max|diff|={max_diff:.2e} recall={stats['recall']:.3f} "
+              f"mIoU={stats['mean_iou']:.3f} ({stats['reference_regions']} -> {stats['candidate_regions']} regions)")
+
+    summary = {
+        "backend": backend,
+        "images": len(per_image),
+        "max_abs_diff": max((r["max_abs_diff"] for r in per_image), default=0.0),
+        "mean_recall": float(np.mean([r["recall"] for r in per_image])) if per_image else 1.0,
+        "mean_iou": float(np.mean([r["mean_iou"] for r in per_image])) if per_image else 1.0,
+        "per_image": per_image,
+    }
+    return summary
+
+
+# -----------------------------------------------------------------------------
+# CLI
+# -----------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Export / verify CRAFT inference backends")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_export = sub.add_parser("export", help="Export TorchScript or ONNX artifact from eager weights")
+    p_export.add_argument("--format", choices=["torchscript", "onnx", "int8"], required=True)
+    p_export.add_argument("--weights", default=DEFAULT_MODEL_PATH)
+    p_export.add_argument("--output", default=None, help="Artifact path (default: next to weights)")
+    p_export.add_argument("--calibration-images", default=None, help="int8 only: calibration image folder")
+
+    p_parity = sub.add_parser("parity", help="Compare a backend against eager PyTorch")
+    p_parity.add_argument("--format", choices=["torchscript", "onnx", "int8"], required=True)
+    p_parity.add_argument("--weights", default=DEFAULT_MODEL_PATH)
+    p_parity.add_argument("--artifact", default=None)
+    p_parity.add_argument("--images", default="image")
+    p_parity.add_argument("--limit", type=int, default=10)
+    p_parity.add_argument("--atol", type=float, default=None,
+                          help="Max allowed score-map difference (default: 1e-3; int8 is report-only)")
+    p_parity.add_argument("--min-recall", type=float, default=None, help="Fail if mean region recall drops below this")
+    p_parity.add_argument("--output", default=None, help="Optional JSON report path")
+
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_backend(args.format, args.weights, args.output, args.calibration_images)
+        return
+
+    images = list_images(args.images, args.limit)
+    print(f"Checking {args.format} parity on {len(images)} images...")
+    summary = check_parity(args.format, images, model_path=args.weights, artifact_path=args.artifact)
+    print(f"Max score-map diff: {summary['max_abs_diff']:.2e} | "
+          f"recall: {summary['mean_recall']:.3f} | mIoU: {summary['mean_iou']:.3f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"Report saved to: {args.output}")
+
+    # int8 is expected to drift; judge it on detections (--min-recall), not raw maps
+    atol = args.atol if args.atol is not None else (None if args.format == "int8" else 1e-3)
+    if atol is not None and summary["max_abs_diff"] > atol:
+        print(f"FAILED: score maps differ by more than {atol}")
+        sys.exit(1)
+    if args.min_recall is not None and summary["mean_recall"] < args.min_recall:
+        print(f"FAILED: mean region recall {summary['mean_recall']:.3f} < {args.min_recall}")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+CRAFT Heatmap Cache V4
+======================
+Content-addressed cache for CRAFT score maps (`score_text` / `score_link`).
+
+The forward pass only depends on the image pixels, the resize parameters
+(`canvas_size`, `mag_ratio`) and the model, while thresholds
+(`text_threshold`, `link_threshold`, `low_text`) only affect the cheap
+post-processing. Caching the maps makes threshold sweeps and re-runs of the
+same run directory skip the network entirely.
+
+Two tiers:
+1. In-memory LRU (per process), bounded by the total size of the held maps
+   (entry count says little: tiled native-resolution maps are large)
+2. Optional (opt-in) on-disk store: `<key>_text.npy` / `<key>_link.npy` +
+   `<key>.json`, loaded back memory-mapped. The store is size-bounded: least
+   recently used entries (`.json` mtime, touched on every disk hit) are evicted
+   once it exceeds its byte budget. Maps of small inputs (box crops, residue
+   ROIs) are kept in memory only; recomputing them is cheaper than the files.
+
+Config (env):
+    PIPELINE_CACHE_DIR          Root for pipeline caches (default: pipeline_outputs/.cache)
+    CRAFT_HEATMAP_CACHE_DIR     Disk dir for heatmaps (default: "" = memory only; e.g.
+                                <PIPELINE_CACHE_DIR>/craft_heatmaps for threshold sweeps)
+    CRAFT_HEATMAP_CACHE_MAX_MB  Disk budget in MB (default: 512)
+    CRAFT_HEATMAP_CACHE_MEM_MB  Memory budget in MB (default: 256)
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+PIPELINE_CACHE_DIR = Path(os.getenv("PIPELINE_CACHE_DIR", "pipeline_outputs/.cache"))
+
+# Heatmaps smaller than this (score map cells, i.e. ~quarter of the resized input
+# pixels) are not written to disk
+MIN_DISK_PIXELS = 128 * 128
+
+
+def image_digest(image: np.ndarray) -> str:
+    """Hash image pixels together with shape/dtype (so reshapes don't collide)."""
+    h = hashlib.sha256()
+    h.update(f"{image.shape}|{image.dtype}".encode("utf-8"))
+    h.update(np.ascontiguousarray(image).data)
+    return h.hexdigest()
+
+
+def make_heatmap_key(image: np.ndarray, canvas_size: int, mag_ratio: float, model_tag: str = "") -> str:
+    """Cache key: image hash + resize parameters + model identity."""
+    params = f"{image_digest(image)}|canvas={canvas_size}|mag={mag_ratio}|model={model_tag}"
+    return hashlib.sha256(params.encode("utf-8")).hexdigest()[:32]
+
+
+class HeatmapCache:
+    """
+    Two-tier (memory LRU + optional disk) store for CRAFT score maps.
+
+    Entries are (score_text, score_link, target_ratio), where target_ratio is
+    the resize ratio needed to map heatmap coordinates back to the image.
+
+    Args:
+        cache_dir: Disk tier directory (None: memory only)
+        max_memory_bytes: Memory tier budget (score map bytes); LRU entries beyond it are dropped
+        max_disk_bytes: Disk tier budget; LRU entries beyond it are evicted on insert
+        min_disk_pixels: Only heatmaps with at least this many cells go to disk
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_memory_bytes: int = 256 << 20,
+                 max_disk_bytes: int = 512 << 20, min_disk_pixels: int = MIN_DISK_PIXELS):
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.min_disk_pixels = min_disk_pixels
+        self._memory: "OrderedDict[str, Tuple[np.ndarray, np.ndarray, float]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._disk_bytes = None  # Running total of the disk tier, scanned on first write
+        self.hits = 0
+        self.misses = 0
+
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    # -- memory tier ----------------------------------------------------------
+
+    @staticmethod
+    def _entry_bytes(entry: Tuple[np.ndarray, np.ndarray, float]) -> int:
+        return entry[0].nbytes + entry[1].nbytes
+
+    def _remember(self, key: str, entry: Tuple[np.ndarray, np.ndarray, float]):
+        with self._lock:
+            old = self._memory.pop(key, None)
+            if old is not None:
+                self._memory_bytes -= self._entry_bytes(old)
+            self._memory[key] = entry
+            self._memory_bytes += self._entry_bytes(entry)
+            # An entry larger than the whole budget is not kept either
+            while self._memory and self._memory_bytes > self.max_memory_bytes:
+                _, dropped = self._memory.popitem(last=False)
+                self._memory_bytes -= self._entry_bytes(dropped)
+
+    # -- disk tier ------------------------------------------------------------
+
+    def _paths(self, key: str):
+        return (
+            self.cache_dir / f"{key}_text.npy",
+            self.cache_dir / f"{key}_link.npy",
+            self.cache_dir / f"{key}.json",
+        )
+
+    def _load_from_disk(self, key: str):
+        if not self.cache_dir:
+            return None
+        text_path, link_path, meta_path = self._paths(key)
+        # The .json is written last, so its presence marks a complete entry
+        if not meta_path.exists():
+            return None
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            score_text = np.load(text_path, mmap_mode="r")
+            score_link = np.load(link_path, mmap_mode="r")
+            os.utime(meta_path)  # LRU: mark as recently used
+            return score_text, score_link, float(meta["target_ratio"])
+        except Exception as e:
+            print(f"  [HeatmapCache] Ignoring unreadable entry {key}: {e}")
+            return None
+
+    def _save_to_disk(self, key: str, score_text: np.ndarray, score_link: np.ndarray, target_ratio: float):
+        text_path, link_path, meta_path = self._paths(key)
+        try:
+            for path, arr in ((text_path, score_text), (link_path, score_link)):
+                tmp = path.with_name(path.name + f".{os.getpid()}.tmp")
+                with open(tmp, "wb") as f:
+                    np.save(f, np.ascontiguousarray(arr))
+                os.replace(tmp, path)
+            tmp = meta_path.with_name(meta_path.name + f".{os.getpid()}.tmp")
+            with open(tmp, "w") as f:
+                json.dump({"target_ratio": target_ratio, "shape": list(score_text.shape)}, f)
+            os.replace(tmp, meta_path)
+        except Exception as e:
+            print(f"  [HeatmapCache] Could not write entry {key}: {e}")
+            return
+
+        with self._disk_lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+            else:
+                self._disk_bytes += sum(p.stat().st_size for p in (text_path, link_path, meta_path))
+            over_budget = self._disk_bytes > self.max_disk_bytes
+        if over_budget:
+            self.evict()
+
+    def _disk_entries(self):
+        """(last used, bytes, key) of every complete disk entry."""
+        entries = []
+        for meta_path in self.cache_dir.glob("*.json"):
+            key = meta_path.stem
+            try:
+                size = sum(p.stat().st_size for p in self._paths(key))
+                entries.append((meta_path.stat().st_mtime, size, key))
+            except OSError:
+                continue  # Evicted or still being written
+        return entries
+
+    def evict(self):
+        """Remove least recently used disk entries until the disk tier fits max_disk_bytes."""
+        if not self.cache_dir:
+            return
+        with self._disk_lock:
+            entries = sorted(self._disk_entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, key in entries:
+                if total <= self.max_disk_bytes:
+                    break
+                # .json first: without it the entry no longer counts as complete
+                for path in reversed(self._paths(key)):
+                    try:
+                        path.unlink()
+                    except FileNotFoundError:
+                        pass
+                total -= size
+            self._disk_bytes = total
+
+    # -- public API -----------------------------------------------------------
+
+    def get(self, key: str) -> Optional[Tuple[np.ndarray, np.ndarray, float]]:
+        """Return cached (score_text, score_link, target_ratio) or None."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        entry = self._load_from_disk(key)
+        if entry is not None:
+            self._remember(key, entry)
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, score_text: np.ndarray, score_link: np.ndarray, target_ratio: float):
+        """Store score maps for key in memory and (if configured) on disk."""
+        # Own the arrays: callers usually pass views into a larger batch output
+        entry = (np.array(score_text, copy=True), np.array(score_link, copy=True), float(target_ratio))
+        self._remember(key, entry)
+        if self.cache_dir and entry[0].size >= self.min_disk_pixels:
+            self._save_to_disk(key, *entry)
+
+    def clear(self):
+        """Drop the in-memory tier (disk entries are kept)."""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+
+
+_DEFAULT_CACHE: Optional[HeatmapCache] = None
+_DEFAULT_CACHE_LOCK = threading.Lock()
+
+
+def get_default_heatmap_cache() -> HeatmapCache:
+    """Process-wide cache shared by all CraftTextDetector instances."""
+    global _DEFAULT_CACHE
+    with _DEFAULT_CACHE_LOCK:
+        if _DEFAULT_CACHE is None:
+            cache_dir = os.getenv("CRAFT_HEATMAP_CACHE_DIR", "")
+            max_bytes = int(float(os.getenv("CRAFT_HEATMAP_CACHE_MAX_MB", "512")) * 1024 * 1024)
+            max_memory_bytes = int(float(os.getenv("CRAFT_HEATMAP_CACHE_MEM_MB", "256")) * 1024 * 1024)
+            _DEFAULT_CACHE = HeatmapCache(cache_dir=cache_dir or None, max_memory_bytes=max_memory_bytes,
+                                          max_disk_bytes=max_bytes)
+        return _DEFAULT_CACHE
@@ -0,0 +1,535 @@
+"""
+CRAFT Detection Service V4
+==========================
+Long-lived local CRAFT daemon so pipeline stages don't pay the torch import and
+model load on every CLI invocation.
+
+The server wraps CraftTextDetector behind a localhost HTTP endpoint. Requests
+go into one queue; worker threads drain it, batch concurrent requests with the
+same detector config into a single batched CRAFT pass, and return region JSON.
+
+Server:
+    python pipeline_v4/craft_service_v4.py --port 8765 --workers 2 --max-batch 8
+
+Clients (pipeline stages use create_text_detector()):
+    export CRAFT_SERVICE_URL=http://127.0.0.1:8765
+
+Endpoints (JSON):
+    GET  /health
+    POST /detect       {"image_path", "crop_mode", "crops_dir", "config"}
+                       -> CraftTextDetector.detect() result
+    POST /detect_many  {"images": [<image ref>, ...], "config"}
+                       -> {"results": [CraftTextDetector.detect_text() result, ...]}
+
+Image refs (BGR uint8):
+    {"path": "/abs/image.png"}
+    {"shm": "<SharedMemory name>", "shape": [h, w, 3], "dtype": "uint8"}
+    {"png_b64": "<base64 PNG>"}
+
+Config (env):
+    CRAFT_SERVICE_URL  Service URL used by create_text_detector() (unset = run CRAFT in-process)
+    CRAFT_SERVICE_SHM  Send detect_many() images through shared memory (default 1; set 0 for PNG)
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import base64
+import argparse
+import threading
+import concurrent.futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+import cv2
+import numpy as np
+import requests
+
+sys.path.append(str(Path(__file__).parent))
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Detector settings a client may choose per request; model/device/backend are fixed by the server
+CONFIG_KEYS = (
+    "text_threshold", "link_threshold", "low_text", "canvas_size", "mag_ratio",
+    "poly", "padding_percentage", "merge_lines", "tile_size", "tile_overlap",
+)
+
+# Mirrors text_detector_craft_v4.CROP_MODES (not imported here: that module pulls in torch)
+CROP_MODES = ("base64", "array", "file", "none")
+
+
+def _normalize_config(config: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Validate per-request detector settings."""
+    config = dict(config or {})
+    unknown = set(config) - set(CONFIG_KEYS)
+    if unknown:
+        raise ValueError(f"Unsupported detector settings: {sorted(unknown)}")
+    return config
+
+
+# -----------------------------------------------------------------------------
+# IMAGE TRANSPORT
+# -----------------------------------------------------------------------------
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """Attach to a client's segment without letting this process's tracker unlink it."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+        return shm
+
+
+def decode_image_ref(ref: Dict[str, Any]) -> np.ndarray:
+    """Load a BGR image from a request image ref (path / shared memory / base64 PNG)."""
+    if "path" in ref:
+        image = cv2.imread(str(ref["path"]))
+        if image is None:
+            raise ValueError(f"Failed to load image: {ref['path']}")
+        return image
+
+    if "shm" in ref:
+        shm = _attach_shared_memory(ref["shm"])
+        try:
+            view = np.ndarray(tuple(ref["shape"]), dtype=np.dtype(ref.get("dtype", "uint8")), buffer=shm.buf)
+            image = view.copy()
+            del view
+        finally:
+            shm.close()
+        return image
+
+    if "png_b64" in ref:
+        buf = np.frombuffer(base64.b64decode(ref["png_b64"]), dtype=np.uint8)
+        image = cv2.imdecode(buf, cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise ValueError("Failed to decode png_b64 image")
+        return image
+
+    raise ValueError("Image ref needs one of 'path', 'shm' or 'png_b64'")
+
+
+def _decode_data_uri(data_uri: str) -> np.ndarray:
+    """Decode a detect() crop data URI back to a BGR array."""
+    payload = data_uri.split(",", 1)[-1]
+    buf = np.frombuffer(base64.b64decode(payload), dtype=np.uint8)
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+
+
+# -----------------------------------------------------------------------------
+# SERVER
+# -----------------------------------------------------------------------------
+
+class CraftService:
+    """
+    Request queue + worker threads around shared CraftTextDetector instances.
+
+    Each worker takes the next job, then keeps collecting jobs for up to
+    `batch_wait` seconds (or until `max_batch` images) and runs every group of
+    jobs with the same detector config through one batched CRAFT pass.
+    """
+
+    def __init__(self, workers: int = 1, max_batch: int = 8, batch_wait: float = 0.01,
+                 model_path: str = None, cuda: bool = False, backend: str = None,
+                 backend_path: str = None, request_timeout: float = 600.0):
+        try:
+            from text_detector_craft_v4 import CraftTextDetector
+        except ImportError:
+            from pipeline_v4.text_detector_craft_v4 import CraftTextDetector
+        self._detector_cls = CraftTextDetector
+
+        self.workers = max(1, workers)
+        self.max_batch = max(1, max_batch)
+        self.batch_wait = batch_wait
+        self.request_timeout = request_timeout
+        self.detector_kwargs = {
+            "model_path": model_path,
+            "cuda": cuda,
+            "backend": backend,
+            "backend_path": backend_path,
+            "batch_size": self.max_batch,
+        }
+
+        self._jobs: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+        self._detectors: Dict[tuple, Any] = {}
+        self._detectors_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker_loop, name=f"craft-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self):
+        for _ in self._threads:
+            self._jobs.put(None)
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+    def get_detector(self, config: Dict[str, Any]):
+        """One detector per config; they all share the process-wide CRAFT model."""
+        key = tuple(sorted(config.items()))
+        with self._detectors_lock:
+            if key not in self._detectors:
+                self._detectors[key] = self._detector_cls(**self.detector_kwargs, **config)
+            return self._detectors[key]
+
+    def warmup(self):
+        """Load the model before the first request."""
+        self.get_detector({})._load_model()
+
+    # -- request API (called from HTTP handler threads) -----------------------
+
+    def _submit(self, kind: str, config: Dict[str, Any], images: List[np.ndarray], **extra):
+        config = _normalize_config(config)
+        job = {
+            "kind": kind,
+            "config": config,
+            "config_key": tuple(sorted(config.items())),
+            "images": images,
+            "future": concurrent.futures.Future(),
+            **extra,
+        }
+        self._jobs.put(job)
+        return job["future"].result(timeout=self.request_timeout)
+
+    def detect(self, image_path: str, crop_mode: str = "base64", crops_dir: str = None,
+               config: Dict[str, Any] = None) -> Dict[str, Any]:
+        if crop_mode not in CROP_MODES or crop_mode == "array":
+            raise ValueError(f"Unsupported crop_mode '{crop_mode}' (service returns base64, file or none)")
+        image_path = Path(image_path)
+        if not image_path.exists():
+            raise FileNotFoundError(f"Image not found: {image_path}")
+        image = decode_image_ref({"path": str(image_path)})
+        return self._submit("detect", config, [image], image_path=image_path,
+                            crop_mode=crop_mode, crops_dir=crops_dir)
+
+    def detect_many(self, image_refs: List[Dict[str, Any]], config: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        images = [decode_image_ref(ref) for ref in image_refs]
+        if not images:
+            return []
+        return self._submit("many", config, images)
+
+    # -- workers ---------------------------------------------------------------
+
+    def _collect_batch(self, first: Dict[str, Any]) -> List[Dict[str, Any]]:
+        jobs = [first]
+        n_images = len(first["images"])
+        deadline = time.monotonic() + self.batch_wait
+        while n_images < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = self._jobs.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if job is None:
+                # Shutdown marker belongs to some worker; hand it back
+                self._jobs.put(None)
+                break
+            jobs.append(job)
+            n_images += len(job["images"])
+        return jobs
+
+    def _worker_loop(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            groups: Dict[tuple, List[Dict[str, Any]]] = {}
+            for j in self._collect_batch(job):
+                groups.setdefault(j["config_key"], []).append(j)
+            for group in groups.values():
+                self._run_group(group)
+
+    def _run_group(self, group: List[Dict[str, Any]]):
+        """One batched CRAFT pass for all images of jobs sharing a detector config."""
+        try:
+            detector = self.get_detector(group[0]["config"])
+            images = [image for job in group for image in job["images"]]
+            outputs = detector._run_craft_batch([cv2.cvtColor(image, cv2.COLOR_BGR2RGB) for image in images])
+        except Exception as e:
+            for job in group:
+                job["future"].set_exception(e)
+            return
+
+        pos = 0
+        for job in group:
+            n = len(job["images"])
+            job_outputs = outputs[pos:pos + n]
+            pos += n
+            try:
+                if job["kind"] == "detect":
+                    _, polys, _ = job_outputs[0]
+                    result = detector._build_detection_result(
+                        job["images"][0], job["image_path"], polys, job["crop_mode"], job["crops_dir"]
+                    )
+                else:
+                    result = [detector._build_regions_result(image, polys)
+                              for image, (_, polys, _) in zip(job["images"], job_outputs)]
+                job["future"].set_result(result)
+            except Exception as e:
+                job["future"].set_exception(e)
+
+
+class _ServiceHandler(BaseHTTPRequestHandler):
+    service: CraftService = None
+
+    def _send_json(self, status: int, payload: Dict[str, Any]):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {
+                "status": "ok",
+                "workers": self.service.workers,
+                "max_batch": self.service.max_batch,
+                "backend": self.service.detector_kwargs["backend"] or os.getenv("CRAFT_BACKEND", "eager"),
+                "tile_size": int(os.getenv("CRAFT_TILE_SIZE", "0")) or None,
+            })
+        else:
+            self._send_json(404, {"error": f"Unknown endpoint {self.path}"})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if self.path == "/detect":
+                result = self.service.detect(
+                    body["image_path"],
+                    crop_mode=body.get("crop_mode", "base64"),
+                    crops_dir=body.get("crops_dir"),
+                    config=body.get("config"),
+                )
+            elif self.path == "/detect_many":
+                result = {"results": self.service.detect_many(body.get("images", []), config=body.get("config"))}
+            else:
+                self._send_json(404, {"error": f"Unknown endpoint {self.path}"})
+                return
+        except (KeyError, ValueError, FileNotFoundError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            print(f"  [CraftService] Request failed: {e}")
+            self._send_json(500, {"error": str(e)})
+            return
+        self._send_json(200, result)
+
+    def log_message(self, format, *args):
+        # Per-request access logs would drown the pipeline output
+        pass
+
+
+def make_server(service: CraftService, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    """HTTP server for a started CraftService (port 0 = any free port, see server_address)."""
+    handler = type("CraftServiceHandler", (_ServiceHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, warmup: bool = True,
+          service: CraftService = None, **service_kwargs):
+    """Run the detection service until interrupted (`service`: a prebuilt CraftService)."""
+    service = service or CraftService(**service_kwargs)
+    if warmup:
+        print("[CraftService] Loading CRAFT model...")
+        service.warmup()
+    service.start()
+
+    server = make_server(service, host, port)
+    host, port = server.server_address[:2]
+    print(f"[CraftService] Listening on http://{host}:{port} "
+          f"(workers={service.workers}, max_batch={service.max_batch})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[CraftService] Shutting down...")
+    finally:
+        server.server_close()
+        service.stop()
+
+
+# -----------------------------------------------------------------------------
+# CLIENT
+# -----------------------------------------------------------------------------
+
+class RemoteCraftTextDetector:
+    """
+    Service-backed stand-in for CraftTextDetector (detect / detect_text / detect_many).
+    """
+
+    def __init__(self, service_url: str = None, timeout: float = 600.0,
+                 use_shared_memory: bool = None, **config):
+        """
+        Args:
+            service_url: Service URL (default: $CRAFT_SERVICE_URL or http://127.0.0.1:8765)
+            timeout: Per-request timeout in seconds
+            use_shared_memory: Send in-memory images via shared memory instead of PNG
+                (default: $CRAFT_SERVICE_SHM, on)
+            **config: Detector settings (see CONFIG_KEYS)
+        """
+        self.service_url = (service_url or os.getenv("CRAFT_SERVICE_URL")
+                            or f"http://{DEFAULT_HOST}:{DEFAULT_PORT}").rstrip("/")
+        self.timeout = timeout
+        if use_shared_memory is None:
+            use_shared_memory = os.getenv("CRAFT_SERVICE_SHM", "1") != "0"
+        self.use_shared_memory = use_shared_memory
+        self.config = _normalize_config(config)
+        self._session = requests.Session()
+
+    def ping(self) -> bool:
+        try:
+            return self._session.get(f"{self.service_url}/health", timeout=2).status_code == 200
+        except requests.RequestException:
+            return False
+
+    def _post(self, endpoint: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        r = self._session.post(f"{self.service_url}{endpoint}", json=payload, timeout=self.timeout)
+        if r.status_code != 200:
+            try:
+                message = r.json().get("error", r.text)
+            except ValueError:
+                message = r.text
+            raise RuntimeError(f"CRAFT service error {r.status_code}: {message}")
+        return r.json()
+
+    def detect(self, image_path: str, crop_mode: str = "base64", crops_dir: str = None) -> Dict[str, Any]:
+        """Same contract as CraftTextDetector.detect (array crops are decoded client-side)."""
+        if crop_mode not in CROP_MODES:
+            raise ValueError(f"Unknown crop_mode '{crop_mode}'. Choose from {CROP_MODES}")
+        result = self._post("/detect", {
+            "image_path": str(Path(image_path).absolute()),
+            "crop_mode": "base64" if crop_mode == "array" else crop_mode,
+            "crops_dir": str(Path(crops_dir).absolute()) if crops_dir is not None else None,
+            "config": self.config,
+        })
+        if crop_mode == "array":
+            for region in result.get("text_regions", []):
+                region["crop"] = _decode_data_uri(region.pop("cropped_base64"))
+        return result
+
+    def detect_text(self, image: np.ndarray) -> Dict[str, Any]:
+        return self.detect_many([image])[0]
+
+    def detect_many(self, images: List[np.ndarray]) -> List[Dict[str, Any]]:
+        """Same contract as CraftTextDetector.detect_many (BGR images)."""
+        if not images:
+            return []
+
+        refs = []
+        segments = []
+        try:
+            for image in images:
+                image = np.ascontiguousarray(image)
+                if self.use_shared_memory:
+                    shm = shared_memory.SharedMemory(create=True, size=max(1, image.nbytes))
+                    segments.append(shm)
+                    np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)[...] = image
+                    refs.append({"shm": shm.name, "shape": list(image.shape), "dtype": str(image.dtype)})
+                else:
+                    ok, buf = cv2.imencode(".png", image)
+                    if not ok:
+                        raise ValueError("Failed to encode image for CRAFT service")
+                    refs.append({"png_b64": base64.b64encode(buf.tobytes()).decode("utf-8")})
+            return self._post("/detect_many", {"images": refs, "config": self.config})["results"]
+        finally:
+            for shm in segments:
+                shm.close()
+                shm.unlink()
+
+
+def craft_runtime_config() -> Dict[str, Any]:
+    """
+    Runtime settings that change detections beyond the per-call config: the
+    inference backend and the default tile size, as used by the detector
+    create_text_detector() would return (the service reports its own).
+    """
+    config = {"backend": os.getenv("CRAFT_BACKEND", "eager"),
+              "tile_size": int(os.getenv("CRAFT_TILE_SIZE", "0")) or None}
+    service_url = os.getenv("CRAFT_SERVICE_URL")
+    if service_url:
+        try:
+            health = requests.get(f"{service_url.rstrip('/')}/health", timeout=2).json()
+            config = {key: health.get(key, value) for key, value in config.items()}
+        except (requests.RequestException, ValueError):
+            pass  # create_text_detector() falls back to in-process CRAFT as well
+    return config
+
+
+def create_text_detector(**kwargs):
+    """
+    CRAFT detector for pipeline stages.
+
+    Returns a RemoteCraftTextDetector when $CRAFT_SERVICE_URL is set and the
+    service answers, otherwise an in-process CraftTextDetector (torch is only
+    imported in that case). Settings outside CONFIG_KEYS (model_path, cuda, ...)
+    are decided by the service when running remotely.
+    """
+    service_url = os.getenv("CRAFT_SERVICE_URL")
+    if service_url:
+        remote = RemoteCraftTextDetector(
+            service_url, **{k: v for k, v in kwargs.items() if k in CONFIG_KEYS}
+        )
+        if remote.ping():
+            print(f"  > Using CRAFT service at {remote.service_url}")
+            return remote
+        print(f"  [Warning] CRAFT service at {service_url} not reachable, loading CRAFT in-process")
+
+    try:
+        from text_detector_craft_v4 import CraftTextDetector
+    except ImportError:
+        from pipeline_v4.text_detector_craft_v4 import CraftTextDetector
+    return CraftTextDetector(**kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Persistent CRAFT text detection service")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Bind address (default: localhost only)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=1, help="Worker threads running CRAFT batches")
+    parser.add_argument("--max-batch", type=int, default=8, help="Max images per batched CRAFT pass")
+    parser.add_argument("--batch-wait-ms", type=float, default=10.0,
+                        help="How long a worker waits to fill a batch")
+    parser.add_argument("--model-path", default=None, help="CRAFT weights (default: CRAFT-pytorch/craft_mlt_25k.pth)")
+    parser.add_argument("--cuda", action="store_true", help="Use GPU acceleration")
+    parser.add_argument("--backend", choices=["eager", "torchscript", "onnx", "int8"], default=None,
+                        help="CRAFT inference runtime (default: $CRAFT_BACKEND or eager)")
+    parser.add_argument("--backend-path", default=None, help="Compiled TorchScript/ONNX/int8 file")
+    parser.add_argument("--no-warmup", action="store_true", help="Load the model on the first request")
+    args = parser.parse_args()
+
+    serve(
+        host=args.host,
+        port=args.port,
+        warmup=not args.no_warmup,
+        workers=args.workers,
+        max_batch=args.max_batch,
+        batch_wait=args.batch_wait_ms / 1000.0,
+        model_path=args.model_path,
+        cuda=args.cuda,
+        backend=args.backend,
+        backend_path=args.backend_path,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -21,6 +21,9 @@ import cv2
 import numpy as np
 from pathlib import Path
 
+sys.path.append(str(Path(__file__).parent))
+from layer_storage_v4 import read_layer
+
 # Config
 ALPHA_FADE = 0.5  # How much to fade original image
 ERASE_COLOR = (0, 0, 255) # Red for erased pixels (BGR)
@@ -90,7 +93,7 @@ def generate_overlay(run_id, base_dir="pipeline_outputs"):
         if not c_path.exists(): continue
         
         # Load Cleaned Layer (RGBA)
-        cleaned_img = cv2.imread(str(c_path), cv2.IMREAD_UNCHANGED)
+        cleaned_img = read_layer(c_path)
         if cleaned_img.shape[2] != 4: continue
         
         # Resize to original if needed (should match if standard pipeline)
@@ -0,0 +1,261 @@
+"""
+fal.ai Queue Client V4
+======================
+Small client for fal.ai's queue API (submit -> poll status -> fetch result),
+used by run_qwen_layered_v4.
+
+- One pooled `requests.Session` per client: keep-alive connections are reused
+  for submission, every status poll and every result download instead of a new
+  TLS handshake per request.
+- Adaptive polling: starts short (most of a job's latency is a few seconds of
+  inference) and backs off exponentially up to a cap.
+- Connect/read timeouts on every request and an overall job deadline.
+- Parallel, streamed downloads of result files over the same pool (written to
+  disk chunk by chunk; optionally the bytes are kept for in-memory decoding).
+- Uploads to fal's CDN storage (initiate + PUT), so inputs can be passed as
+  URLs instead of base64 data URIs.
+- Configurable base URLs, so the client can be pointed at a local stand-in
+  server or a proxy.
+
+Config (env):
+    FAL_KEY                 API key (required for real calls)
+    FAL_BASE_URL            queue base URL (default: https://queue.fal.run)
+    FAL_STORAGE_URL         storage REST base URL (default: https://rest.alpha.fal.ai)
+    FAL_POLL_INITIAL        first poll interval in seconds (default: 0.25)
+    FAL_POLL_MAX            poll interval cap in seconds (default: 2.0)
+    FAL_JOB_TIMEOUT         max seconds to wait for one job (default: 600)
+"""
+
+import os
+import time
+import hashlib
+import threading
+import concurrent.futures
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+FAL_BASE_URL = os.getenv("FAL_BASE_URL", "https://queue.fal.run").rstrip("/")
+FAL_STORAGE_URL = os.getenv("FAL_STORAGE_URL", "https://rest.alpha.fal.ai").rstrip("/")
+
+POLL_INITIAL = float(os.getenv("FAL_POLL_INITIAL", "0.25"))
+POLL_MAX = float(os.getenv("FAL_POLL_MAX", "2.0"))
+POLL_BACKOFF = 1.5
+JOB_TIMEOUT = float(os.getenv("FAL_JOB_TIMEOUT", "600"))
+
+# (connect, read) seconds per HTTP request
+REQUEST_TIMEOUT = (10, 60)
+POOL_SIZE = 16
+DOWNLOAD_CHUNK = 1 << 16
+
+
+def poll_intervals(initial: float = None, maximum: float = None, factor: float = POLL_BACKOFF) -> Iterator[float]:
+    """Sleep durations between status polls: initial, initial*factor, ... capped at maximum."""
+    interval = initial or POLL_INITIAL
+    maximum = maximum or POLL_MAX
+    while True:
+        yield min(interval, maximum)
+        interval *= factor
+
+
+class FalJobError(RuntimeError):
+    """A fal.ai job failed or did not finish in time."""
+
+
+class JobDeadline:
+    """Overall time budget of one fal.ai job, started at construction."""
+
+    def __init__(self, timeout: float = None):
+        self.timeout = timeout or JOB_TIMEOUT
+        self.expires_at = time.monotonic() + self.timeout
+
+    def exceeded(self, wait: float = 0.0) -> bool:
+        """True if the budget is (or, after waiting `wait` more seconds, would be) used up."""
+        return time.monotonic() + wait > self.expires_at
+
+
+def submit_response(resp) -> Dict:
+    """Check a submit response (requests or httpx) and return fal's job dict (request_id, status/response URLs)."""
+    if resp.status_code != 200:
+        print(f"❌ Error: API Request Failed with status {resp.status_code}")
+        print(f"Details: {resp.text}")
+    resp.raise_for_status()
+    return resp.json()
+
+
+def job_done(job: Dict, status: Dict, deadline: JobDeadline, wait: float = 0.0) -> bool:
+    """
+    Interpret one status response; shared by every polling loop (sync, async, scheduler).
+
+    Args:
+        wait: Seconds until the next poll (fail now rather than sleep past the deadline)
+    Returns:
+        True once the job is COMPLETED, False while it is queued or running
+    Raises:
+        FalJobError if the job FAILED or the deadline is exceeded
+    """
+    if status["status"] == "COMPLETED":
+        return True
+    if status["status"] == "FAILED":
+        raise FalJobError(f"fal.ai job {job['request_id']} failed.")
+    if deadline.exceeded(wait):
+        raise FalJobError(f"fal.ai job {job['request_id']} not done after {deadline.timeout:.0f}s.")
+    return False
+
+
+class FalClient:
+    """
+    Pooled, thread-safe client for the fal.ai queue API.
+
+    Args:
+        key: API key (default: $FAL_KEY)
+        base_url: Queue base URL (default: $FAL_BASE_URL)
+        storage_url: Storage REST base URL (default: $FAL_STORAGE_URL)
+        pool_size: Max keep-alive connections per host (also the download parallelism)
+        timeout: (connect, read) timeout per request
+        job_timeout: Max seconds to wait for a job to complete
+    """
+
+    def __init__(self, key: str = None, base_url: str = None, storage_url: str = None, pool_size: int = POOL_SIZE,
+                 timeout=REQUEST_TIMEOUT, job_timeout: float = JOB_TIMEOUT):
+        self.key = key or os.getenv("FAL_KEY")
+        if not self.key:
+            raise RuntimeError("FAL_KEY not found. Set it in .env or environment variables.")
+        self.base_url = (base_url or FAL_BASE_URL).rstrip("/")
+        self.storage_url = (storage_url or FAL_STORAGE_URL).rstrip("/")
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.job_timeout = job_timeout
+
+        self.session = requests.Session()
+        # Transient 5xx / connection errors on idempotent GETs are retried by urllib3;
+        # POST (submission) is not, so a job is never submitted twice.
+        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(502, 503, 504), allowed_methods=("GET",))
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.headers = {"Authorization": f"Key {self.key}", "Content-Type": "application/json"}
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # -- queue API ------------------------------------------------------------
+
+    def endpoint(self, app: str) -> str:
+        return f"{self.base_url}/{app.strip('/')}"
+
+    def submit(self, app: str, payload: Dict) -> Dict:
+        """
+        Queue a job.
+
+        Returns:
+            fal's submit response (request_id, status_url, response_url)
+        """
+        resp = self.session.post(self.endpoint(app), headers=self.headers, json=payload, timeout=self.timeout)
+        return submit_response(resp)
+
+    def status(self, job: Dict) -> Dict:
+        """One status request (fal status: IN_QUEUE / IN_PROGRESS / COMPLETED)."""
+        resp = self.session.get(job["status_url"], headers=self.headers, timeout=self.timeout)
+        resp.raise_for_status()
+        return resp.json()
+
+    def wait(self, job: Dict) -> Dict:
+        """Poll the job's status with backoff until it completes; returns the final status."""
+        deadline = JobDeadline(self.job_timeout)
+        for interval in poll_intervals():
+            status = self.status(job)
+            if job_done(job, status, deadline, wait=interval):
+                return status
+            time.sleep(interval)
+
+    def result(self, job: Dict) -> Dict:
+        resp = self.session.get(job["response_url"], headers=self.headers, timeout=self.timeout)
+        resp.raise_for_status()
+        return resp.json()
+
+    def run(self, app: str, payload: Dict) -> Dict:
+        """submit + wait + result."""
+        job = self.submit(app, payload)
+        print(f"Request ID: {job['request_id']}")
+        self.wait(job)
+        return self.result(job)
+
+    # -- storage --------------------------------------------------------------
+
+    @property
+    def storage_scope(self) -> str:
+        """Storage endpoint + API key fingerprint; uploaded URLs are only reused within one scope."""
+        return f"{self.storage_url}|{hashlib.sha256(self.key.encode('utf-8')).hexdigest()[:16]}"
+
+    def upload(self, data: bytes, content_type: str, file_name: str) -> str:
+        """
+        Upload bytes to fal's CDN storage.
+
+        Returns:
+            Public file URL usable as a model input (e.g. `image_url`)
+        """
+        resp = self.session.post(
+            f"{self.storage_url}/storage/upload/initiate",
+            params={"storage_type": "fal-cdn-v3"},
+            headers=self.headers,
+            json={"content_type": content_type, "file_name": file_name},
+            timeout=self.timeout,
+        )
+        resp.raise_for_status()
+        target = resp.json()
+
+        put_resp = self.session.put(target["upload_url"], data=data, headers={"Content-Type": content_type},
+                                    timeout=self.timeout)
+        put_resp.raise_for_status()
+        return target["file_url"]
+
+    # -- downloads ------------------------------------------------------------
+
+    def download(self, url: str, save_path, keep_bytes: bool = False):
+        """
+        Stream a result file to disk (result URLs are public: no auth header).
+
+        Returns:
+            save_path, or the downloaded bytes if keep_bytes (the file is written either way)
+        """
+        save_path = Path(save_path)
+        data = bytearray() if keep_bytes else None
+        with self.session.get(url, timeout=self.timeout, stream=True) as resp:
+            resp.raise_for_status()
+            with open(save_path, "wb") as f:
+                for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK):
+                    f.write(chunk)
+                    if data is not None:
+                        data.extend(chunk)
+        return bytes(data) if keep_bytes else save_path
+
+    def download_many(self, urls: List[str], save_paths: List, keep_bytes: bool = False) -> List:
+        """Download files in parallel over the pooled session; results keep input order."""
+        if len(urls) <= 1:
+            return [self.download(u, p, keep_bytes) for u, p in zip(urls, save_paths)]
+        workers = min(len(urls), self.pool_size)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda u, p: self.download(u, p, keep_bytes), urls, save_paths))
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_fal_client() -> FalClient:
+    """Process-wide shared client (one connection pool for all jobs)."""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = FalClient()
+        return _default_client
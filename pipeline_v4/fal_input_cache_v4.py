@@ -0,0 +1,208 @@
+"""
+fal.ai Input Cache V4
+=====================
+Pass the Qwen input image by URL instead of inlining it as a base64 PNG in
+every request body.
+
+The input is resized (max 1280px, LANCZOS, as before), encoded and uploaded to
+fal storage once; the returned URL is reused for every later job on the same
+content (retries, resumed runs, variants with another `num_layers`). Keys are
+the sha256 of the input bytes plus the encode settings and the client's storage
+scope (storage URL + API key fingerprint, so a URL is never reused under another
+account or endpoint), stored in `<PIPELINE_CACHE_DIR>/fal_uploads.json` with a TTL.
+
+If uploading is disabled or fails, the image is inlined as a data URI. That is
+lossless PNG by default (exactly what Qwen received before); a faster, smaller
+JPEG/WebP at a configurable quality can be opted into. Inputs with an alpha
+channel always stay lossless (PNG, or lossless WebP), since JPEG would drop the
+alpha and change what Qwen sees. Inline data URIs are memoized per process, so
+retries do not re-encode.
+
+Config (env):
+    FAL_UPLOAD           1 = upload inputs (default), 0 = always inline
+    FAL_UPLOAD_TTL       seconds an uploaded URL is reused (default: 86400)
+    FAL_INLINE_FORMAT    png | jpeg | webp for inlined inputs (default: png)
+    FAL_INLINE_QUALITY   JPEG/WebP quality 1-100 (default: 95)
+"""
+
+import os
+import json
+import time
+import base64
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+try:
+    from fal_client_v4 import get_fal_client
+    from stage_checkpoints_v4 import file_digest
+    from layer_storage_v4 import PNG_COMPRESSION
+    from craft_heatmap_cache_v4 import PIPELINE_CACHE_DIR
+except ImportError:
+    from pipeline_v4.fal_client_v4 import get_fal_client
+    from pipeline_v4.stage_checkpoints_v4 import file_digest
+    from pipeline_v4.layer_storage_v4 import PNG_COMPRESSION
+    from pipeline_v4.craft_heatmap_cache_v4 import PIPELINE_CACHE_DIR
+
+MAX_INPUT_SIZE = 1280
+
+FAL_UPLOAD = os.getenv("FAL_UPLOAD", "1") != "0"
+UPLOAD_TTL = float(os.getenv("FAL_UPLOAD_TTL", "86400"))
+INLINE_FORMAT = os.getenv("FAL_INLINE_FORMAT", "png").lower()
+INLINE_QUALITY = int(os.getenv("FAL_INLINE_QUALITY", "95"))
+
+CONTENT_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+INLINE_MEMO_SIZE = 8
+
+
+def encode_input(image_path, fmt: str = "png", quality: int = INLINE_QUALITY) -> Tuple[bytes, str]:
+    """
+    Resize (max MAX_INPUT_SIZE px) and encode the input image.
+
+    Images with an alpha channel are never encoded lossily: "jpeg" falls back
+    to PNG and "webp" is lossless.
+
+    Returns:
+        (encoded bytes, content type)
+    """
+    fmt = fmt.lower()
+    if fmt not in CONTENT_TYPES:
+        raise ValueError(f"Unknown input format '{fmt}'. Choose from {list(CONTENT_TYPES)}")
+
+    with Image.open(image_path) as img:
+        # Resize if too large (max 1280px to be safe)
+        if max(img.size) > MAX_INPUT_SIZE:
+            ratio = MAX_INPUT_SIZE / max(img.size)
+            new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
+            img = img.resize(new_size, Image.Resampling.LANCZOS)
+
+        has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+        if fmt == "jpeg" and has_alpha:
+            fmt = "png"
+
+        buffered = BytesIO()
+        if fmt == "jpeg":
+            img.convert("RGB").save(buffered, format="JPEG", quality=quality)
+        elif fmt == "webp":
+            img.save(buffered, format="WEBP", quality=quality, method=0, lossless=has_alpha)
+        else:
+            img.save(buffered, format="PNG", compress_level=PNG_COMPRESSION)
+    return buffered.getvalue(), CONTENT_TYPES[fmt]
+
+
+def input_encoding() -> Dict:
+    """
+    Inline encode settings, i.e. what Qwen receives when the input is inlined
+    (part of the layer cache / checkpoint keys: a lossy input changes the layers).
+    """
+    fmt = INLINE_FORMAT
+    return {"inline_format": fmt, "inline_quality": INLINE_QUALITY if fmt != "png" else None}
+
+
+def to_data_uri(data: bytes, content_type: str) -> str:
+    return f"data:{content_type};base64,{base64.b64encode(data).decode('utf-8')}"
+
+
+class UploadCache:
+    """
+    JSON map of input key -> uploaded URL, with a TTL.
+
+    Writes are atomic (temp file + os.replace) and serialised within the process.
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, path=None, ttl: float = UPLOAD_TTL):
+        self.path = Path(path) if path else PIPELINE_CACHE_DIR / "fal_uploads.json"
+        self.ttl = ttl
+
+    def _read(self) -> Dict[str, Dict]:
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"  [UploadCache] Ignoring unreadable cache: {e}")
+            return {}
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._read().get(key)
+        if entry and time.time() - entry["uploaded_at"] < self.ttl:
+            return entry["url"]
+        return None
+
+    def put(self, key: str, url: str):
+        with self._lock:
+            cache = self._read()
+            now = time.time()
+            # Drop expired entries while we are rewriting the file anyway
+            cache = {k: v for k, v in cache.items() if now - v["uploaded_at"] < self.ttl}
+            cache[key] = {"url": url, "uploaded_at": now}
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_name(self.path.name + f".{os.getpid()}.tmp")
+            with open(tmp, "w") as f:
+                json.dump(cache, f, indent=2)
+            os.replace(tmp, self.path)
+
+
+_inline_memo = OrderedDict()
+_inline_memo_lock = threading.Lock()
+
+
+def inline_image_url(image_path, fmt: str = None, quality: int = None, digest: str = None) -> str:
+    """Input as a data URI (FAL_INLINE_FORMAT), memoized per content + settings."""
+    fmt, quality = (fmt or INLINE_FORMAT).lower(), quality or INLINE_QUALITY
+    key = f"{digest or file_digest(image_path)}|max={MAX_INPUT_SIZE}|{fmt}|q={quality}"
+    with _inline_memo_lock:
+        if key in _inline_memo:
+            _inline_memo.move_to_end(key)
+            return _inline_memo[key]
+
+    data_uri = to_data_uri(*encode_input(image_path, fmt, quality))
+    with _inline_memo_lock:
+        _inline_memo[key] = data_uri
+        while len(_inline_memo) > INLINE_MEMO_SIZE:
+            _inline_memo.popitem(last=False)
+    return data_uri
+
+
+def input_image_url(image_path, client=None, cache: UploadCache = None, upload: bool = None) -> str:
+    """
+    URL to pass as the Qwen `image_url` for `image_path`.
+
+    Uploaded once per content (cached URL reused until the TTL expires);
+    falls back to an inline data URI if uploading is disabled or fails.
+    """
+    digest = file_digest(image_path)
+    if not (FAL_UPLOAD if upload is None else upload):
+        return inline_image_url(image_path, digest=digest)
+
+    try:
+        client = client or get_fal_client()
+    except Exception as e:
+        print(f"  [Upload] No fal.ai client ({e}), inlining the input instead.")
+        return inline_image_url(image_path, digest=digest)
+
+    cache = cache or UploadCache()
+    key = f"{digest}|max={MAX_INPUT_SIZE}|png|{client.storage_scope}"
+    url = cache.get(key)
+    if url:
+        print(f"  [Upload] Reusing uploaded input: {url}")
+        return url
+
+    try:
+        data, content_type = encode_input(image_path, "png")
+        url = client.upload(data, content_type, f"{digest[:16]}.png")
+    except Exception as e:
+        print(f"  [Upload] Failed ({e}), inlining the input instead.")
+        return inline_image_url(image_path, digest=digest)
+
+    cache.put(key, url)
+    print(f"  [Upload] Uploaded input: {url}")
+    return url
@@ -0,0 +1,208 @@
+"""
+fal.ai Qwen Job Scheduler V4
+============================
+Overlaps Qwen Image Layered jobs across many images instead of running
+submit -> poll-until-done -> download one image at a time per thread.
+
+- submit() returns a concurrent.futures.Future immediately; the job is queued
+  locally and sent to fal as soon as an in-flight slot is free.
+- At most `max_in_flight` jobs are outstanding (submitting, in fal's queue,
+  running or downloading); the rest wait locally in FIFO order.
+- One polling thread tracks the status of every outstanding job, each on its
+  own backoff schedule (fal_client_v4.poll_intervals).
+- Input upload/submission and result downloads run on a small I/O pool, so
+  polling never waits on a transfer.
+- Finished layers are handed over as they complete: the future resolves to the
+  job's LayerHandles and optional callbacks fire (e.g. to enqueue cleaning).
+- Layer cache hits (layer_cache_v4) resolve without using a slot.
+
+Config (env):
+    FAL_MAX_IN_FLIGHT        max outstanding fal.ai jobs (default: 16)
+    FAL_SCHEDULER_WORKERS    upload/submit/download threads (default: 8)
+"""
+
+import os
+import time
+import threading
+import collections
+import concurrent.futures
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+try:
+    from fal_client_v4 import JobDeadline, get_fal_client, job_done, poll_intervals
+    from run_qwen_layered_v4 import cached_layers, submit_qwen_job, fetch_qwen_layers
+except ImportError:
+    from pipeline_v4.fal_client_v4 import JobDeadline, get_fal_client, job_done, poll_intervals
+    from pipeline_v4.run_qwen_layered_v4 import cached_layers, submit_qwen_job, fetch_qwen_layers
+
+
+class QwenJobScheduler:
+    """
+    Queue-aware scheduler for Qwen layering jobs on fal.ai (thread-safe).
+
+    Args:
+        client: FalClient (default: the shared pooled client, created on the first
+            actual fal.ai submission, so layer cache hits need no FAL_KEY)
+        max_in_flight: Max outstanding fal.ai jobs (default: $FAL_MAX_IN_FLIGHT)
+        workers: Threads for upload/submit/download (default: $FAL_SCHEDULER_WORKERS)
+
+    Usage:
+        with QwenJobScheduler() as scheduler:
+            futures = [scheduler.submit(img, out_dir) for img, out_dir in jobs]
+            for future in concurrent.futures.as_completed(futures):
+                layer_paths = future.result()
+    """
+
+    def __init__(self, client=None, max_in_flight: int = None, workers: int = None):
+        self._client = client
+        self.max_in_flight = max_in_flight or int(os.getenv("FAL_MAX_IN_FLIGHT", "16"))
+        self._io = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers or int(os.getenv("FAL_SCHEDULER_WORKERS", "8")), thread_name_prefix="fal-io"
+        )
+        self._cond = threading.Condition()
+        self._pending = collections.deque()  # Waiting for an in-flight slot
+        self._polling = []                   # Queued/running on fal
+        self._in_flight = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, name="fal-scheduler", daemon=True)
+        self._thread.start()
+
+    # -- public ---------------------------------------------------------------
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_fal_client()
+        return self._client
+
+    def submit(self, image_path, output_dir, num_layers: int = 2,
+               callback: Optional[Callable[[concurrent.futures.Future], None]] = None) -> concurrent.futures.Future:
+        """
+        Schedule layering of one image into `output_dir`.
+
+        Returns:
+            Future resolving to the list of LayerHandles (or raising the job's error)
+        """
+        future = concurrent.futures.Future()
+        if callback:
+            future.add_done_callback(callback)
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        job = {"image_path": str(image_path), "output_dir": output_dir, "num_layers": num_layers,
+               "future": future, "queued_at": time.monotonic()}
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("QwenJobScheduler is closed")
+            self._pending.append(job)
+            self._cond.notify()
+        return future
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {"pending": len(self._pending), "in_flight": self._in_flight, "polling": len(self._polling)}
+
+    def close(self, cancel_pending: bool = False):
+        """Stop accepting jobs and wait for the outstanding ones (optionally cancelling queued ones)."""
+        with self._cond:
+            self._closed = True
+            if cancel_pending:
+                while self._pending:
+                    self._pending.popleft()["future"].cancel()
+            self._cond.notify()
+        self._thread.join()
+        self._io.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.close(cancel_pending=exc_type is not None)
+
+    # -- scheduler loop (single thread) ---------------------------------------
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                # Admit queued jobs into free in-flight slots
+                while self._pending and self._in_flight < self.max_in_flight:
+                    job = self._pending.popleft()
+                    if not job["future"].set_running_or_notify_cancel():
+                        continue
+                    self._in_flight += 1
+                    self._io.submit(self._start, job)
+
+                if self._closed and not self._pending and self._in_flight == 0:
+                    return
+
+                now = time.monotonic()
+                due = [job for job in self._polling if job["next_poll"] <= now]
+                if not due:
+                    next_poll = min((job["next_poll"] for job in self._polling), default=None)
+                    self._cond.wait(None if next_poll is None else max(0.0, next_poll - now))
+                    continue
+
+            for job in due:
+                self._poll(job)
+
+    def _poll(self, job):
+        interval = next(job["intervals"])
+        try:
+            done = job_done(job["fal"], self.client.status(job["fal"]), job["deadline"], wait=interval)
+        except Exception as e:
+            self._untrack(job)
+            self._finish(job, error=e)
+            return
+
+        if done:
+            self._untrack(job)
+            self._io.submit(self._fetch, job)
+        else:
+            job["next_poll"] = time.monotonic() + interval
+
+    def _untrack(self, job):
+        with self._cond:
+            self._polling.remove(job)
+
+    # -- I/O pool -------------------------------------------------------------
+
+    def _start(self, job):
+        """Layer cache lookup, else upload input + submit to fal."""
+        try:
+            restored = cached_layers(job["image_path"], job["output_dir"], job["num_layers"])
+            if restored:
+                self._finish(job, result=restored)
+                return
+            job["fal"] = submit_qwen_job(job["image_path"], job["num_layers"], self.client)
+        except Exception as e:
+            self._finish(job, error=e)
+            return
+
+        job["intervals"] = poll_intervals()
+        job["deadline"] = JobDeadline(self.client.job_timeout)
+        job["next_poll"] = time.monotonic() + next(job["intervals"])
+        with self._cond:
+            self._polling.append(job)
+            self._cond.notify()
+
+    def _fetch(self, job):
+        try:
+            layers = fetch_qwen_layers(job["fal"], job["image_path"], job["output_dir"], job["num_layers"],
+                                       self.client)
+        except Exception as e:
+            self._finish(job, error=e)
+            return
+        self._finish(job, result=layers)
+
+    def _finish(self, job, result=None, error=None):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify()
+        # Resolve outside the lock: done-callbacks run in this thread
+        if error is not None:
+            print(f"  [Scheduler] {Path(job['image_path']).name}: failed: {error}")
+            job["future"].set_exception(error)
+        else:
+            print(f"  [Scheduler] {Path(job['image_path']).name}: {len(result)} layers ready "
+                  f"({time.monotonic() - job['queued_at']:.1f}s)")
+            job["future"].set_result(result)
@@ -7,6 +7,8 @@ Returns numeric font weights (100-900) instead of text labels
 
 import os
 import json
+import asyncio
+import hashlib
 from PIL import Image
 from google import genai
 from google.genai import types
@@ -224,21 +226,23 @@ def print_call_cost(usage):
     print(f"Estimated cost: ${cost:.6f}")
 
 
-def analyze_text_crops_batch(crop_image_paths: list) -> list:
-    """Analyze multiple crops in one call with enhanced weight detection."""
-    client = get_gemini_client()
-    images = [Image.open(p) for p in crop_image_paths]
+BATCH_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=MULTI_TEXT_SCHEMA,
+    temperature=0
+)
 
-    response = client.models.generate_content(
-        model=MODEL_NAME,
-        contents=[BATCH_PROMPT] + images,
-        config=types.GenerateContentConfig(
-            response_mime_type="application/json",
-            response_schema=MULTI_TEXT_SCHEMA,
-            temperature=0
-        )
-    )
-    
+
+def batch_analysis_config() -> dict:
+    """Model + prompt/schema version of the batch analysis (changes whenever either is edited)."""
+    prompt_version = hashlib.sha256(
+        json.dumps([BATCH_PROMPT, MULTI_TEXT_SCHEMA], sort_keys=True).encode("utf-8")
+    ).hexdigest()[:16]
+    return {"model": MODEL_NAME, "prompt_version": prompt_version}
+
+
+def _parse_batch_response(response) -> list:
+    """Cost log + JSON array parsing shared by the sync and async batch calls."""
     # Calculate cost
     if hasattr(response, 'usage_metadata'):
         print_call_cost(response.usage_metadata)
@@ -254,6 +258,47 @@ def analyze_text_crops_batch(crop_image_paths: list) -> list:
         return []
 
 
+def _load_crops(crop_image_paths: list) -> list:
+    images = []
+    for p in crop_image_paths:
+        with Image.open(p) as img:
+            img.load()
+            images.append(img.copy())
+    return images
+
+
+def analyze_text_crops_batch(crop_image_paths: list) -> list:
+    """Analyze multiple crops in one call with enhanced weight detection."""
+    client = get_gemini_client()
+    images = [Image.open(p) for p in crop_image_paths]
+
+    response = client.models.generate_content(
+        model=MODEL_NAME,
+        contents=[BATCH_PROMPT] + images,
+        config=BATCH_CONFIG
+    )
+    return _parse_batch_response(response)
+
+
+async def analyze_text_crops_batch_async(crop_image_paths: list) -> list:
+    """
+    asyncio version of analyze_text_crops_batch (same prompt, schema and output).
+
+    Uses the SDK's native async client (`client.aio`), so many images' Gemini
+    calls can be awaited concurrently from one event loop.
+    """
+    client = get_gemini_client()
+    # Decoding the crops is blocking file I/O -> off the event loop
+    images = await asyncio.to_thread(_load_crops, crop_image_paths)
+
+    response = await client.aio.models.generate_content(
+        model=MODEL_NAME,
+        contents=[BATCH_PROMPT] + images,
+        config=BATCH_CONFIG
+    )
+    return _parse_batch_response(response)
+
+
 # --------------------------------------------------
 # TEST
 # --------------------------------------------------
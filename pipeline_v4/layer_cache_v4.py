@@ -0,0 +1,182 @@
+"""
+Qwen Layer Cache V4
+===================
+On-disk cache of Qwen Image Layered results, consulted automatically by
+run_qwen_layered, so the same creative is never layered twice with the same
+settings (replaces hand-copying mock layer directories).
+
+Key = sha256(input image bytes hash + canonical JSON of the Qwen parameters:
+app, prompt, negative prompt, num_layers, num_inference_steps, guidance_scale,
+...). Anything that changes the generated layers changes the key.
+
+Layout:
+    <cache_dir>/<key>/0_layer_0.png, 1_layer_1.png, ...
+    <cache_dir>/<key>/meta.json      params, file names, total bytes
+
+Entries are written to a dot-prefixed temp dir and renamed into place; meta.json
+is written last, after the rename, so only entries with a meta.json are complete
+(readers and eviction ignore everything else). Restores copy to temp names and
+rename, so a failed restore leaves no partial layers behind. The cache is
+size-bounded: after each insert, least recently used entries (meta.json mtime,
+touched on every hit) are evicted until the total size fits the budget.
+
+Config (env):
+    QWEN_LAYER_CACHE_DIR     cache dir (default: <PIPELINE_CACHE_DIR>/qwen_layers,
+                             set to "" to disable)
+    QWEN_LAYER_CACHE_MAX_MB  size budget in MB (default: 2048)
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    from stage_checkpoints_v4 import file_digest, json_digest
+    from craft_heatmap_cache_v4 import PIPELINE_CACHE_DIR
+except ImportError:
+    from pipeline_v4.stage_checkpoints_v4 import file_digest, json_digest
+    from pipeline_v4.craft_heatmap_cache_v4 import PIPELINE_CACHE_DIR
+
+META_NAME = "meta.json"
+# Temp dirs / entries without meta.json older than this are leftovers of a dead writer
+STALE_SECONDS = 3600
+
+
+def layer_cache_key(image_path, params: Dict) -> str:
+    """Cache key: input bytes hash + canonical Qwen parameters."""
+    return hashlib.sha256(f"{file_digest(image_path)}|{json_digest(params)}".encode("utf-8")).hexdigest()[:32]
+
+
+class LayerCache:
+    """
+    Size-bounded LRU directory cache of layer files.
+
+    Args:
+        cache_dir: Root directory of the cache
+        max_bytes: Total size budget; LRU entries beyond it are evicted on insert
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, cache_dir, max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+
+    def get(self, key: str, output_dir) -> Optional[List[Path]]:
+        """
+        Copy a cached entry's layers into `output_dir`.
+
+        Returns:
+            Paths of the restored layers (in layer order), or None on a miss
+        """
+        entry = self.cache_dir / key
+        output_dir = Path(output_dir)
+        staged = []
+        with self._lock:
+            try:
+                with open(entry / META_NAME, "r") as f:
+                    meta = json.load(f)
+                for name in meta["files"]:
+                    # copyfile: the run dir gets its own file (reflinked where supported)
+                    tmp = output_dir / f".{name}.{os.getpid()}.{threading.get_ident()}.tmp"
+                    staged.append((tmp, output_dir / name))
+                    shutil.copyfile(entry / name, tmp)
+                for tmp, dst in staged:
+                    os.replace(tmp, dst)
+                os.utime(entry / META_NAME)  # LRU: mark as recently used
+            except (OSError, ValueError, KeyError):
+                for tmp, _ in staged:
+                    tmp.unlink(missing_ok=True)
+                return None
+        return [dst for _, dst in staged]
+
+    def put(self, key: str, layer_paths: List, params: Dict = None):
+        """Store layer files under `key` (no-op if the key is already cached), then evict."""
+        entry = self.cache_dir / key
+        if (entry / META_NAME).exists():
+            return
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.cache_dir / f".{key}.{os.getpid()}.{threading.get_ident()}.tmp"
+        tmp.mkdir(parents=True, exist_ok=True)
+        try:
+            names, total = [], 0
+            for p in layer_paths:
+                src = Path(p)
+                shutil.copyfile(src, tmp / src.name)
+                names.append(src.name)
+                total += src.stat().st_size
+            with self._lock:
+                if entry.exists():
+                    return  # Another writer stored the same key first
+                try:
+                    os.replace(tmp, entry)
+                except OSError:
+                    return  # ... from another process
+        finally:
+            if tmp.exists():
+                shutil.rmtree(tmp, ignore_errors=True)
+
+        # meta.json last: it marks the entry complete
+        meta_tmp = entry / f".{META_NAME}.{os.getpid()}.tmp"
+        with open(meta_tmp, "w") as f:
+            json.dump({"created_at": time.time(), "params": params or {}, "files": names, "bytes": total},
+                      f, indent=2)
+        os.replace(meta_tmp, entry / META_NAME)
+        self.evict()
+
+    def _entries(self):
+        """(last used, bytes, dir) of complete entries; stale incomplete dirs are removed."""
+        entries = []
+        now = time.time()
+        for entry in self.cache_dir.iterdir():
+            if not entry.is_dir():
+                continue
+            meta_path = entry / META_NAME
+            try:
+                if entry.name.startswith(".") or not meta_path.exists():
+                    # A put in progress (temp dir, or renamed but meta.json not written yet)
+                    if now - entry.stat().st_mtime > STALE_SECONDS:
+                        shutil.rmtree(entry, ignore_errors=True)
+                    continue
+                size = sum(f.stat().st_size for f in entry.iterdir() if f.is_file())
+                entries.append((meta_path.stat().st_mtime, size, entry))
+            except OSError:
+                continue  # Removed concurrently
+        return entries
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits max_bytes."""
+        with self._lock:
+            if not self.cache_dir.exists():
+                return
+            entries = sorted(self._entries(), key=lambda e: e[0])
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in entries:
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+                print(f"  [LayerCache] Evicted {entry.name} ({size / 1e6:.1f} MB)")
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_layer_cache() -> Optional[LayerCache]:
+    """Process-wide cache from env config (None if disabled)."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            cache_dir = os.getenv("QWEN_LAYER_CACHE_DIR", str(PIPELINE_CACHE_DIR / "qwen_layers"))
+            if not cache_dir:
+                return None
+            max_bytes = int(float(os.getenv("QWEN_LAYER_CACHE_MAX_MB", "2048")) * 1024 * 1024)
+            _default_cache = LayerCache(cache_dir, max_bytes)
+        return _default_cache
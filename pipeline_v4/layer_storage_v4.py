@@ -0,0 +1,220 @@
+"""
+Layer Storage V4
+================
+Single storage-format policy for intermediate images in a run directory
+(`layers/*_cleaned.*`, `layers/extracted_boxes/*`) plus fast PNG settings for
+final outputs.
+
+Formats:
+    png   PNG with a low zlib level (fast encode, default)
+    webp  Lossless WebP (smaller files, slower encode)
+    npy   Raw uncompressed NumPy arrays (no encode/decode at all; largest on disk)
+
+Arrays are always in OpenCV channel order (BGR / BGRA); PIL helpers convert.
+Readers dispatch on the file suffix, so runs written with different settings
+stay readable.
+
+A LayerHandle is a layer path that may also carry the already-decoded array
+(e.g. decoded from the downloaded bytes); read_layer() serves it from memory
+instead of reading and decoding the file again.
+
+Config (env):
+    PIPELINE_LAYER_FORMAT     png | webp | npy (default: png)
+    PIPELINE_PNG_COMPRESSION  zlib level 0-9 for PNG writes (default: 1)
+"""
+
+import os
+from pathlib import Path
+from typing import List, Union
+
+import cv2
+import numpy as np
+from PIL import Image
+
+LAYER_FORMATS = {"png": ".png", "webp": ".webp", "npy": ".npy"}
+LAYER_FORMAT = os.getenv("PIPELINE_LAYER_FORMAT", "png").lower()
+PNG_COMPRESSION = int(os.getenv("PIPELINE_PNG_COMPRESSION", "1"))
+
+PathLike = Union[str, Path, "LayerHandle"]
+
+
+class LayerHandle(os.PathLike):
+    """
+    A layer file on disk plus, optionally, its decoded BGR(A) array.
+
+    Behaves like a path (os.fspath, str, Path(handle)), so it can be passed
+    wherever layer paths are expected.
+    """
+
+    def __init__(self, path: PathLike, image: np.ndarray = None):
+        self.path = Path(path)
+        self.image = image
+
+    def __fspath__(self) -> str:
+        return str(self.path)
+
+    def __str__(self) -> str:
+        return str(self.path)
+
+    def __repr__(self) -> str:
+        return f"LayerHandle({str(self.path)!r}, in_memory={self.image is not None})"
+
+    @property
+    def name(self) -> str:
+        return self.path.name
+
+    def load(self, flags: int = cv2.IMREAD_UNCHANGED) -> np.ndarray:
+        """
+        The layer as an array: a copy of the in-memory one (callers may modify
+        it), or read from disk if none is held.
+        """
+        if self.image is None:
+            return read_layer(self.path, flags)
+        image = self.image
+        if flags == cv2.IMREAD_COLOR:
+            if image.ndim == 2:
+                return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+            if image.shape[2] == 4:
+                return cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+        return image.copy()
+
+    def release(self):
+        """Drop the in-memory array (the file stays)."""
+        self.image = None
+
+
+def get_layer_format(fmt: str = None) -> str:
+    """Resolve and validate a format name (None = configured default)."""
+    fmt = (fmt or LAYER_FORMAT).lower()
+    if fmt not in LAYER_FORMATS:
+        raise ValueError(f"Unknown layer format '{fmt}'. Choose from {list(LAYER_FORMATS)}")
+    return fmt
+
+
+def layer_format_of(path: PathLike) -> str:
+    """Format of an existing layer file, from its suffix."""
+    suffix = Path(path).suffix.lower()
+    for fmt, ext in LAYER_FORMATS.items():
+        if ext == suffix:
+            return fmt
+    raise ValueError(f"Not a layer file: {path}")
+
+
+def layer_path(path: PathLike, fmt: str = None) -> Path:
+    """
+    `path` with the suffix of the given (or default) format.
+
+    A known layer suffix (.png/.webp/.npy) is replaced; anything else is kept as
+    part of the name (`img.v2_layer_0` -> `img.v2_layer_0.png`).
+    """
+    path = Path(path)
+    ext = LAYER_FORMATS[get_layer_format(fmt)]
+    if path.suffix.lower() in LAYER_FORMATS.values():
+        return path.with_suffix(ext)
+    return path.with_name(path.name + ext)
+
+
+def list_layers(directory: PathLike, pattern: str = "*") -> List[Path]:
+    """Sorted layer files in `directory` matching `pattern` (without suffix), any format."""
+    directory = Path(directory)
+    files = []
+    for ext in LAYER_FORMATS.values():
+        files.extend(directory.glob(pattern + ext))
+    return sorted(files)
+
+
+# -----------------------------------------------------------------------------
+# OPENCV (numpy, BGR/BGRA)
+# -----------------------------------------------------------------------------
+
+def write_layer(path: PathLike, image: np.ndarray, fmt: str = None) -> Path:
+    """
+    Write a BGR/BGRA array in the given (or default) format.
+
+    Returns:
+        Path actually written (suffix follows the format)
+    """
+    fmt = get_layer_format(fmt)
+    out_path = layer_path(path, fmt)
+
+    if fmt == "npy":
+        np.save(out_path, np.ascontiguousarray(image))
+        return out_path
+
+    if fmt == "webp":
+        # Quality above 100 selects lossless WebP in OpenCV
+        params = [cv2.IMWRITE_WEBP_QUALITY, 101]
+    else:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]
+    if not cv2.imwrite(str(out_path), image, params):
+        raise IOError(f"Failed to write layer: {out_path}")
+    return out_path
+
+
+def decode_layer(data: bytes, flags: int = cv2.IMREAD_UNCHANGED) -> np.ndarray:
+    """Decode encoded image bytes (PNG/WebP/...) to a BGR/BGRA array (None if undecodable)."""
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+
+
+def read_layer(path: PathLike, flags: int = cv2.IMREAD_UNCHANGED) -> np.ndarray:
+    """
+    Read a layer as a BGR/BGRA array (None if missing/unreadable, like cv2.imread).
+    LayerHandles holding a decoded array are served from memory.
+
+    Args:
+        flags: cv2.IMREAD_UNCHANGED (keep alpha) or cv2.IMREAD_COLOR (BGR)
+    """
+    if isinstance(path, LayerHandle) and path.image is not None:
+        return path.load(flags)
+    path = Path(path)
+    if path.suffix.lower() != LAYER_FORMATS["npy"]:
+        return cv2.imread(str(path), flags)
+
+    try:
+        image = np.load(path)
+    except (OSError, ValueError):
+        return None
+    if flags == cv2.IMREAD_COLOR:
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        elif image.shape[2] == 4:
+            image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+    return image
+
+
+# -----------------------------------------------------------------------------
+# PIL
+# -----------------------------------------------------------------------------
+
+def open_layer_pil(path: PathLike) -> Image.Image:
+    """Open a layer as a PIL image (npy layers are converted from BGR(A))."""
+    path = Path(path)
+    if path.suffix.lower() != LAYER_FORMATS["npy"]:
+        return Image.open(path)
+
+    image = np.load(path)
+    if image.ndim == 3 and image.shape[2] == 4:
+        return Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGRA2RGBA))
+    if image.ndim == 3:
+        return Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    return Image.fromarray(image)
+
+
+def save_layer_pil(image: Image.Image, path: PathLike, fmt: str = None) -> Path:
+    """
+    Save a PIL image in the given (or default) format.
+
+    Returns:
+        Path actually written (suffix follows the format)
+    """
+    fmt = get_layer_format(fmt)
+    out_path = layer_path(path, fmt)
+
+    if fmt == "npy":
+        rgba = np.array(image.convert("RGBA"))
+        np.save(out_path, cv2.cvtColor(rgba, cv2.COLOR_RGBA2BGRA))
+    elif fmt == "webp":
+        image.save(out_path, format="WEBP", lossless=True)
+    else:
+        image.save(out_path, format="PNG", compress_level=PNG_COMPRESSION)
+    return out_path
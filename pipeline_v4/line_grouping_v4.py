@@ -0,0 +1,145 @@
+"""
+Line Grouping Engine V4
+=======================
+Array-based grouping of word boxes into text lines and horizontal merging of
+close words, used by CraftTextDetector._merge_close_regions.
+
+Region coordinates live in one NumPy structured array (x1, x2, y1, y2, cy,
+height). Line clustering walks the regions once in `cy` order keeping running
+sums of the current line's `cy`/height (instead of re-averaging the whole line
+for every region), and each line is merged in a single left-to-right sweep.
+The output matches the previous dict-based implementation polygon for polygon.
+"""
+
+from typing import List, Sequence
+
+import numpy as np
+
+LINE_TOLERANCE = 0.5   # |cy - line mean cy| < 0.5 * line mean height
+MERGE_GAP_RATIO = 1.5  # merge when horizontal gap < 1.5 * max height of the pair
+
+
+def regions_array(polys: Sequence[np.ndarray]) -> np.ndarray:
+    """
+    Build the structured region array for a list of polygons.
+
+    The coordinate dtype follows the polygons (float32 for CRAFT boxes), so the
+    running means below use the same arithmetic as the per-region values.
+    """
+    coord_dtype = np.result_type(*[np.asarray(p).dtype for p in polys])
+    region_dtype = np.dtype([(name, coord_dtype) for name in ("x1", "x2", "y1", "y2", "cy", "height")])
+    regions = np.empty(len(polys), dtype=region_dtype)
+
+    shapes = {np.shape(p) for p in polys}
+    if len(shapes) == 1:
+        pts = np.stack([np.asarray(p, dtype=coord_dtype) for p in polys])
+        mins, maxs = pts.min(axis=1), pts.max(axis=1)
+    else:
+        mins = np.array([np.asarray(p, dtype=coord_dtype).min(axis=0) for p in polys], dtype=coord_dtype)
+        maxs = np.array([np.asarray(p, dtype=coord_dtype).max(axis=0) for p in polys], dtype=coord_dtype)
+
+    regions["x1"], regions["y1"] = mins[:, 0], mins[:, 1]
+    regions["x2"], regions["y2"] = maxs[:, 0], maxs[:, 1]
+    regions["cy"] = (regions["y1"] + regions["y2"]) / 2
+    regions["height"] = regions["y2"] - regions["y1"]
+    return regions
+
+
+def group_lines(regions: np.ndarray, tolerance: float = LINE_TOLERANCE) -> List[np.ndarray]:
+    """
+    Cluster regions into lines by vertical centre.
+
+    Regions are visited in (stable) `cy` order; a region joins the current line
+    if its `cy` is within `tolerance` x the line's mean height of the line's mean
+    `cy`, otherwise it starts a new line. Means come from running sums, so the
+    whole pass is O(n) after the sort.
+
+    Returns:
+        List of index arrays into `regions`, one per line, in visiting order
+    """
+    if len(regions) == 0:
+        return []
+
+    cy, height = regions["cy"], regions["height"]
+    order = np.argsort(cy, kind="stable")
+
+    lines = []
+    start = 0
+    sum_cy, sum_h = cy[order[0]], height[order[0]]
+    for pos in range(1, len(order)):
+        i = order[pos]
+        count = pos - start
+        if abs(cy[i] - sum_cy / count) < (tolerance * (sum_h / count)):
+            sum_cy += cy[i]
+            sum_h += height[i]
+        else:
+            lines.append(order[start:pos])
+            start = pos
+            sum_cy, sum_h = cy[i], height[i]
+    lines.append(order[start:])
+    return lines
+
+
+def merge_line(regions: np.ndarray, line: np.ndarray, polys: Sequence[np.ndarray],
+               gap_ratio: float = MERGE_GAP_RATIO) -> List[np.ndarray]:
+    """
+    Merge horizontally close regions of one line in a single sweep.
+
+    Regions are swept left to right (stable on x1); a region is folded into the
+    running span when its gap to the span is below `gap_ratio` x the larger of
+    the two heights. Spans made of one region keep their original polygon;
+    merged spans become axis-aligned rectangles.
+    """
+    line = line[np.argsort(regions["x1"][line], kind="stable")]
+    x1, x2, y1, y2 = (regions[name][line] for name in ("x1", "x2", "y1", "y2"))
+    height = regions["height"][line]
+
+    out = []
+
+    def flush(first, sx1, sx2, sy1, sy2, merged):
+        if merged:
+            out.append(np.array([
+                [sx1, sy1], [sx2, sy1],
+                [sx2, sy2], [sx1, sy2]
+            ], dtype=np.float32))
+        else:
+            out.append(polys[line[first]])
+
+    first, merged = 0, False
+    sx1, sx2, sy1, sy2, sh = x1[0], x2[0], y1[0], y2[0], height[0]
+    for k in range(1, len(line)):
+        if (x1[k] - sx2) < (gap_ratio * max(sh, height[k])):
+            sx1, sx2 = min(sx1, x1[k]), max(sx2, x2[k])
+            sy1, sy2 = min(sy1, y1[k]), max(sy2, y2[k])
+            sh = sy2 - sy1
+            merged = True
+        else:
+            flush(first, sx1, sx2, sy1, sy2, merged)
+            first, merged = k, False
+            sx1, sx2, sy1, sy2, sh = x1[k], x2[k], y1[k], y2[k], height[k]
+    flush(first, sx1, sx2, sy1, sy2, merged)
+    return out
+
+
+def merge_close_polys(polys: Sequence[np.ndarray], tolerance: float = LINE_TOLERANCE,
+                      gap_ratio: float = MERGE_GAP_RATIO) -> List[np.ndarray]:
+    """
+    Merge close polygons that are likely on the same line.
+
+    Args:
+        polys: CRAFT polygons (None entries are ignored)
+        tolerance: Line clustering tolerance (fraction of mean line height)
+        gap_ratio: Max horizontal gap for merging (fraction of pair height)
+
+    Returns:
+        Merged polygons, line by line, left to right
+    """
+    polys = [p for p in polys if p is not None]
+    if not polys:
+        return []
+
+    regions = regions_array(polys)
+    final_polys = []
+    for line in group_lines(regions, tolerance):
+        final_polys.extend(merge_line(regions, line, polys, gap_ratio))
+    return final_polys
@@ -0,0 +1,89 @@
+"""
+Logo Refinement V4
+==================
+V4.7 Logo Proximity Protection, vectorized.
+
+Text sitting right next to a detected logo (a tagline under a wordmark, the
+second line of a two-line logo, ...) is usually part of the logo and must not
+be erased and re-rendered. A region is promoted to "logo" when, for some logo
+region:
+    - the vertical gap between the two boxes is <= LOGO_MAX_GAP px
+    - their horizontal centers differ by <= LOGO_CENTER_TOLERANCE x the wider box
+    - it is at most LOGO_MAX_HEIGHT_RATIO x the logo's height
+
+All logo x region pairs are tested at once with NumPy broadcasting over the
+bbox arrays. The input role map is never modified; a new map is returned.
+"""
+
+import copy
+from typing import Dict, List
+
+import numpy as np
+
+LOGO_MAX_GAP = 20
+LOGO_CENTER_TOLERANCE = 0.5
+LOGO_MAX_HEIGHT_RATIO = 2
+
+
+def bbox_array(regions: List[Dict]) -> np.ndarray:
+    """(N, 4) float array of [x, y, width, height] from CRAFT regions."""
+    return np.array(
+        [[r["bbox"]["x"], r["bbox"]["y"], r["bbox"]["width"], r["bbox"]["height"]] for r in regions],
+        dtype=np.float64,
+    ).reshape(-1, 4)
+
+
+def logo_proximity_matrix(boxes: np.ndarray, logo_mask: np.ndarray) -> np.ndarray:
+    """
+    Args:
+        boxes: (N, 4) [x, y, w, h]
+        logo_mask: (N,) bool, True for logo regions
+    Returns:
+        (L, N) bool: [i, j] is True if region j is close enough to the i-th logo
+        (logos themselves are never candidates)
+    """
+    logos = boxes[logo_mask][:, None, :]   # (L, 1, 4)
+    others = boxes[None, :, :]             # (1, N, 4)
+    lx, ly, lw, lh = (logos[..., k] for k in range(4))
+    ox, oy, ow, oh = (others[..., k] for k in range(4))
+
+    # Vertical gap between the boxes (0 when they overlap vertically)
+    gap = np.maximum(np.maximum(oy - (ly + lh), ly - (oy + oh)), 0)
+    center_delta = np.abs((lx + lw / 2) - (ox + ow / 2))
+
+    near = gap <= LOGO_MAX_GAP
+    aligned = center_delta <= np.maximum(lw, ow) * LOGO_CENTER_TOLERANCE
+    not_taller = oh <= lh * LOGO_MAX_HEIGHT_RATIO
+    return near & aligned & not_taller & ~logo_mask[None, :]
+
+
+def refine_logo_roles(regions: List[Dict], g_map: Dict[str, Dict]) -> Dict[str, Dict]:
+    """
+    Promote regions next to a logo to the "logo" role.
+
+    Args:
+        regions: CRAFT text regions (need "id" and "bbox")
+        g_map: region id (str) -> Gemini analysis dict
+    Returns:
+        New region id -> analysis map (entries are copies; `g_map` is untouched).
+        Only ids already present in `g_map` are updated.
+    """
+    refined = copy.deepcopy(g_map)
+    if not regions:
+        return refined
+
+    rids = [str(r["id"]) for r in regions]
+    logo_mask = np.array([g_map.get(rid, {}).get("role", "") == "logo" for rid in rids], dtype=bool)
+    if not logo_mask.any():
+        return refined
+
+    match = logo_proximity_matrix(bbox_array(regions), logo_mask)
+    logo_ids = [rids[i] for i in np.flatnonzero(logo_mask)]
+    for j in np.flatnonzero(match.any(axis=0)):
+        rid = rids[j]
+        print(f"  [Logo Protection] Region {rid} near Logo {logo_ids[int(match[:, j].argmax())]}. "
+              f"Encouraging 'logo' role.")
+        if rid in refined:
+            refined[rid]["role"] = "logo"
+    return refined
+
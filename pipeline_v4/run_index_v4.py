@@ -0,0 +1,124 @@
+"""
+Run Index V4
+============
+Content-addressed run directories for the layered pipeline.
+
+A run is keyed by the sha256 of the input image bytes plus the pipeline config,
+so its directory name (`run_<key>_layered`) is deterministic: uploading the same
+creative twice maps to the same run, and two uploads in the same second no
+longer collide.
+
+`pipeline_outputs/run_index.json` maps run keys to their directory, input and
+config. It is used to answer "has this input been processed?" and to find a
+sibling run of the same input (different config) to branch from.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+try:
+    from stage_checkpoints_v4 import json_digest, CHECKPOINT_DIRNAME
+except ImportError:
+    from pipeline_v4.stage_checkpoints_v4 import json_digest, CHECKPOINT_DIRNAME
+
+RUN_INDEX_NAME = "run_index.json"
+RUN_KEY_LENGTH = 16
+
+
+def make_run_key(input_hash: str, config: Dict[str, Any]) -> str:
+    """Run key = hash(input bytes hash + canonical pipeline config)."""
+    return hashlib.sha256(f"{input_hash}|{json_digest(config)}".encode("utf-8")).hexdigest()[:RUN_KEY_LENGTH]
+
+
+def run_dir_for(output_base, run_key: str) -> Path:
+    return Path(output_base) / f"run_{run_key}_layered"
+
+
+class RunIndex:
+    """
+    JSON index of content-addressed runs under `output_base`.
+
+    Writes are atomic (temp file + os.replace) and serialised within the
+    process. The index is only a lookup aid: entries whose directory is gone
+    are ignored.
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, output_base="pipeline_outputs"):
+        self.output_base = Path(output_base)
+        self.path = self.output_base / RUN_INDEX_NAME
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"  [RunIndex] Ignoring unreadable index: {e}")
+            return {}
+
+    def _write(self, index: Dict[str, Dict[str, Any]]):
+        self.output_base.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + f".{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def get(self, run_key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._read().get(run_key)
+        if entry and Path(entry["run_dir"]).exists():
+            return entry
+        return None
+
+    def find_by_input(self, input_hash: str) -> List[Dict[str, Any]]:
+        """Existing runs of the same input (any config), most recent first."""
+        with self._lock:
+            entries = [dict(entry, run_key=key) for key, entry in self._read().items()
+                       if entry.get("input_hash") == input_hash]
+        entries = [e for e in entries if Path(e["run_dir"]).exists()]
+        return sorted(entries, key=lambda e: e.get("created_at", 0), reverse=True)
+
+    def record(self, run_key: str, **fields):
+        """Create or update the entry for `run_key`."""
+        with self._lock:
+            index = self._read()
+            entry = index.get(run_key, {"created_at": time.time()})
+            entry.update(fields)
+            entry["updated_at"] = time.time()
+            index[run_key] = entry
+            self._write(index)
+
+
+def branch_run(source_dir, target_dir):
+    """
+    Seed a new run dir from a sibling run of the same input.
+
+    Copies checkpoints, crops and the raw Qwen layers; each stage then reuses
+    its checkpoint only if its deps (config) still match, so e.g. a different
+    layer format re-runs cleaning but not CRAFT/Gemini/Qwen.
+    """
+    source_dir, target_dir = Path(source_dir), Path(target_dir)
+    target_dir.mkdir(parents=True, exist_ok=True)
+
+    for name in (CHECKPOINT_DIRNAME, "crops"):
+        if (source_dir / name).exists():
+            # box_detection belongs to the sibling's final layers, never to a fresh branch
+            shutil.copytree(source_dir / name, target_dir / name, dirs_exist_ok=True,
+                            ignore=shutil.ignore_patterns("box_detection.json"))
+
+    layers_src = source_dir / "layers"
+    if layers_src.exists():
+        (target_dir / "layers").mkdir(exist_ok=True)
+        for f in layers_src.iterdir():
+            # Cleaned layers may already carry box-detection holes; let cleaning redo them
+            if f.is_file() and "_cleaned" not in f.stem:
+                shutil.copy2(f, target_dir / "layers" / f.name)
@@ -0,0 +1,327 @@
+"""
+Batch Pipeline V4
+=================
+Runs the full v4 pipeline (Layering -> Box Detection -> Text Rendering) over
+many creatives as a staged pipeline instead of one image after another:
+
+    [feeder] -> q -> CRAFT (CPU pool)
+             -> q -> Gemini + Qwen (I/O pool)
+             -> q -> Cleaning + Box Detection + Rendering (CPU pool)
+
+- Qwen jobs are submitted to a QwenJobScheduler (fal_scheduler_v4) as soon as
+  an item enters the CRAFT stage, so fal's GPUs work on many images while
+  CRAFT runs; the I/O stage then just waits for that item's layers.
+
+- Backpressure: the queues between stages are bounded, so a slow stage blocks
+  its upstream instead of piling up work (and open files) in memory.
+- Retries: a failing stage is retried per item with exponential backoff.
+  Stages are checkpointed (stage_checkpoints_v4), so a retry only redoes the
+  work that did not complete.
+- Summary: one JSON report with per-item status, attempts, timings and errors.
+
+Input is a folder of images or a JSONL manifest, one item per line:
+    {"image": "path/to/creative.png", "id": "optional-name"}
+("image_path" / "path" are accepted too; a bare JSON string is a path.)
+
+Config (env, overridable by CLI flags):
+    PIPELINE_BATCH_CPU_WORKERS   CRAFT / finishing workers per stage (default: 2)
+    PIPELINE_BATCH_IO_WORKERS    concurrent Gemini + Qwen items (default: 8)
+    PIPELINE_BATCH_QUEUE_SIZE    max items waiting between stages (default: 2x IO workers)
+    PIPELINE_BATCH_RETRIES       extra attempts per stage (default: 2)
+    FAL_MAX_IN_FLIGHT            outstanding Qwen jobs on fal.ai (default: 16)
+
+Usage:
+    python pipeline_v4/run_pipeline_batch_v4.py image/ --summary batch_summary.json
+    python pipeline_v4/run_pipeline_batch_v4.py creatives.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+import traceback
+import concurrent.futures
+from pathlib import Path
+
+# -----------------------------------------------------------------------------
+# SETUP PATHS
+# -----------------------------------------------------------------------------
+current_dir = Path(__file__).parent
+sys.path.append(str(current_dir))
+sys.path.append(os.path.join(os.path.dirname(__file__), "rendering"))
+
+from run_pipeline_layered_v4 import (
+    start_layered_run, finish_layered_run, stage_craft, stage_gemini, stage_layers, layers_checkpoint_deps
+)
+from fal_scheduler_v4 import QwenJobScheduler
+from run_pipeline_box_detection_v4 import run_box_detection_pipeline
+from stage_checkpoints_v4 import file_digest
+from run_pipeline_v4 import render_final
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+# Queue marker: no more items for this stage
+_STOP = object()
+
+# -----------------------------------------------------------------------------
+# INPUT
+# -----------------------------------------------------------------------------
+
+def load_batch_items(source: str) -> list:
+    """
+    Items from a folder of images or a JSONL manifest.
+
+    Returns:
+        List of {"id", "image"} dicts, in folder (sorted) / manifest order
+    """
+    source = Path(source)
+    items = []
+    if source.is_dir():
+        for f in sorted(source.iterdir()):
+            if f.is_file() and f.suffix.lower() in IMAGE_EXTENSIONS:
+                items.append({"id": f.stem, "image": str(f)})
+        return items
+
+    with open(source, "r") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if isinstance(entry, str):
+                entry = {"image": entry}
+            image = entry.get("image") or entry.get("image_path") or entry.get("path")
+            if not image:
+                print(f"  [Batch] Manifest line {line_no}: no image path, skipped")
+                continue
+            items.append({"id": str(entry.get("id", Path(image).stem)), "image": image})
+    return items
+
+# -----------------------------------------------------------------------------
+# STAGES (one item each; raise to trigger a retry)
+# -----------------------------------------------------------------------------
+
+def _stage_craft(item, options):
+    ctx = item["_ctx"]
+    image_path = Path(item["image"])
+    if not image_path.exists():
+        raise FileNotFoundError(f"{image_path} not found")
+
+    run = start_layered_run(image_path, options["mock_layers_dir"], options["resume"])
+    ctx["run"] = run
+    item["run_dir"] = str(run["run_dir"])
+    if run["complete"]:
+        return
+
+    # Start Qwen now (it only needs the input image) unless its checkpoint is still valid
+    scheduler = options["scheduler"]
+    deps = layers_checkpoint_deps(run["input_hash"], options["mock_layers_dir"])
+    if scheduler and "qwen_future" not in ctx and not run["checkpoints"].load("layers", deps=deps):
+        ctx["qwen_future"] = scheduler.submit(image_path, run["run_dir"] / "layers")
+
+    ctx["craft_result"], ctx["craft_hash"] = stage_craft(image_path, run["run_dir"], run["checkpoints"],
+                                                         run["input_hash"])
+
+def _stage_external(item, options):
+    ctx = item["_ctx"]
+    run = ctx["run"]
+    if run["complete"]:
+        return
+    run_dir, checkpoints = run["run_dir"], run["checkpoints"]
+    crops_dir, layers_dir = run_dir / "crops", run_dir / "layers"
+
+    def qwen(image_path, out_dir):
+        # The job submitted in the CRAFT stage; a retry submits a fresh one
+        future = ctx.pop("qwen_future", None) or options["scheduler"].submit(image_path, out_dir)
+        return future.result()
+
+    # Same shape as run_pipeline_layered: Gemini and Qwen side by side
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        future_gemini = executor.submit(stage_gemini, crops_dir, checkpoints, ctx["craft_hash"])
+        future_qwen = executor.submit(stage_layers, item["image"], layers_dir, checkpoints, run["input_hash"],
+                                      options["mock_layers_dir"], qwen if options["scheduler"] else None)
+        gemini_results = future_gemini.result()
+        layer_paths, layers_hash = future_qwen.result()
+
+    # The stages log and swallow provider errors; surface them here so they are retried
+    if not layer_paths:
+        raise RuntimeError("Qwen produced no layers")
+    if not gemini_results and any(crops_dir.glob("*.png")):
+        raise RuntimeError("Gemini analysis failed")
+    ctx["gemini_results"], ctx["layer_paths"], ctx["layers_hash"] = gemini_results, layer_paths, layers_hash
+
+def _stage_finish(item, options):
+    ctx = item["_ctx"]
+    run = ctx["run"]
+    if not run["complete"]:
+        finish_layered_run(run, item["image"], ctx["craft_result"], ctx["craft_hash"], ctx["gemini_results"],
+                           ctx["layer_paths"], ctx["layers_hash"], options["mock_layers_dir"])
+    run_box_detection_pipeline(item["run_dir"])
+    out_path = render_final(item["run_dir"])
+    if out_path is None:
+        raise RuntimeError("Rendering produced no image")
+    item["final_image"] = str(out_path)
+
+BATCH_STAGES = [
+    # (name, function, pool)
+    ("craft", _stage_craft, "cpu"),
+    ("gemini_qwen", _stage_external, "io"),
+    ("finish", _stage_finish, "cpu"),
+]
+
+# -----------------------------------------------------------------------------
+# RUNNER
+# -----------------------------------------------------------------------------
+
+def _run_with_retries(name, fn, item, options):
+    """True if the stage succeeded within the retry budget (errors are recorded on the item)."""
+    retries, delay = options["retries"], options["retry_delay"]
+    for attempt in range(retries + 1):
+        item["attempts"][name] = attempt + 1
+        t0 = time.time()
+        try:
+            fn(item, options)
+            item["timings"][name] = round(time.time() - t0, 3)
+            return True
+        except Exception as e:
+            item["timings"][name] = round(time.time() - t0, 3)
+            item["errors"].append({"stage": name, "attempt": attempt + 1, "error": f"{type(e).__name__}: {e}"})
+            print(f"  [Batch] {item['id']}: {name} failed (attempt {attempt + 1}/{retries + 1}): {e}")
+            if options["verbose"]:
+                traceback.print_exc()
+            if attempt < retries:
+                time.sleep(delay * (2 ** attempt))
+    return False
+
+def _stage_worker(name, fn, inbox, outbox, options):
+    while True:
+        item = inbox.get()
+        if item is _STOP:
+            return
+        if _run_with_retries(name, fn, item, options):
+            if outbox is not None:
+                outbox.put(item)  # Blocks while the next stage is saturated (backpressure)
+            else:
+                item["status"] = "done"
+                print(f"  [Batch] {item['id']}: done -> {item.get('final_image')}")
+        else:
+            item["status"] = "failed"
+            item["failed_stage"] = name
+
+def run_batch(items, cpu_workers: int = None, io_workers: int = None, queue_size: int = None,
+              retries: int = None, retry_delay: float = 2.0, mock_layers_dir: str = None,
+              resume: bool = True, verbose: bool = False) -> dict:
+    """
+    Run the full pipeline over `items` (see load_batch_items) as a staged pipeline.
+
+    Returns:
+        Summary dict: counts, wall time and one entry per item (input order)
+    """
+    cpu_workers = cpu_workers or int(os.getenv("PIPELINE_BATCH_CPU_WORKERS", "2"))
+    io_workers = io_workers or int(os.getenv("PIPELINE_BATCH_IO_WORKERS", "8"))
+    queue_size = queue_size or int(os.getenv("PIPELINE_BATCH_QUEUE_SIZE", "0")) or 2 * io_workers
+    if retries is None:
+        retries = int(os.getenv("PIPELINE_BATCH_RETRIES", "2"))
+    # Mock layers are local copies -> nothing to schedule on fal. The scheduler only
+    # creates its fal.ai client (and needs FAL_KEY) once a job is actually submitted
+    scheduler = None if mock_layers_dir else QwenJobScheduler()
+    options = {"retries": retries, "retry_delay": retry_delay, "mock_layers_dir": mock_layers_dir,
+               "resume": resume, "verbose": verbose, "scheduler": scheduler}
+    pool_sizes = {"cpu": cpu_workers, "io": io_workers}
+
+    for item in items:
+        item.update({"status": "pending", "run_dir": None, "attempts": {}, "timings": {}, "errors": [],
+                     "_ctx": {}})
+
+    print(f"[Batch] {len(items)} items | CPU workers: {cpu_workers} | I/O workers: {io_workers} | "
+          f"queue: {queue_size} | retries: {retries}")
+    t_start = time.time()
+
+    queues = [queue.Queue(maxsize=queue_size) for _ in BATCH_STAGES]
+    stage_threads = []
+    for i, (name, fn, pool) in enumerate(BATCH_STAGES):
+        outbox = queues[i + 1] if i + 1 < len(BATCH_STAGES) else None
+        threads = [
+            threading.Thread(target=_stage_worker, args=(name, fn, queues[i], outbox, options),
+                             name=f"batch-{name}-{n}", daemon=True)
+            for n in range(pool_sizes[pool])
+        ]
+        for t in threads:
+            t.start()
+        stage_threads.append(threads)
+
+    # Feed (blocks when the first stage is saturated), then drain stage by stage.
+    # Items with identical bytes share one content-addressed run dir, so only the
+    # first one is processed.
+    first_by_hash, duplicates = {}, []
+    for item in items:
+        if Path(item["image"]).is_file():
+            original = first_by_hash.setdefault(file_digest(item["image"]), item)
+            if original is not item:
+                item["duplicate_of"] = original["id"]
+                duplicates.append((item, original))
+                continue
+        queues[0].put(item)
+    for i, threads in enumerate(stage_threads):
+        for _ in threads:
+            queues[i].put(_STOP)
+        for t in threads:
+            t.join()
+    if scheduler:
+        scheduler.close()
+
+    for item, original in duplicates:
+        for key in ("status", "run_dir", "final_image", "failed_stage"):
+            if key in original:
+                item[key] = original[key]
+    for item in items:
+        item.pop("_ctx", None)
+    done = sum(1 for item in items if item["status"] == "done")
+    summary = {
+        "total": len(items),
+        "done": done,
+        "failed": len(items) - done,
+        "wall_time_s": round(time.time() - t_start, 2),
+        "config": {"cpu_workers": cpu_workers, "io_workers": io_workers, "queue_size": queue_size,
+                   "retries": retries, "mock_layers_dir": mock_layers_dir, "resume": resume},
+        "items": items,
+    }
+    print(f"[Batch] Finished: {done}/{len(items)} done, {summary['failed']} failed "
+          f"in {summary['wall_time_s']}s")
+    return summary
+
+# -----------------------------------------------------------------------------
+# ENTRY POINT
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the v4 pipeline over a folder or JSONL manifest")
+    parser.add_argument("source", help="Folder of images or JSONL manifest")
+    parser.add_argument("--summary", default="pipeline_outputs/batch_summary.json", help="Summary JSON path")
+    parser.add_argument("--cpu-workers", type=int, default=None)
+    parser.add_argument("--io-workers", type=int, default=None)
+    parser.add_argument("--queue-size", type=int, default=None)
+    parser.add_argument("--retries", type=int, default=None)
+    parser.add_argument("--mock-layers", default=None, help="Use pre-existing layers instead of Qwen")
+    parser.add_argument("--no-resume", action="store_true", help="Recompute every stage")
+    parser.add_argument("--verbose", action="store_true", help="Print tracebacks of failed attempts")
+    args = parser.parse_args()
+
+    batch_items = load_batch_items(args.source)
+    if not batch_items:
+        print(f"No images found in {args.source}")
+        sys.exit(1)
+
+    result = run_batch(batch_items, cpu_workers=args.cpu_workers, io_workers=args.io_workers,
+                       queue_size=args.queue_size, retries=args.retries, mock_layers_dir=args.mock_layers,
+                       resume=not args.no_resume, verbose=args.verbose)
+
+    summary_path = Path(args.summary)
+    summary_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(summary_path, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Summary saved to: {summary_path}")
+    sys.exit(0 if result["failed"] == 0 else 1)
@@ -32,14 +32,18 @@ DEBUG_SAVE_EDGES = True     # Save edge detection debug images
 # CORE FUNCTIONS
 # -----------------------------------------------------------------------------
 
-# Import CraftTextDetector
 current_dir = Path(__file__).parent
 sys.path.append(str(current_dir))
+
+from layer_storage_v4 import read_layer, open_layer_pil, save_layer_pil, layer_format_of
+from stage_checkpoints_v4 import StageCheckpoints, file_digest
+
+# Import CRAFT detector factory (CRAFT service client or in-process CraftTextDetector)
 try:
-    from text_detector_craft_v4 import CraftTextDetector
+    from craft_service_v4 import create_text_detector
 except ImportError:
     print("Warning: Could not import CraftTextDetector. Local box cleaning may fail.")
-    CraftTextDetector = None
+    create_text_detector = None
 
 def detect_boxes_in_layer(layer_path: str, text_regions: List[Dict], 
                           layer_scale: Tuple[float, float] = (1.0, 1.0)) -> List[Dict]:
@@ -60,7 +64,7 @@ def detect_boxes_in_layer(layer_path: str, text_regions: List[Dict],
         List of detected box dicts with 'bbox', 'color', 'contains_regions'
     """
     # Load the layer
-    layer = cv2.imread(layer_path, cv2.IMREAD_UNCHANGED)
+    layer = read_layer(layer_path)
     if layer is None:
         print(f"  ! Could not load layer: {layer_path}")
         return []
@@ -372,16 +376,28 @@ def run_box_detection_pipeline(run_dir: str):
     
     with open(report_path, "r") as f:
         report = json.load(f)
+    
+    # Box extraction punches holes into the cleaned layers in place, so running it
+    # twice on the same layers would detect on already-holed layers. Skip when the
+    # checkpoint shows it was applied to exactly the current layers/report.
+    checkpoints = StageCheckpoints(run_path)
+    box_deps = {"report": file_digest(report_path)}
+    if checkpoints.load("box_detection", deps=box_deps):
+        print("Box detection already applied to this run's layers, skipping.")
+        return
         
     # Initialize global CRAFT detector for local box cleaning
     craft_detector = None
-    if CraftTextDetector:
+    if create_text_detector:
         # Check for model weights
         weights_path = Path(current_dir).parent / "CRAFT-pytorch" / "craft_mlt_25k.pth"
         if weights_path.exists():
             print(f"Loading CRAFT for local box cleaning from {weights_path}...")
             # Use CPU by default for safety, or check torch.cuda.is_available() inside class
-            craft_detector = CraftTextDetector(model_path=str(weights_path)) 
+            try:
+                craft_detector = create_text_detector(model_path=str(weights_path))
+            except ImportError as e:
+                print(f"Warning: Could not load CraftTextDetector ({e}). Local box cleaning disabled.")
         else:
             print(f"CRAFT weights not found at {weights_path}")
     
@@ -417,7 +433,7 @@ def run_box_detection_pipeline(run_dir: str):
             continue
         
         # Get layer dimensions for scaling
-        layer_img = cv2.imread(str(cleaned_layer_path), cv2.IMREAD_UNCHANGED)
+        layer_img = read_layer(cleaned_layer_path)
         if layer_img is None:
             continue
         
@@ -438,16 +454,19 @@ def run_box_detection_pipeline(run_dir: str):
             original_layer_path = layers_dir / original_layer_name
             if original_layer_path.exists():
                 from PIL import Image, ImageDraw
-                orig_layer_img = Image.open(original_layer_path).convert("RGBA")
+                orig_layer_img = open_layer_pil(original_layer_path).convert("RGBA")
                 
                 # Load cleaned layer for erasure (making hole in background)
-                cleaned_layer_pil = Image.open(cleaned_layer_path).convert("RGBA")
+                cleaned_layer_pil = open_layer_pil(cleaned_layer_path).convert("RGBA")
                 modified_cleaned = False
                 
                 # Create extracted_boxes directory
                 extracted_dir = layers_dir / "extracted_boxes"
                 extracted_dir.mkdir(exist_ok=True)
                 
+                # 1. Crop every box region from the original layer first, so local
+                #    CRAFT cleaning can run on all crops in one batched call.
+                box_crops = []
                 for idx, box in enumerate(boxes):
                     # USE RAW LAYER COORDINATES (Fixes rounding drift)
                     if "layer_bbox" in box:
@@ -469,73 +488,74 @@ def run_box_detection_pipeline(run_dir: str):
                     bh = min(bh, layer_h - by)
                     
                     if bw > 0 and bh > 0:
-                        # 1. Crop the box region from original layer
                         box_img = orig_layer_img.crop((bx, by, bx + bw, by + bh))
+                        box_crops.append((box, box_img, (bx, by, bw, bh)))
+                
+                # 2. LOCAL CLEANING: Run CRAFT on all crops (batched inference)
+                local_reports = [None] * len(box_crops)
+                if craft_detector and box_crops:
+                    # Convert to numpy for CRAFT (RGB)
+                    # PIL is RGB (if convert('RGB') used) or RGBA. 
+                    # Convert to RGB array for CRAFT
+                    box_arrays = [np.array(box_img.convert("RGB")) for _, box_img, _ in box_crops]
+                    local_reports = craft_detector.detect_many(box_arrays)
+                
+                for (box, box_img, (bx, by, bw, bh)), local_report in zip(box_crops, local_reports):
+                    if craft_detector:
+                        local_regions = local_report.get("regions", [])
                         
-                        # 2. LOCAL CLEANING: Run CRAFT on this crop
-                        if craft_detector:
-                            # Convert to numpy for CRAFT (RGB)
-                            # PIL is RGB (if convert('RGB') used) or RGBA. 
-                            # Convert to RGB array for CRAFT
-                            box_rgb = box_img.convert("RGB")
-                            box_cv = np.array(box_rgb)
-
-                            # print(f"     [Cleaning] Running local CRAFT on box {idx}...")
-                            local_report = craft_detector.detect_text(box_cv)
-                            local_regions = local_report.get("regions", [])
-                            
-                            # Prepare drawing
-                            draw_box = ImageDraw.Draw(box_img)
-                            
-                            # Parse detected color
-                            try:
-                                c_hex = box.get("color", "#000000")
-                                r = int(c_hex[1:3], 16)
-                                g = int(c_hex[3:5], 16)
-                                b = int(c_hex[5:7], 16)
-                                fill_color = (r, g, b, 255)
-                            except:
-                                fill_color = (0, 0, 0, 255)
-                            
-                            erased_count = 0
-                            for l_reg in local_regions:
-                                # Get polygon from local detection
-                                poly = l_reg.get("polygon")
-                                if poly:
-                                    # Poly is already in box local coords
-                                    # Convert list of lists to list of tuples
-                                    draw_box.polygon([tuple(p) for p in poly], fill=fill_color)
-                                    erased_count += 1
-                                    
-                            if erased_count > 0:
-                                print(f"     [Cleaning] Erased {erased_count} local text regions from box using {c_hex}")
-                            else:
-                                print("     [Cleaning] No text found locally to erase.")
-
-                        else:
-                            # Fallback to erasing known global regions if CRAFT fails loading
-                            print("     [Warning] CRAFT not available for local cleaning, skipping.")
-
-                        # Save with unique name
-                        region_ids = "_".join(map(str, box["contains_regions"]))
-                        box_filename = f"box_region_{region_ids}.png"
-                        box_path = extracted_dir / box_filename
-                        box_img.save(box_path)
-                        
-                        # Store the path in box metadata
-                        box["extracted_image"] = str(box_path.relative_to(run_path))
-                        box["layer_bbox"] = {"x": bx, "y": by, "width": bw, "height": bh}
+                        # Prepare drawing
+                        draw_box = ImageDraw.Draw(box_img)
                         
-                        print(f"     - Extracted box for regions {box['contains_regions']} -> {box_filename}")
+                        # Parse detected color
+                        try:
+                            c_hex = box.get("color", "#000000")
+                            r = int(c_hex[1:3], 16)
+                            g = int(c_hex[3:5], 16)
+                            b = int(c_hex[5:7], 16)
+                            fill_color = (r, g, b, 255)
+                        except:
+                            fill_color = (0, 0, 0, 255)
                         
-                        # 3. ERASE from Background (Cleaned Layer)
-                        # We overwrite the region with 0 alpha
-                        cleaned_layer_pil.paste((0, 0, 0, 0), (bx, by, bx + bw, by + bh))
-                        modified_cleaned = True
-                        print(f"     - Erased box region from background layer")
+                        erased_count = 0
+                        for l_reg in local_regions:
+                            # Get polygon from local detection
+                            poly = l_reg.get("polygon")
+                            if poly:
+                                # Poly is already in box local coords
+                                # Convert list of lists to list of tuples
+                                draw_box.polygon([tuple(p) for p in poly], fill=fill_color)
+                                erased_count += 1
+                                
+                        if erased_count > 0:
+                            print(f"     [Cleaning] Erased {erased_count} local text regions from box using {c_hex}")
+                        else:
+                            print("     [Cleaning] No text found locally to erase.")
+
+                    else:
+                        # Fallback to erasing known global regions if CRAFT fails loading
+                        print("     [Warning] CRAFT not available for local cleaning, skipping.")
+
+                    # Save with unique name
+                    region_ids = "_".join(map(str, box["contains_regions"]))
+                    box_path = save_layer_pil(box_img, extracted_dir / f"box_region_{region_ids}")
+                    box_filename = box_path.name
+                    
+                    # Store the path in box metadata
+                    box["extracted_image"] = str(box_path.relative_to(run_path))
+                    box["layer_bbox"] = {"x": bx, "y": by, "width": bw, "height": bh}
+                    
+                    print(f"     - Extracted box for regions {box['contains_regions']} -> {box_filename}")
+                    
+                    # 3. ERASE from Background (Cleaned Layer)
+                    # We overwrite the region with 0 alpha
+                    cleaned_layer_pil.paste((0, 0, 0, 0), (bx, by, bx + bw, by + bh))
+                    modified_cleaned = True
+                    print(f"     - Erased box region from background layer")
                 
                 if modified_cleaned:
-                    cleaned_layer_pil.save(cleaned_layer_path)
+                    # Rewrite in place, keeping the format the report already points to
+                    save_layer_pil(cleaned_layer_pil, cleaned_layer_path, fmt=layer_format_of(cleaned_layer_path))
                     print(f"     [UPDATE] Saved {cleaned_layer_name} with transparent holes.")
 
         for box in boxes:
@@ -566,6 +586,11 @@ def run_box_detection_pipeline(run_dir: str):
         json.dump(report, f, indent=2)
     
     print(f"\nSaved: {output_report_path}")
+    
+    produced_files = [layers_dir / entry["cleaned_layer"] for entry in layer_info if entry.get("cleaned_layer")]
+    produced_files += [run_path / box["extracted_image"] for box in all_boxes if box.get("extracted_image")]
+    produced_files.append(output_report_path)
+    checkpoints.save("box_detection", report["box_detection"], files=produced_files, deps=box_deps)
     print("=" * 60)
     print("BOX DETECTION COMPLETE")
     print("=" * 60)
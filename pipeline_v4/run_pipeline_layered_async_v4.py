@@ -0,0 +1,198 @@
+"""
+Layered Pipeline V4 (asyncio)
+=============================
+asyncio-native driver for the layered pipeline, for running many images from
+one process.
+
+Per image the stages are the same as run_pipeline_layered (same checkpoints,
+same run dirs, same report), but:
+- Gemini (client.aio) and Qwen/fal.ai (httpx) calls are awaited instead of
+  blocking a thread, so dozens of images' external calls can be in flight.
+- CPU stages (CRAFT, cleaning + residue check) run in worker threads.
+- Each provider has its own concurrency limit.
+
+Config (env):
+    GEMINI_MAX_CONCURRENCY    concurrent Gemini batch calls (default: 16)
+    FAL_MAX_CONCURRENCY       concurrent fal.ai jobs, submit -> download (default: 16)
+    PIPELINE_CPU_CONCURRENCY  concurrent CRAFT / cleaning jobs (default: 2)
+
+Usage:
+    python pipeline_v4/run_pipeline_layered_async_v4.py img1.png img2.png ...
+"""
+
+import os
+import sys
+import asyncio
+import argparse
+from pathlib import Path
+
+import httpx
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+try:
+    from run_pipeline_layered_v4 import (
+        start_layered_run, finish_layered_run, stage_craft, stage_layers, layers_checkpoint_deps,
+        gemini_checkpoint_deps, gemini_results_for
+    )
+    from stage_checkpoints_v4 import file_digest
+    from gemini_text_analysis_pro_v4 import analyze_text_crops_batch_async
+    from run_qwen_layered_v4 import run_qwen_layered_async
+except ImportError:
+    from pipeline_v4.run_pipeline_layered_v4 import (
+        start_layered_run, finish_layered_run, stage_craft, stage_layers, layers_checkpoint_deps,
+        gemini_checkpoint_deps, gemini_results_for
+    )
+    from pipeline_v4.stage_checkpoints_v4 import file_digest
+    from pipeline_v4.gemini_text_analysis_pro_v4 import analyze_text_crops_batch_async
+    from pipeline_v4.run_qwen_layered_v4 import run_qwen_layered_async
+
+
+class ProviderLimits:
+    """
+    Per-provider concurrency limits for one event loop.
+
+    Explicit arguments override the env defaults.
+    """
+
+    def __init__(self, gemini: int = None, fal: int = None, cpu: int = None):
+        self.gemini = asyncio.Semaphore(gemini or int(os.getenv("GEMINI_MAX_CONCURRENCY", "16")))
+        self.fal = asyncio.Semaphore(fal or int(os.getenv("FAL_MAX_CONCURRENCY", "16")))
+        self.cpu = asyncio.Semaphore(cpu or int(os.getenv("PIPELINE_CPU_CONCURRENCY", "2")))
+
+
+# ----------------------------------------------------------------------
+# ASYNC STAGES (same checkpoints as the sync stages)
+# ----------------------------------------------------------------------
+
+async def stage_gemini_async(crops_dir, checkpoints, craft_hash, limits):
+    """STEP 2 via the async Gemini client (see stage_gemini)."""
+    deps = gemini_checkpoint_deps(craft_hash)
+    cached = checkpoints.load("gemini", deps=deps)
+    if cached:
+        return cached["data"]
+
+    crop_files = sorted(list(crops_dir.glob("*.png")))
+    results = []
+    if crop_files:
+        try:
+            async with limits.gemini:
+                print(f"  [Gemini] Analyzing {len(crop_files)} crops ({crops_dir.parent.name})...")
+                analysis_list = await analyze_text_crops_batch_async([str(p) for p in crop_files])
+            results = gemini_results_for(crop_files, analysis_list)
+        except Exception as e:
+            print(f"  [Gemini] Failed ({crops_dir.parent.name}): {e}")
+    else:
+        print("  [Gemini] No crops to analyze.")
+
+    # Only successful analyses are checkpointed, so a failed call is retried on resume
+    if results:
+        checkpoints.save("gemini", results, deps=deps)
+    return results
+
+async def stage_layers_async(image_path, layers_dir, checkpoints, input_hash, limits, client,
+                             mock_layers_dir=None):
+    """STEP 3 via async fal.ai submit/poll/download (see stage_layers)."""
+    if mock_layers_dir:
+        # Mock layers are a local copy -> the sync stage in a thread is enough
+        return await asyncio.to_thread(stage_layers, image_path, layers_dir, checkpoints, input_hash,
+                                       mock_layers_dir)
+
+    deps = layers_checkpoint_deps(input_hash)
+    cached = checkpoints.load("layers", deps=deps)
+    if cached:
+        return [str(layers_dir / name) for name in cached["data"]["layers"]], cached["data_hash"]
+
+    paths = []
+    try:
+        async with limits.fal:
+            paths = await run_qwen_layered_async(str(image_path), layers_dir, client)
+    except Exception as e:
+        print(f"  [Qwen] Failed ({Path(image_path).name}): {e}")
+
+    layers_hash = None
+    if paths:
+        layers_hash = checkpoints.save("layers", {"layers": [Path(p).name for p in paths]}, files=paths, deps=deps)
+    return paths, layers_hash
+
+# ----------------------------------------------------------------------
+# DRIVERS
+# ----------------------------------------------------------------------
+
+async def run_pipeline_layered_async(image_path_str: str, mock_layers_dir: str = None, resume: bool = True,
+                                     limits: ProviderLimits = None, client: httpx.AsyncClient = None) -> str:
+    """
+    asyncio version of run_pipeline_layered (same run dir, checkpoints and report).
+
+    Args:
+        limits: Shared ProviderLimits (default: a private one from env)
+        client: Shared httpx.AsyncClient for fal.ai (default: one per job)
+    Returns:
+        str: Path to the run directory
+    """
+    image_path = Path(image_path_str)
+    if not image_path.exists():
+        raise FileNotFoundError(f"Error: {image_path} not found")
+    limits = limits or ProviderLimits()
+
+    run = await asyncio.to_thread(start_layered_run, image_path, mock_layers_dir, resume)
+    run_dir, checkpoints, input_hash = run["run_dir"], run["checkpoints"], run["input_hash"]
+    if run["complete"]:
+        return str(run_dir)
+    print(f"Starting LAYERED pipeline V4 (async) for: {image_path.name} -> {run_dir}")
+
+    # Qwen only needs the input image, so it starts before CRAFT finishes
+    layers_task = asyncio.create_task(stage_layers_async(
+        image_path, run_dir / "layers", checkpoints, input_hash, limits, client, mock_layers_dir
+    ))
+    try:
+        async with limits.cpu:
+            craft_result, craft_hash = await asyncio.to_thread(stage_craft, image_path, run_dir, checkpoints,
+                                                               input_hash)
+        gemini_results = await stage_gemini_async(run_dir / "crops", checkpoints, craft_hash, limits)
+        layer_paths, layers_hash = await layers_task
+    except BaseException:
+        layers_task.cancel()
+        raise
+
+    async with limits.cpu:
+        return await asyncio.to_thread(finish_layered_run, run, image_path, craft_result, craft_hash,
+                                       gemini_results, layer_paths, layers_hash, mock_layers_dir)
+
+async def run_many_layered_async(image_paths, mock_layers_dir: str = None, resume: bool = True,
+                                 limits: ProviderLimits = None) -> list:
+    """
+    Run the layered pipeline on many images concurrently in this event loop.
+
+    Returns:
+        One entry per input, in order: the run dir (str), or the exception raised
+        for that image (one failing image does not cancel the others).
+    """
+    limits = limits or ProviderLimits()
+    async with httpx.AsyncClient(timeout=httpx.Timeout(60.0)) as client:
+        # Same input bytes twice -> one run (same run dir; both entries share the result)
+        keys = [file_digest(p) if Path(p).exists() else str(p) for p in image_paths]
+        tasks = {}
+        for key, p in zip(keys, image_paths):
+            if key not in tasks:
+                tasks[key] = asyncio.ensure_future(
+                    run_pipeline_layered_async(p, mock_layers_dir, resume, limits, client)
+                )
+        results = dict(zip(tasks, await asyncio.gather(*tasks.values(), return_exceptions=True)))
+    return [results[key] for key in keys]
+
+def run_many_layered(image_paths, mock_layers_dir: str = None, resume: bool = True) -> list:
+    """Blocking entry point for run_many_layered_async."""
+    return asyncio.run(run_many_layered_async(image_paths, mock_layers_dir, resume))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the layered pipeline on many images (asyncio)")
+    parser.add_argument("images", nargs="+", help="Input images")
+    parser.add_argument("--mock-layers", default=None, help="Use pre-existing layers instead of Qwen")
+    parser.add_argument("--no-resume", action="store_true", help="Recompute every stage")
+    args = parser.parse_args()
+
+    outcomes = run_many_layered(args.images, args.mock_layers, resume=not args.no_resume)
+    for image, outcome in zip(args.images, outcomes):
+        status = f"FAILED: {outcome}" if isinstance(outcome, BaseException) else outcome
+        print(f"{image} -> {status}")
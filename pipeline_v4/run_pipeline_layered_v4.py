@@ -5,6 +5,9 @@ Layered Pipeline V4 with Qwen + CRAFT + Gemini
 2. Gemini: Classify regions (Keep vs Remove)
 3. Qwen: Split image into layers (Text, Logo, UI, Base)
 4. Cleanup: Erase "Remove" text pixels from Qwen layers deterministically
+
+Each stage is checkpointed under <run_dir>/checkpoints (see stage_checkpoints_v4),
+so a rerun on the same input resumes from the last completed stage.
 """
 
 import os
@@ -12,7 +15,9 @@ import sys
 import time
 import cv2
 import json
+import shutil
 import argparse
+import concurrent.futures
 import numpy as np
 from pathlib import Path
 from dotenv import load_dotenv
@@ -23,14 +28,22 @@ sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
 # Import stages (Updated for v4)
 try:
-    from text_detector_craft_v4 import CraftTextDetector
-    from gemini_text_analysis_pro_v4 import analyze_text_crops_batch
-    from run_qwen_layered_v4 import run_qwen_layered
+    from craft_service_v4 import create_text_detector, craft_runtime_config
+    from layer_storage_v4 import LayerHandle, get_layer_format, layer_path, read_layer, write_layer
+    from stage_checkpoints_v4 import StageCheckpoints, file_digest, json_digest
+    from run_index_v4 import RunIndex, make_run_key, run_dir_for, branch_run
+    from logo_refinement_v4 import refine_logo_roles
+    from gemini_text_analysis_pro_v4 import analyze_text_crops_batch, batch_analysis_config
+    from run_qwen_layered_v4 import run_qwen_layered, qwen_config
 except ImportError:
     # Fallback if running from root relative
-    from pipeline_v4.text_detector_craft_v4 import CraftTextDetector
-    from pipeline_v4.gemini_text_analysis_pro_v4 import analyze_text_crops_batch
-    from pipeline_v4.run_qwen_layered_v4 import run_qwen_layered
+    from pipeline_v4.craft_service_v4 import create_text_detector, craft_runtime_config
+    from pipeline_v4.layer_storage_v4 import LayerHandle, get_layer_format, layer_path, read_layer, write_layer
+    from pipeline_v4.stage_checkpoints_v4 import StageCheckpoints, file_digest, json_digest
+    from pipeline_v4.run_index_v4 import RunIndex, make_run_key, run_dir_for, branch_run
+    from pipeline_v4.logo_refinement_v4 import refine_logo_roles
+    from pipeline_v4.gemini_text_analysis_pro_v4 import analyze_text_crops_batch, batch_analysis_config
+    from pipeline_v4.run_qwen_layered_v4 import run_qwen_layered, qwen_config
 
 load_dotenv()
 
@@ -38,156 +51,252 @@ def get_layer_scale(orig_w, orig_h, layer_w, layer_h):
     if orig_w == 0 or orig_h == 0: return 0, 0
     return layer_w / orig_w, layer_h / orig_h
 
-def clean_layers(layer_paths, output_dir, global_craft_result, gemini_results, orig_size, original_img=None):
+# Dilation applied around every erased polygon to catch anti-aliased edges
+ERASURE_KERNEL = np.ones((2, 2), np.uint8)
+
+def erase_polygons_alpha(alpha, polygons):
     """
-    Refined Layer Cleaning Logic (V4.2 High-Res Gating):
-    1.  **Global Mapping**: Use global CRAFT boxes.
-    2.  **High-Res Pixel Gating**: 
-        - Crop from **ORIGINAL IMAGE** (High Precision).
-        - Run CRAFT on high-res crop (`merge_lines=False`).
-        - Map detected polygons -> Layer Coordinates.
-        - Erase on Layer.
-    3.  **Layer 0 Protection**: SACRED.
+    Region-level erasure engine: zero `alpha` under each polygon (+ 2x2 dilation).
+
+    Each polygon is rasterized only inside its bounding ROI (grown by one pixel
+    right/bottom, which is how far the 2x2 kernel reaches) and the alpha ROI is
+    cleared in place, so the cost scales with text area instead of layer size.
+    Equivalent to filling one full-frame mask, dilating it and applying it once.
+
+    Args:
+        alpha: (H, W) uint8 alpha plane, modified in place
+        polygons: List of (N, 2) int32 polygons in layer coordinates
     """
-    cleaned_paths = []
-    cleaning_report = []
+    h, w = alpha.shape[:2]
+    for poly in polygons:
+        x0, y0 = max(0, int(poly[:, 0].min())), max(0, int(poly[:, 1].min()))
+        x1, y1 = min(w, int(poly[:, 0].max()) + 2), min(h, int(poly[:, 1].max()) + 2)
+        if x1 <= x0 or y1 <= y0:
+            continue
+
+        roi_mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        cv2.fillPoly(roi_mask, [poly - np.array([x0, y0], dtype=np.int32)], 255)
+        roi_mask = cv2.dilate(roi_mask, ERASURE_KERNEL, iterations=1)
+        alpha[y0:y1, x0:x1][roi_mask == 255] = 0
+
+# Roles configuration
+# V4.15 UPDATE: 'usp' is REMOVED to prevent double-rendering (ghosting) inside boxes.
+# We will FORCE render it in the rendering stage to handle floating USPs.
+PRESERVE_ROLES = ["product_text", "logo", "ui_element", "label", "icon"]
+REMOVE_ROLES   = ["heading", "subheading", "body", "cta", "usp"]
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+def _passthrough_layer(src, dst):
+    """
+    Preserve a layer unchanged as `dst` without a PNG decode/re-encode.
+
+    When the layer storage format is PNG, PNG sources are copied byte for byte
+    (copyfile uses the kernel copy path and reflinks where the filesystem
+    supports it). A hardlink is deliberately not used: box detection later
+    rewrites *_cleaned layers in place, which would also modify the Qwen
+    original. Other sources/formats are transcoded via layer_storage_v4.
+
+    Returns:
+        "copy", "transcode", or "failed"
+    """
+    with open(src, "rb") as f:
+        is_png = f.read(len(PNG_SIGNATURE)) == PNG_SIGNATURE
+    if is_png and get_layer_format() == "png":
+        shutil.copyfile(src, dst)
+        return "copy"
+
+    img = read_layer(src)
+    if img is None:
+        return "failed"
+    write_layer(dst, img)
+    return "transcode"
+
+def _clean_single_layer(src_layer, output_dir, text_regions, gemini_map, orig_w, orig_h):
+    """
+    Clean one Qwen layer (read -> erase -> write in the layer storage format).
+
+    Args:
+        src_layer: Layer path, or a LayerHandle (its in-memory array is used, no decode)
+
+    Returns:
+        (cleaned_path, report_entry), or None if the layer is missing/unreadable
+    """
+    path = Path(src_layer)
+    if not path.exists(): return None
+        
+    print(f"  > Processing layer: {path.name}")
+    
+    # RULE 1: Skip Layer 0
+    if "layer_0" in path.name.lower():
+        print("    [Info] Layer 0 is Background -> PROTECTED")
+        cleaned_path = layer_path(output_dir / (path.stem + "_cleaned"))
+        cleaned_filename = cleaned_path.name
+        method = _passthrough_layer(src_layer, cleaned_path)
+        
+        return str(cleaned_path), {
+            "original_layer": path.name,
+            "cleaned_layer": cleaned_filename,
+            "status": "preserved",
+            "action": "none (background)",
+            "regions_removed": 0,
+            "passthrough": method,
+            "byte_identical": method == "copy"
+        }
+
+    # Process Overlay Layers
+    raw_img = read_layer(src_layer)
+    if raw_img is None: return None
+    
+    # Ensure RGBA
+    if raw_img.shape[2] == 3: raw_img = cv2.cvtColor(raw_img, cv2.COLOR_BGR2BGRA)
+    
+    h, w = raw_img.shape[:2]
+    sx, sy = get_layer_scale(orig_w, orig_h, w, h)
+    print(f"    @ Scale: x={sx:.3f}, y={sy:.3f} (Resolution: {w}x{h})")
 
-    # Roles configuration
-    # Roles configuration
-    # V4.15 UPDATE: 'usp' is REMOVED to prevent double-rendering (ghosting) inside boxes.
-    # We will FORCE render it in the rendering stage to handle floating USPs.
-    PRESERVE_ROLES = ["product_text", "logo", "ui_element", "label", "icon"]
-    REMOVE_ROLES   = ["heading", "subheading", "body", "cta", "usp"]
+    erase_polys = []
     
-    # Initialize detector for LOCAL PIXEL GATING
-    # CRITICAL: merge_lines=False
-    print("  [Init] Loading CRAFT for pixel gating (High-Res Mode)...")
-    detector = CraftTextDetector(cuda=False, merge_lines=False, link_threshold=0.2, text_threshold=0.6, low_text=0.35)
+    # V4.8 FIX: Atomic Erasure (Erase-All, Render-Once)
+    # Trust Global CRAFT Polygon completely. No local re-detection.
+    
+    for region in text_regions:
+        rid = str(region["id"])
+        role = gemini_map.get(rid, {}).get("role", "body").lower().strip()
+        
+        # 1. Logic: Only remove "Removable" roles
+        if role not in REMOVE_ROLES: continue
+        
+        # 2. Logic: Atomic Erasure of Global Polygon
+        # Use POLYGON from Global Detection (High Precision)
+        g_poly = np.array(region["polygon"], dtype=np.float32) # Shape (N, 2)
+        
+        # Scale to Layer Coordinates
+        # (Global X * sx = Layer X)
+        l_poly = g_poly.copy()
+        l_poly[:, 0] *= sx
+        l_poly[:, 1] *= sy
+        erase_polys.append(l_poly.astype(np.int32))
+        
+    regions_removed = len(erase_polys)
+
+    # 3. Apply Erasure (in place, per region ROI)
+    if regions_removed > 0:
+        # Dilation: Moderate to catch anti-aliasing (Atomic means wipe it ALL)
+        erase_polygons_alpha(raw_img[:, :, 3], erase_polys)
+        
+        log = f"atomic_erasure (removed {regions_removed} regions)"
+        print(f"    -> {path.name}: {log}")
+    else:
+        log = "no_erasures"
+        print(f"    -> {path.name}: No regions matched.")
+
+    # Save
+    cleaned_path = write_layer(output_dir / (path.stem + "_cleaned"), raw_img)
+    cleaned_filename = cleaned_path.name
     
+    return str(cleaned_path), {
+        "original_layer": path.name,
+        "cleaned_layer": cleaned_filename,
+        "status": "cleaned" if regions_removed > 0 else "preserved",
+        "action": log,
+        "regions_removed": regions_removed
+    }
+
+def clean_layers(layer_paths, output_dir, global_craft_result, gemini_results, orig_size, original_img=None,
+                 max_workers=None):
+    """
+    Layer Cleaning Logic (V4.8 Atomic Erasure):
+    1.  **Global Mapping**: Use global CRAFT polygons (no local re-detection).
+    2.  **Role Gating**: Only REMOVE_ROLES regions (per Gemini) are erased.
+    3.  **Region-Level Erasure**: Polygons are scaled to layer coordinates and
+        erased from the alpha channel ROI by ROI (see erase_polygons_alpha).
+    4.  **Layer 0 Protection**: SACRED.
+
+    Layers are independent, so they are cleaned in parallel on a thread pool
+    (OpenCV decode/encode releases the GIL). `cleaned_paths` and
+    `cleaning_report` keep the order of `layer_paths`.
+    
+    `layer_paths` may contain LayerHandles from the Qwen stage: their decoded
+    arrays are used directly (no disk read + decode) and released afterwards.
+
+    Args:
+        max_workers: Parallel layer jobs (default: $PIPELINE_CLEAN_WORKERS or CPU count, capped at layer count)
+    """
     gemini_map = {str(res["region_id"]): res["analysis"] for res in gemini_results}
     orig_h, orig_w = orig_size[:2]
+    text_regions = global_craft_result["text_regions"]
     
     # Ensure original image is available for high-res cropping
     if original_img is None:
         print("  [Warning] Original Image not provided! Falling back to low-res layer cropping (Quality degraded).")
 
-    for layer_path in layer_paths:
-        path = Path(layer_path)
-        if not path.exists(): continue
-            
-        print(f"  > Processing layer: {path.name}")
-        
-        # RULE 1: Skip Layer 0
-        if "layer_0" in path.name.lower():
-            print("    [Info] Layer 0 is Background -> PROTECTED")
-            cleaned_filename = path.stem + "_cleaned.png"
-            cleaned_path = output_dir / cleaned_filename
-            img = cv2.imread(str(path), cv2.IMREAD_UNCHANGED)
-            if img is not None: cv2.imwrite(str(cleaned_path), img)
-            cleaned_paths.append(str(cleaned_path))
-            
-            cleaning_report.append({
-                "original_layer": path.name,
-                "cleaned_layer": cleaned_filename,
-                "status": "preserved",
-                "action": "none (background)",
-                "regions_removed": 0
-            })
-            continue
+    if max_workers is None:
+        max_workers = int(os.getenv("PIPELINE_CLEAN_WORKERS", "0")) or (os.cpu_count() or 1)
+    max_workers = max(1, min(max_workers, len(layer_paths)))
 
-        # Process Overlay Layers
-        raw_img = cv2.imread(str(path), cv2.IMREAD_UNCHANGED)
-        if raw_img is None: continue
-        
-        # Ensure RGBA
-        if raw_img.shape[2] == 3: raw_img = cv2.cvtColor(raw_img, cv2.COLOR_BGR2BGRA)
-        
-        h, w = raw_img.shape[:2]
-        sx, sy = get_layer_scale(orig_w, orig_h, w, h)
-        print(f"    @ Scale: x={sx:.3f}, y={sy:.3f} (Resolution: {w}x{h})")
+    def clean(src_layer):
+        result = _clean_single_layer(src_layer, output_dir, text_regions, gemini_map, orig_w, orig_h)
+        if isinstance(src_layer, LayerHandle):
+            src_layer.release()  # The decoded Qwen layer is not needed after cleaning
+        return result
 
-        erasure_mask = np.zeros((h, w), dtype=np.uint8)
-        regions_removed = 0
-        pixel_gating_stats = {"checked": 0, "verified_text": 0, "skipped_graphic": 0}
-        
-        # V4.8 FIX: Atomic Erasure (Erase-All, Render-Once)
-        # Trust Global CRAFT Polygon completely. No local re-detection.
-        
-        for region in global_craft_result["text_regions"]:
-            rid = str(region["id"])
-            role = gemini_map.get(rid, {}).get("role", "body").lower().strip()
-            
-            # 1. Logic: Only remove "Removable" roles
-            if role not in REMOVE_ROLES: continue
-            
-            # 2. Logic: Atomic Erasure of Global Polygon
-            # Use POLYGON from Global Detection (High Precision)
-            g_poly = np.array(region["polygon"], dtype=np.float32) # Shape (N, 2)
-            
-            # Scale to Layer Coordinates
-            # (Global X * sx = Layer X)
-            l_poly = g_poly.copy()
-            l_poly[:, 0] *= sx
-            l_poly[:, 1] *= sy
-            l_poly = l_poly.astype(np.int32)
-            
-            # 3. Fill Mask
-            cv2.fillPoly(erasure_mask, [l_poly], 255)
-            regions_removed += 1
-
-        # 4. Apply Erasure
-        if regions_removed > 0:
-            # Dilation: Moderate to catch anti-aliasing (Atomic means wipe it ALL)
-            kernel = np.ones((2, 2), np.uint8) 
-            erasure_mask = cv2.dilate(erasure_mask, kernel, iterations=1)
-            raw_img[:, :, 3] = np.where(erasure_mask == 255, 0, raw_img[:, :, 3])
-            
-            log = f"atomic_erasure (removed {regions_removed} regions)"
-            print(f"    -> {log}")
-        else:
-            log = "no_erasures"
-            print(f"    -> No regions matched.")
-
-        # Save
-        cleaned_filename = path.stem + "_cleaned.png"
-        cleaned_path = output_dir / cleaned_filename
-        cv2.imwrite(str(cleaned_path), raw_img)
-        cleaned_paths.append(str(cleaned_path))
-        
-        cleaning_report.append({
-            "original_layer": path.name,
-            "cleaned_layer": cleaned_filename,
-            "status": "cleaned" if regions_removed > 0 else "preserved",
-            "action": log,
-            "regions_removed": regions_removed
-        })
+    if max_workers == 1:
+        results = [clean(p) for p in layer_paths]
+    else:
+        print(f"  [Info] Cleaning {len(layer_paths)} layers with {max_workers} workers")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # map() yields in submission order -> deterministic report
+            results = list(executor.map(clean, layer_paths))
+
+    cleaned_paths = []
+    cleaning_report = []
+    for result in results:
+        if result is None: continue
+        cleaned_path, report_entry = result
+        cleaned_paths.append(cleaned_path)
+        cleaning_report.append(report_entry)
 
     return cleaned_paths, cleaning_report
 
+# Residue check tuning
+RESIDUE_ROI_MARGIN = 0.5   # Context around each removable region (fraction of its height, each side)
+RESIDUE_ROI_MIN_MARGIN = 16  # ... but at least this many layer pixels
+RESIDUE_GRID_CELL = 64     # Spatial index cell size (layer pixels)
+
+def build_polygon_grid(polygons, cell=RESIDUE_GRID_CELL):
+    """Uniform-grid spatial index: (gx, gy) -> indices of polygons whose bbox touches the cell."""
+    grid = {}
+    for i, poly in enumerate(polygons):
+        (x0, y0), (x1, y1) = poly.min(axis=0), poly.max(axis=0)
+        for gy in range(int(y0 // cell), int(y1 // cell) + 1):
+            for gx in range(int(x0 // cell), int(x1 // cell) + 1):
+                grid.setdefault((gx, gy), []).append(i)
+    return grid
+
+def point_in_polygons(point, polygons, grid, cell=RESIDUE_GRID_CELL):
+    """True if `point` lies in (or on) any polygon; only the point's grid cell is tested."""
+    for i in grid.get((int(point[0] // cell), int(point[1] // cell)), ()):
+        if cv2.pointPolygonTest(polygons[i], point, False) >= 0:
+            return True
+    return False
+
 def detect_layer0_residue(layer0_path, global_regions, gemini_map, orig_size):
     """
     V4.13: Detect if 'Removable' text is still visible on Layer 0 (Background).
     If Qwen failed to layer text properly, it stays on Layer 0.
     We detect it here and mark those regions to skip rendering.
     
+    Only the ROIs of removable global regions (plus context margin) are checked:
+    all ROIs go through one batched CRAFT call, detections are mapped back to
+    layer coordinates, and region centers are matched via a grid index.
+    
     Returns: List of region IDs that have residue on Layer 0.
     """
-    REMOVE_ROLES = ["heading", "subheading", "body", "cta", "usp"]
-    
     print("\n[STEP 4.5] Detecting Layer 0 Residue...")
     
-    # 1. Run CRAFT on Layer 0 (pass path, not image)
-    detector = CraftTextDetector(cuda=False, merge_lines=True, text_threshold=0.5)
-    layer0_result = detector.detect(str(layer0_path))  # Pass path string
-    l0_regions = layer0_result.get("text_regions", [])
-    print(f"  > CRAFT found {len(l0_regions)} text regions on Layer 0.")
-    
-    if not l0_regions:
-        print("  > No text detected on Layer 0. All clear!")
-        return []
-    
-    # 2. Load image to get dimensions for scaling
-    layer0_img = cv2.imread(str(layer0_path))
+    # 1. Load Layer 0 once (any layer storage format)
+    layer0_img = read_layer(layer0_path, cv2.IMREAD_COLOR)
     if layer0_img is None:
         print("  [Warning] Could not load Layer 0 for residue check.")
         return []
@@ -197,9 +306,9 @@ def detect_layer0_residue(layer0_path, global_regions, gemini_map, orig_size):
     orig_h, orig_w = orig_size[:2]
     sx, sy = l_w / orig_w, l_h / orig_h
     
-    residue_ids = []
-    
-    # 3. For each Global Region marked as Removable, check if it's on Layer 0
+    # 3. Collect Removable regions and their Layer 0 ROIs
+    candidates = []  # (rid, role, center, (x0, y0))
+    rois = []
     for region in global_regions:
         rid = str(region["id"])
         role = gemini_map.get(rid, {}).get("role", "body").lower().strip()
@@ -207,19 +316,46 @@ def detect_layer0_residue(layer0_path, global_regions, gemini_map, orig_size):
         if role not in REMOVE_ROLES:
             continue  # Only check Removable roles
         
-        # Scale global bbox center to layer coords
+        # Scale global bbox to layer coords
         g_bbox = region["bbox"]
-        l_cx = (g_bbox["x"] + g_bbox["width"] / 2) * sx
-        l_cy = (g_bbox["y"] + g_bbox["height"] / 2) * sy
+        bx, by = g_bbox["x"] * sx, g_bbox["y"] * sy
+        bw, bh = g_bbox["width"] * sx, g_bbox["height"] * sy
+        margin = max(RESIDUE_ROI_MIN_MARGIN, RESIDUE_ROI_MARGIN * bh)
         
-        # Check if any Layer 0 detection overlaps this center
-        for l0_region in l0_regions:
-            l0_poly = np.array(l0_region["polygon"], dtype=np.int32)
-            if cv2.pointPolygonTest(l0_poly, (l_cx, l_cy), False) >= 0:
-                text_preview = gemini_map.get(rid, {}).get("text", "")[:20]
-                print(f"  [Residue] Region {rid} ('{role}': '{text_preview}...') found on Layer 0!")
-                residue_ids.append(rid)
-                break
+        x0, y0 = max(0, int(bx - margin)), max(0, int(by - margin))
+        x1, y1 = min(l_w, int(bx + bw + margin) + 1), min(l_h, int(by + bh + margin) + 1)
+        if x1 <= x0 or y1 <= y0:
+            continue
+        
+        candidates.append((rid, role, (bx + bw / 2, by + bh / 2), (x0, y0)))
+        rois.append(layer0_img[y0:y1, x0:x1])
+    
+    if not candidates:
+        print("  > No removable regions to check.")
+        return []
+    
+    # 4. Run CRAFT on all ROIs in one batched call
+    detector = create_text_detector(cuda=False, merge_lines=True, text_threshold=0.5)
+    roi_results = detector.detect_many(rois)
+    
+    l0_polys = []
+    for (_, _, _, (x0, y0)), roi_result in zip(candidates, roi_results):
+        for l0_region in roi_result.get("regions", []):
+            l0_polys.append(np.array(l0_region["polygon"], dtype=np.int32) + np.array([x0, y0], dtype=np.int32))
+    print(f"  > CRAFT found {len(l0_polys)} text regions in {len(rois)} Layer 0 ROIs.")
+    
+    if not l0_polys:
+        print("  > No text detected on Layer 0. All clear!")
+        return []
+    
+    # 5. Check if any Layer 0 detection covers each removable region's center
+    grid = build_polygon_grid(l0_polys)
+    residue_ids = []
+    for rid, role, center, _ in candidates:
+        if point_in_polygons(center, l0_polys, grid):
+            text_preview = gemini_map.get(rid, {}).get("text", "")[:20]
+            print(f"  [Residue] Region {rid} ('{role}': '{text_preview}...') found on Layer 0!")
+            residue_ids.append(rid)
     
     if residue_ids:
         print(f"  > Total residue regions: {len(residue_ids)}")
@@ -228,171 +364,131 @@ def detect_layer0_residue(layer0_path, global_regions, gemini_map, orig_size):
     
     return residue_ids
 
-def run_pipeline_layered(image_path_str: str, mock_layers_dir: str = None) -> str:
-    """
-    Run the full layered pipeline on an image.
-    Args:
-        image_path_str: Path to the input image
-        mock_layers_dir: Optional path to pre-existing layers to skip Qwen cost
-    Returns:
-        str: Path to the run directory
-    """
-    image_path = Path(image_path_str)
-    output_base = "pipeline_outputs"
-    
-    if not image_path.exists():
-        raise FileNotFoundError(f"Error: {image_path} not found")
+# Global CRAFT pass settings (part of the craft checkpoint deps)
+CRAFT_GLOBAL_CONFIG = {"merge_lines": True, "link_threshold": 0.2, "text_threshold": 0.6, "low_text": 0.35}
 
-    # Setup run dir
-    run_id = int(time.time())
-    run_dir = Path(output_base) / f"run_{run_id}_layered"
-    run_dir.mkdir(parents=True, exist_ok=True)
-    
-    print(f"Starting LAYERED pipeline V4 for: {image_path.name}")
-    print(f"Output directory: {run_dir}")
-    
-    # ------------------------------------------------------------------
-    # STEP 1: CRAFT
-    # ------------------------------------------------------------------
-    # ------------------------------------------------------------------
-    # STEP 1: CRAFT
-    # ------------------------------------------------------------------
-    print("\n[STEP 1] Running CRAFT (Global)...")
-    detector = CraftTextDetector(cuda=False, merge_lines=True, link_threshold=0.2, text_threshold=0.6, low_text=0.35)
-    craft_result = detector.detect(str(image_path))
-    
-    # Save crops for Gemini
+# ----------------------------------------------------------------------
+# STAGES (each one checkpointed, see stage_checkpoints_v4)
+# ----------------------------------------------------------------------
+# Checkpoint deps include every setting that changes a stage's output, since a
+# branched run (run_index_v4.branch_run) starts from a sibling's checkpoints.
+
+def craft_checkpoint_deps(input_hash):
+    return {"input": input_hash, "config": CRAFT_GLOBAL_CONFIG, "runtime": craft_runtime_config()}
+
+def gemini_checkpoint_deps(craft_hash):
+    return {"craft": craft_hash, "analysis": batch_analysis_config()}
+
+def layers_checkpoint_deps(input_hash, mock_layers_dir=None):
+    return {"input": input_hash, "mock": str(mock_layers_dir) if mock_layers_dir else None,
+            "qwen": None if mock_layers_dir else qwen_config()}
+
+def stage_craft(image_path, run_dir, checkpoints, input_hash):
+    """STEP 1: Global CRAFT detection; crops are written to <run_dir>/crops for Gemini."""
+    deps = craft_checkpoint_deps(input_hash)
     crops_dir = run_dir / "crops"
-    crops_dir.mkdir(parents=True, exist_ok=True)
-    import base64
-    for region in craft_result["text_regions"]:
-        b64 = region["cropped_base64"]
-        if "base64," in b64: b64 = b64.split("base64,")[1]
-        with open(crops_dir / f"region_{region['id']}.png", "wb") as f:
-            f.write(base64.b64decode(b64))
+    cached = checkpoints.load("craft", deps=deps)
+    if cached:
+        craft_result = cached["data"]
+        # Crops live in this run dir (the checkpoint may come from a branched sibling run)
+        for region in craft_result["text_regions"]:
+            if "crop_path" in region:
+                region["crop_path"] = str(crops_dir / Path(region["crop_path"]).name)
+        return craft_result, cached["data_hash"]
 
-    # ------------------------------------------------------------------
-    # PARALLEL EXECUTION: STEP 2 (Gemini) & STEP 3 (Qwen)
-    # ------------------------------------------------------------------
-    print("\n[STEP 2 & 3] Running Gemini & Qwen in PARALLEL...")
-    
-    gemini_results = []
-    layer_paths = []
-    
-    import concurrent.futures
+    print("\n[STEP 1] Running CRAFT (Global)...")
+    detector = create_text_detector(cuda=False, **CRAFT_GLOBAL_CONFIG)
+    # Save crops for Gemini (written straight to disk, no base64 round-trip)
+    # Drop crops of a stale earlier pass so Gemini only sees this detection's regions
+    for old_crop in crops_dir.glob("region_*.png"):
+        old_crop.unlink()
+    craft_result = detector.detect(str(image_path), crop_mode="file", crops_dir=crops_dir)
 
-    # -- Task Functions --
-    layers_dir = run_dir / "layers"
-    layers_dir.mkdir(parents=True, exist_ok=True)
-    
-    def run_gemini_task():
-        print("  [Gemini] Starting Analysis...")
-        crop_files = sorted(list(crops_dir.glob("*.png")))
-        results = []
-        if crop_files:
-            crop_paths_str = [str(p) for p in crop_files]
-            try:
-                analysis_list = analyze_text_crops_batch(crop_paths_str)
-                count = min(len(crop_files), len(analysis_list))
-                for i in range(count):
-                    crop = crop_files[i]
-                    results.append({
-                        "region_id": crop.stem.split("_")[-1],
-                        "analysis": analysis_list[i]
-                    })
-                print("  [Gemini] Analysis Complete.")
-            except Exception as e:
-                print(f"  [Gemini] Failed: {e}")
-        else:
-            print("  [Gemini] No crops to analyze.")
-        
-        # refinement logic
-        return results
+    crop_files = [r["crop_path"] for r in craft_result["text_regions"] if "crop_path" in r]
+    craft_hash = checkpoints.save("craft", craft_result, files=crop_files, deps=deps)
+    return craft_result, craft_hash
 
-    def run_qwen_task():
-        print("  [Qwen] Starting Layer Generation...")
-        # layers_dir is available from outer scope
-        paths = []
-        
-        if mock_layers_dir and Path(mock_layers_dir).exists():
-            print(f"  [Qwen] Using mock layers from: {mock_layers_dir}")
-            import shutil
-            mock_path = Path(mock_layers_dir)
-            for f in sorted(mock_path.glob("*.png")):
-                dest = layers_dir / f.name
-                shutil.copy2(f, dest)
-                paths.append(str(dest))
-        else:
-            # REAL CALL
-            try:
-                paths = run_qwen_layered(str(image_path), layers_dir)
-                print("  [Qwen] Generation Complete.")
-            except Exception as e:
-                print(f"  [Qwen] Failed: {e}")
-        
-        return paths
+def gemini_results_for(crop_files, analysis_list):
+    """Pair Gemini's ordered analyses with the crops' region ids."""
+    count = min(len(crop_files), len(analysis_list))
+    return [
+        {"region_id": crop_files[i].stem.split("_")[-1], "analysis": analysis_list[i]}
+        for i in range(count)
+    ]
 
-    # -- Parallel Execution --
-    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-        future_gemini = executor.submit(run_gemini_task)
-        future_qwen = executor.submit(run_qwen_task)
-        
-        # Wait for results
+def stage_gemini(crops_dir, checkpoints, craft_hash):
+    """STEP 2: Gemini role/style analysis of the CRAFT crops (raw, before logo refinement)."""
+    deps = gemini_checkpoint_deps(craft_hash)
+    cached = checkpoints.load("gemini", deps=deps)
+    if cached:
+        return cached["data"]
+
+    print("  [Gemini] Starting Analysis...")
+    crop_files = sorted(list(crops_dir.glob("*.png")))
+    results = []
+    if crop_files:
+        crop_paths_str = [str(p) for p in crop_files]
         try:
-            gemini_results = future_gemini.result()
-            layer_paths = future_qwen.result()
+            analysis_list = analyze_text_crops_batch(crop_paths_str)
+            results = gemini_results_for(crop_files, analysis_list)
+            print("  [Gemini] Analysis Complete.")
         except Exception as e:
-            print(f"Parallel Execution Error: {e}")
-            raise e
+            print(f"  [Gemini] Failed: {e}")
+    else:
+        print("  [Gemini] No crops to analyze.")
 
-    # --- Post-Processing Gemini Results (Logo Refinement) ---
-    # V4.7 REFINEMENT: Logo Proximity Protection
-    def refine_logo_roles(regions, g_map):
-        logo_ids = []
-        for r in regions:
-            rid = str(r["id"])
-            role = g_map.get(rid, {}).get("role", "")
-            if role == "logo": logo_ids.append(r)
-        
-        if not logo_ids: return g_map
-            
-        updated_map = g_map.copy()
-        for logo_r in logo_ids:
-            lx, ly, lw, lh = logo_r["bbox"]["x"], logo_r["bbox"]["y"], logo_r["bbox"]["width"], logo_r["bbox"]["height"]
-            for other_r in regions:
-                other_rid = str(other_r["id"])
-                if other_rid == str(logo_r["id"]): continue
-                current_role = updated_map.get(other_rid, {}).get("role", "")
-                if current_role == "logo": continue
-                ox, oy, ow, oh = other_r["bbox"]["x"], other_r["bbox"]["y"], other_r["bbox"]["width"], other_r["bbox"]["height"]
-                if oy > (ly + lh): gap = oy - (ly + lh)
-                elif ly > (oy + oh): gap = ly - (oy + oh)
-                else: gap = 0
-                if gap > 20: continue
-                lc, oc = lx + lw/2, ox + ow/2
-                if abs(lc - oc) > max(lw, ow) * 0.5: continue
-                if oh > lh * 2: continue
-                print(f"  [Logo Protection] Region {other_rid} near Logo {logo_r['id']}. Encouraging 'logo' role.")
-                if other_rid in updated_map: updated_map[other_rid]["role"] = "logo"
-        return updated_map
+    # Only successful analyses are checkpointed, so a failed call is retried on resume
+    if results:
+        checkpoints.save("gemini", results, deps=deps)
+    return results
 
-    if gemini_results:
-        temp_map = {str(res["region_id"]): res["analysis"] for res in gemini_results}
-        fixed_map = refine_logo_roles(craft_result["text_regions"], temp_map)
-        for res in gemini_results:
-            rid = str(res["region_id"])
-            if rid in fixed_map: res["analysis"] = fixed_map[rid]
+def stage_layers(image_path, layers_dir, checkpoints, input_hash, mock_layers_dir=None, qwen=None):
+    """
+    STEP 3: Qwen layer decomposition (or mock layers).
+
+    Args:
+        qwen: Optional callable (image_path, layers_dir) -> layer paths replacing
+              run_qwen_layered (e.g. waiting on a fal_scheduler_v4 job)
+    """
+    deps = layers_checkpoint_deps(input_hash, mock_layers_dir)
+    cached = checkpoints.load("layers", deps=deps)
+    if cached:
+        return [str(layers_dir / name) for name in cached["data"]["layers"]], cached["data_hash"]
+
+    print("  [Qwen] Starting Layer Generation...")
+    paths = []
     
-    # ------------------------------------------------------------------
-    # STEP 4: CLEAN LAYERS
-    # ------------------------------------------------------------------
+    if mock_layers_dir and Path(mock_layers_dir).exists():
+        print(f"  [Qwen] Using mock layers from: {mock_layers_dir}")
+        mock_path = Path(mock_layers_dir)
+        for f in sorted(mock_path.glob("*.png")):
+            dest = layers_dir / f.name
+            shutil.copy2(f, dest)
+            paths.append(str(dest))
+    else:
+        # REAL CALL
+        try:
+            paths = (qwen or run_qwen_layered)(str(image_path), layers_dir)
+            print("  [Qwen] Generation Complete.")
+        except Exception as e:
+            print(f"  [Qwen] Failed: {e}")
+
+    layers_hash = None
+    if paths:
+        layers_hash = checkpoints.save("layers", {"layers": [Path(p).name for p in paths]}, files=paths, deps=deps)
+    return paths, layers_hash
+
+def stage_cleaning(layer_paths, layers_dir, craft_result, gemini_results, orig_img, checkpoints, deps):
+    """STEP 4 + 4.5: Erase removable text from layers, then check Layer 0 for residue."""
+    cached = checkpoints.load("cleaning", deps=deps)
+    if cached:
+        data = cached["data"]
+        return data["cleaning_report"], data["residue_ids"]
+
     print("\n[STEP 4] Cleaning Layers (Layer-Aware Pixel Erasure)...")
-    orig_img = cv2.imread(str(image_path))
     cleaned_layers, cleaning_report = clean_layers(layer_paths, layers_dir, craft_result, gemini_results, orig_img.shape, original_img=orig_img)
     
-    # ------------------------------------------------------------------
     # STEP 4.5: Layer Residue Detection (V4.13)
-    # ------------------------------------------------------------------
     gemini_map = {str(res["region_id"]): res["analysis"] for res in gemini_results}
     
     # Find Layer 0 path from cleaned layers
@@ -405,6 +501,96 @@ def run_pipeline_layered(image_path_str: str, mock_layers_dir: str = None) -> st
     residue_ids = []
     if layer0_path:
         residue_ids = detect_layer0_residue(layer0_path, craft_result["text_regions"], gemini_map, orig_img.shape)
+
+    checkpoints.save("cleaning", {"cleaning_report": cleaning_report, "residue_ids": residue_ids},
+                     files=cleaned_layers, deps=deps)
+    return cleaning_report, residue_ids
+
+def layered_pipeline_config(mock_layers_dir: str = None) -> dict:
+    """Everything besides the input bytes that determines a run's outputs (part of the run key)."""
+    return {
+        "craft": CRAFT_GLOBAL_CONFIG,
+        "craft_runtime": craft_runtime_config(),
+        "gemini": batch_analysis_config(),
+        "qwen": None if mock_layers_dir else qwen_config(),
+        "mock_layers": str(mock_layers_dir) if mock_layers_dir else None,
+        "layer_format": get_layer_format(),
+    }
+
+def start_layered_run(image_path, mock_layers_dir=None, resume=True, output_base="pipeline_outputs"):
+    """
+    Resolve the content-addressed run dir for an input and prepare it.
+
+    Returns:
+        dict with run_id, run_dir, input_hash, config, run_index, checkpoints and
+        `complete` (True if this input + config was already fully processed;
+        nothing is touched in that case).
+    """
+    image_path = Path(image_path)
+    input_hash = file_digest(image_path)
+    config = layered_pipeline_config(mock_layers_dir)
+    run_id = make_run_key(input_hash, config)
+    run_dir = run_dir_for(output_base, run_id)
+    run_index = RunIndex(output_base)
+    run = {"run_id": run_id, "run_dir": run_dir, "input_hash": input_hash, "config": config,
+           "run_index": run_index, "checkpoints": None, "complete": False}
+
+    existing = run_index.get(run_id)
+    if resume and existing and existing.get("complete") and (run_dir / "pipeline_report.json").exists():
+        print(f"[Cache] {image_path.name} was already processed with this config -> {run_dir}")
+        run["complete"] = True
+        return run
+
+    if not run_dir.exists() and resume:
+        siblings = run_index.find_by_input(input_hash)
+        if siblings:
+            print(f"[Cache] Branching from earlier run of the same input: {siblings[0]['run_dir']}")
+            branch_run(siblings[0]["run_dir"], run_dir)
+    run_dir.mkdir(parents=True, exist_ok=True)
+    (run_dir / "layers").mkdir(parents=True, exist_ok=True)
+
+    checkpoints = StageCheckpoints(run_dir, input_hash=input_hash)
+    if not resume:
+        checkpoints.invalidate("craft", "gemini", "layers", "cleaning", "box_detection")
+    checkpoints.write_manifest(image_path, {"run_key": run_id})
+    run_index.record(run_id, run_dir=str(run_dir), input_image=str(image_path), input_hash=input_hash,
+                     config=config, complete=False)
+    run["checkpoints"] = checkpoints
+    return run
+
+def finish_layered_run(run, image_path, craft_result, craft_hash, gemini_results, layer_paths, layers_hash,
+                       mock_layers_dir=None):
+    """
+    Logo refinement, STEP 4 / 4.5 (cleaning + residue) and the JSON report.
+
+    Returns:
+        str: Path to the run directory
+    """
+    image_path = Path(image_path)
+    run_dir, run_id, checkpoints = run["run_dir"], run["run_id"], run["checkpoints"]
+    layers_dir = run_dir / "layers"
+
+    # --- Post-Processing Gemini Results (Logo Refinement, V4.7) ---
+    # refine_logo_roles returns a new map, so the (checkpointed) Gemini results stay untouched
+    if gemini_results:
+        temp_map = {str(res["region_id"]): res["analysis"] for res in gemini_results}
+        fixed_map = refine_logo_roles(craft_result["text_regions"], temp_map)
+        gemini_results = [dict(res, analysis=fixed_map[str(res["region_id"])]) for res in gemini_results]
+    
+    # ------------------------------------------------------------------
+    # STEP 4 / 4.5: CLEAN LAYERS + Layer Residue Detection
+    # ------------------------------------------------------------------
+    orig_img = cv2.imread(str(image_path))
+    cleaning_deps = {
+        "craft": craft_hash,
+        "gemini": json_digest(gemini_results),
+        "layers": layers_hash,
+        "layer_format": get_layer_format(),
+    }
+    cleaning_report, residue_ids = stage_cleaning(
+        layer_paths, layers_dir, craft_result, gemini_results, orig_img, checkpoints, cleaning_deps
+    )
+    gemini_map = {str(res["region_id"]): res["analysis"] for res in gemini_results}
     
     # ------------------------------------------------------------------
     # Reporting
@@ -436,8 +622,74 @@ def run_pipeline_layered(image_path_str: str, mock_layers_dir: str = None) -> st
         json.dump(final_report, f, indent=2)
     
     print(f"Report saved to: {report_path}")
+    run["run_index"].record(run_id, complete=True)
     return str(run_dir)
 
+def run_pipeline_layered(image_path_str: str, mock_layers_dir: str = None, resume: bool = True) -> str:
+    """
+    Run the full layered pipeline on an image.
+    
+    Run directories are content-addressed: `run_<key>_layered`, where the key
+    hashes the input bytes and the pipeline config (see run_index_v4).
+    - Same input + config already completed -> the existing run is returned.
+    - Same input + config, incomplete -> resumed from its stage checkpoints.
+    - Same input, other config -> branched from the sibling run, so only the
+      stages whose config changed are recomputed.
+    
+    For many images at once, see run_pipeline_layered_async_v4 (asyncio-native
+    Gemini/Qwen calls with per-provider concurrency limits).
+    
+    Args:
+        image_path_str: Path to the input image
+        mock_layers_dir: Optional path to pre-existing layers to skip Qwen cost
+                         (not needed for repeats: Qwen results are cached, see layer_cache_v4)
+        resume: Reuse existing runs/checkpoints (False recomputes every stage)
+    Returns:
+        str: Path to the run directory
+    """
+    image_path = Path(image_path_str)
+    
+    if not image_path.exists():
+        raise FileNotFoundError(f"Error: {image_path} not found")
+
+    # Setup run dir (content-addressed)
+    run = start_layered_run(image_path, mock_layers_dir, resume)
+    run_dir, checkpoints, input_hash = run["run_dir"], run["checkpoints"], run["input_hash"]
+    if run["complete"]:
+        return str(run_dir)
+
+    print(f"Starting LAYERED pipeline V4 for: {image_path.name}")
+    print(f"Output directory: {run_dir}")
+    
+    # ------------------------------------------------------------------
+    # STEP 1: CRAFT
+    # ------------------------------------------------------------------
+    craft_result, craft_hash = stage_craft(image_path, run_dir, checkpoints, input_hash)
+
+    # ------------------------------------------------------------------
+    # PARALLEL EXECUTION: STEP 2 (Gemini) & STEP 3 (Qwen)
+    # ------------------------------------------------------------------
+    print("\n[STEP 2 & 3] Running Gemini & Qwen in PARALLEL...")
+    
+    crops_dir = run_dir / "crops"
+    layers_dir = run_dir / "layers"
+
+    # -- Parallel Execution --
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        future_gemini = executor.submit(stage_gemini, crops_dir, checkpoints, craft_hash)
+        future_qwen = executor.submit(stage_layers, image_path, layers_dir, checkpoints, input_hash, mock_layers_dir)
+        
+        # Wait for results
+        try:
+            gemini_results = future_gemini.result()
+            layer_paths, layers_hash = future_qwen.result()
+        except Exception as e:
+            print(f"Parallel Execution Error: {e}")
+            raise e
+
+    return finish_layered_run(run, image_path, craft_result, craft_hash, gemini_results, layer_paths,
+                              layers_hash, mock_layers_dir)
+
 if __name__ == "__main__":
     # Test
     IMAGE_PATH = r"image/IMAGE_CTA_BOX/Freedom to Move.png"
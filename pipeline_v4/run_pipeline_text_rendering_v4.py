@@ -5,6 +5,11 @@ import sys
 from pathlib import Path
 from PIL import Image, ImageDraw, ImageFont
 
+try:
+    from layer_storage_v4 import open_layer_pil, save_layer_pil
+except ImportError:
+    from pipeline_v4.layer_storage_v4 import open_layer_pil, save_layer_pil
+
 # Add 'rendering' to path to load font loader
 # In v4, we assume 'rendering' folder is present in pipeline_v4
 sys.path.append(os.path.join(os.path.dirname(__file__), "rendering"))
@@ -40,7 +45,7 @@ def composite_layers(run_dir, report_data):
             continue
             
         print(f"  > Merging {filename}...")
-        img = Image.open(path).convert("RGBA")
+        img = open_layer_pil(path).convert("RGBA")
         
         if base_img is None:
             base_img = img
@@ -82,7 +87,7 @@ def draw_background_boxes(base_image, report_data, orig_w, orig_h, run_dir):
             # Load the extracted box image
             full_path = Path(run_dir) / extracted_image_path
             if full_path.exists():
-                box_img = Image.open(full_path).convert("RGBA")
+                box_img = open_layer_pil(full_path).convert("RGBA")
                 
                 # Get position from layer_bbox (already in layer/canvas coords)
                 box_x = layer_bbox.get("x", 0)
@@ -402,6 +407,5 @@ if __name__ == "__main__":
     final_img = render_text_layer(final_img, report)
     
     # 4. Save
-    out_path = BASE_DIR / "final_composed.png"
-    final_img.save(out_path)
+    out_path = save_layer_pil(final_img, BASE_DIR / "final_composed.png", fmt="png")
     print(f"\nSuccess! Final image saved to: {out_path}")
@@ -32,6 +32,7 @@ try:
         draw_background_boxes, 
         render_text_layer
     )
+    from layer_storage_v4 import save_layer_pil
 except ImportError as e:
     print(f"Error importing pipeline modules: {e}")
     print("Ensure all v4 pipeline scripts are in the same directory.")
@@ -41,9 +42,79 @@ except ImportError as e:
 # MAIN PIPELINE LOGIC
 # -----------------------------------------------------------------------------
 
-def run_full_pipeline(input_path: str):
+def render_final(run_dir: str):
+    """
+    STAGE 3: Composite layers + background boxes + rendered text into
+    <run_dir>/final_composed.png.
+    
+    Returns:
+        Path of the final image, or None if the run has no report / layers.
+        Rendering errors propagate to the caller.
+    """
+    run_path = Path(run_dir)
+    
+    # Load the updated report
+    report_with_boxes = run_path / "pipeline_report_with_boxes.json"
+    report_orig = run_path / "pipeline_report.json"
+    
+    report_file = report_with_boxes if report_with_boxes.exists() else report_orig
+    
+    if not report_file.exists():
+        print(f"Error: No pipeline report found in {run_dir}")
+        return None
+        
+    print(f"Loading report: {report_file.name}")
+    with open(report_file, "r") as f:
+        report = json.load(f)
+        
+    # Get original image dimensions
+    input_filename = report.get("input_image", "")
+    orig_w, orig_h = 1080, 1920  # Fallback
+    
+    if input_filename:
+        # Try to resolve absolute path of input image
+        possible_paths = [
+            Path(input_filename),
+            Path(run_dir).parent.parent / "image" / Path(input_filename).name,
+            Path("c:/Users/harsh/Downloads/zocket/product_pipeline/image") / Path(input_filename).name
+        ]
+        
+        for p in possible_paths:
+            if p.exists():
+                try:
+                    with Image.open(p) as orig_img:
+                        orig_w, orig_h = orig_img.size
+                    print(f"Original image size detected: {orig_w}x{orig_h}")
+                    break
+                except:
+                    continue
+    
+    # 1. Composite Layers
+    print(" -> Compositing layers...")
+    final_img = composite_layers(run_dir, report)
+    if final_img is None:
+        print("Error: Failed to composite layers.")
+        return None
+
+    # 2. Composite Background Boxes (CTAs)
+    print(" -> Drawing background boxes...")
+    final_img = draw_background_boxes(final_img, report, orig_w, orig_h, run_dir)
+
+    # 3. Render Text
+    print(" -> Rendering text...")
+    final_img = render_text_layer(final_img, report)
+
+    # 4. Save Final Output
+    return save_layer_pil(final_img, run_path / "final_composed.png", fmt="png")
+
+def run_full_pipeline(input_path: str, resume: bool = True):
     """
     Executes the COMPLETE pipeline sequence.
+    
+    Stages are checkpointed in the run directory: with resume=True an image that
+    was processed before continues in its existing run dir from the last
+    completed stage, and box detection is skipped when it already ran on the
+    current layers.
     """
     path_obj = Path(input_path)
     run_dir = None
@@ -59,7 +130,7 @@ def run_full_pipeline(input_path: str):
         
         try:
             # run_pipeline_layered returns the new run directory
-            run_dir = run_pipeline_layered(str(path_obj))
+            run_dir = run_pipeline_layered(str(path_obj), resume=resume)
             print(f"Stage 1 Complete. Run Directory: {run_dir}")
         except Exception as e:
             print(f"!! CRITICAL: Stage 1 Failed: {e}")
@@ -97,63 +168,10 @@ def run_full_pipeline(input_path: str):
     print(f"STAGE 3: TEXT RENDERING")
     print(f"************************************************************")
     
-    run_path = Path(run_dir)
-    
-    # Load the updated report
-    report_with_boxes = run_path / "pipeline_report_with_boxes.json"
-    report_orig = run_path / "pipeline_report.json"
-    
-    report_file = report_with_boxes if report_with_boxes.exists() else report_orig
-    
-    if not report_file.exists():
-        print(f"Error: No pipeline report found in {run_dir}")
-        return
-        
-    print(f"Loading report: {report_file.name}")
-    with open(report_file, "r") as f:
-        report = json.load(f)
-        
-    # Get original image dimensions
-    input_filename = report.get("input_image", "")
-    orig_w, orig_h = 1080, 1920  # Fallback
-    
-    if input_filename:
-        # Try to resolve absolute path of input image
-        possible_paths = [
-            Path(input_filename),
-            Path(run_dir).parent.parent / "image" / Path(input_filename).name,
-            Path("c:/Users/harsh/Downloads/zocket/product_pipeline/image") / Path(input_filename).name
-        ]
-        
-        for p in possible_paths:
-            if p.exists():
-                try:
-                    with Image.open(p) as orig_img:
-                        orig_w, orig_h = orig_img.size
-                    print(f"Original image size detected: {orig_w}x{orig_h}")
-                    break
-                except:
-                    continue
-    
     try:
-        # 1. Composite Layers
-        print(" -> Compositing layers...")
-        final_img = composite_layers(run_dir, report)
-        if final_img is None:
-            print("Error: Failed to composite layers.")
+        out_path = render_final(run_dir)
+        if out_path is None:
             return
-
-        # 2. Composite Background Boxes (CTAs)
-        print(" -> Drawing background boxes...")
-        final_img = draw_background_boxes(final_img, report, orig_w, orig_h, run_dir)
-
-        # 3. Render Text
-        print(" -> Rendering text...")
-        final_img = render_text_layer(final_img, report)
-
-        # 4. Save Final Output
-        out_path = run_path / "final_composed.png"
-        final_img.save(out_path)
         print(f"\n>>> SUCCESS! Final combined image saved to:")
         print(f"{out_path}")
         
@@ -1,28 +1,34 @@
 import os
-import time
 import base64
-import requests
+import asyncio
+import httpx
 from pathlib import Path
-from io import BytesIO
-from PIL import Image
 from dotenv import load_dotenv
 
+try:
+    from fal_client_v4 import (
+        DOWNLOAD_CHUNK, JobDeadline, get_fal_client, job_done, poll_intervals, submit_response
+    )
+    from layer_storage_v4 import LayerHandle, decode_layer
+    from fal_input_cache_v4 import MAX_INPUT_SIZE, encode_input, input_encoding, input_image_url
+    from layer_cache_v4 import get_layer_cache, layer_cache_key
+except ImportError:
+    from pipeline_v4.fal_client_v4 import (
+        DOWNLOAD_CHUNK, JobDeadline, get_fal_client, job_done, poll_intervals, submit_response
+    )
+    from pipeline_v4.layer_storage_v4 import LayerHandle, decode_layer
+    from pipeline_v4.fal_input_cache_v4 import MAX_INPUT_SIZE, encode_input, input_encoding, input_image_url
+    from pipeline_v4.layer_cache_v4 import get_layer_cache, layer_cache_key
+
 # -------------------------------------------------------
 # CONFIG
 # -------------------------------------------------------
 
+# FAL_KEY is checked when the fal.ai client is first created (get_fal_client),
+# so cached / checkpointed layers work without it
 load_dotenv()
 
-FAL_KEY = os.getenv("FAL_KEY")
-if not FAL_KEY:
-    raise RuntimeError("FAL_KEY not found. Set it in .env or environment variables.")
-
-FAL_ENDPOINT = "https://queue.fal.run/fal-ai/qwen-image-layered"
-
-HEADERS = {
-    "Authorization": f"Key {FAL_KEY}",
-    "Content-Type": "application/json"
-}
+QWEN_LAYERED_APP = "fal-ai/qwen-image-layered"
 
 INPUT_IMAGE = "image/IMAGE_CTA_BOX/American-Built Reliability.png"
 OUTPUT_DIR = Path("outputs/IMAGE_CTA_BOX/American-Built Reliability_v4_t")
@@ -34,106 +40,203 @@ OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 # -------------------------------------------------------
 
 def image_to_base64(path: str) -> str:
-    with Image.open(path) as img:
-        # Resize if too large (max 1280px to be safe)
-        max_size = 1280
-        if max(img.size) > max_size:
-            ratio = max_size / max(img.size)
-            new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
-            
-        buffered = BytesIO()
-        img.save(buffered, format="PNG")
-        return base64.b64encode(buffered.getvalue()).decode("utf-8")
+    data, _ = encode_input(path, "png")
+    return base64.b64encode(data).decode("utf-8")
 
 def download_image(url: str, save_path: Path):
-    r = requests.get(url)
-    r.raise_for_status()
-    save_path.write_bytes(r.content)
-
-# -------------------------------------------------------
-# MAIN
-# -------------------------------------------------------
+    get_fal_client().download(url, save_path)
 
-def run_qwen_layered(image_path: str, output_dir: Path = None):
-    if output_dir is None:
-        output_dir = OUTPUT_DIR
-    output_dir.mkdir(parents=True, exist_ok=True)
-
-    print("Encoding image...")
-    image_b64 = image_to_base64(image_path)
+# Optimized Prompting for Text/CTA Separation
+# Positive: Describes clarity and essential elements to help model focus (reduces hallucinations)
+# Negative: Standard quality guardrails
+PROMPT = "A high-quality professional advertisement image features clear text overlays and a distinct call-to-action button"
+NEGATIVE_PROMPT = "blurry, low quality, distortion, noise, artifacts, messy, jpeg artifacts"
 
-    # Optimized Prompting for Text/CTA Separation
-    # Positive: Describes clarity and essential elements to help model focus (reduces hallucinations)
-    # Negative: Standard quality guardrails
-    prompt = "A high-quality professional advertisement image features clear text overlays and a distinct call-to-action button"
-    negative_prompt = "blurry, low quality, distortion, noise, artifacts, messy, jpeg artifacts"
-
-    payload = {
-        "image_url": f"data:image/png;base64,{image_b64}",
-        "prompt": prompt,
-        "negative_prompt": negative_prompt,
+def qwen_params(num_layers: int = 2) -> dict:
+    """Generation parameters (everything in the payload except the input image)."""
+    return {
+        "prompt": PROMPT,
+        "negative_prompt": NEGATIVE_PROMPT,
         "num_inference_steps": 50,
         "guidance_scale": 4,
-        "num_layers": 2,  
+        "num_layers": num_layers,
         "enable_safety_checker": True,
         "output_format": "png",
         "acceleration": "regular"
     }
 
-    print("Submitting job to fal.ai...")
-    submit_resp = requests.post(FAL_ENDPOINT, headers=HEADERS, json=payload)
-    
-    if submit_resp.status_code != 200:
-        print(f"❌ Error: API Request Failed with status {submit_resp.status_code}")
-        print(f"Details: {submit_resp.text}")
-    
-    submit_resp.raise_for_status()
-    submit_data = submit_resp.json()
+def build_payload(image_url: str, num_layers: int = 2) -> dict:
+    """
+    Args:
+        image_url: Uploaded input URL or data URI (see fal_input_cache_v4.input_image_url)
+    """
+    return {"image_url": image_url, **qwen_params(num_layers)}
 
-    request_id = submit_data["request_id"]
-    status_url = submit_data["status_url"]
-    result_url = submit_data["response_url"]
+def qwen_config(num_layers: int = 2) -> dict:
+    """Endpoint, input sizing/encoding and generation parameters: everything besides the input that shapes the layers."""
+    return {"app": QWEN_LAYERED_APP, "max_input_size": MAX_INPUT_SIZE, **input_encoding(), **qwen_params(num_layers)}
 
-    print(f"Request ID: {request_id}")
-    print("Waiting for completion...")
+def qwen_cache_key(image_path: str, num_layers: int = 2):
+    """Layer cache key for this input + generation parameters; returns (key, params)."""
+    params = qwen_config(num_layers)
+    return layer_cache_key(image_path, params), params
 
-    # Poll
-    while True:
-        status_resp = requests.get(status_url, headers=HEADERS)
-        status_resp.raise_for_status()
-        status = status_resp.json()
+def layer_save_path(output_dir: Path, idx: int) -> Path:
+    return output_dir / f"{idx}_layer_{idx}.png"
 
-        if status["status"] == "COMPLETED":
-            break
-        elif status["status"] == "FAILED":
-            raise RuntimeError("Qwen Image Layered job failed.")
-        else:
-            time.sleep(2)
+# -------------------------------------------------------
+# MAIN
+# -------------------------------------------------------
 
-    print("Downloading results...")
-    result_resp = requests.get(result_url, headers=HEADERS)
-    result_resp.raise_for_status()
-    result = result_resp.json()
+def cached_layers(image_path: str, output_dir: Path, num_layers: int = 2):
+    """Layers restored from the layer cache into `output_dir`, or None (see layer_cache_v4)."""
+    cache = get_layer_cache()
+    if not cache:
+        return None
+    cache_key, _ = qwen_cache_key(image_path, num_layers)
+    restored = cache.get(cache_key, output_dir)
+    if not restored:
+        return None
+    print(f"  [LayerCache] {Path(image_path).name}: reusing {len(restored)} cached layers ({cache_key})")
+    return [LayerHandle(p) for p in restored]
+
+def store_layers(image_path: str, layer_paths: list, num_layers: int = 2):
+    """Add freshly generated layers to the layer cache (no-op if disabled)."""
+    cache = get_layer_cache()
+    if cache and layer_paths:
+        cache_key, cache_params = qwen_cache_key(image_path, num_layers)
+        cache.put(cache_key, layer_paths, cache_params)
+
+def submit_qwen_job(image_path: str, num_layers: int = 2, client=None) -> dict:
+    """Queue a Qwen job on fal.ai; returns fal's submit response (request_id, status/response URLs)."""
+    client = client or get_fal_client()
+    # Uploaded once per input content and reused (inline data URI as fallback)
+    payload = build_payload(input_image_url(image_path, client), num_layers)
+    job = client.submit(QWEN_LAYERED_APP, payload)
+    print(f"  [Qwen] Submitted {Path(image_path).name} (request {job['request_id']})")
+    return job
+
+def fetch_qwen_layers(job: dict, image_path: str, output_dir: Path, num_layers: int = 2, client=None):
+    """
+    Download a completed job's layers into `output_dir` and add them to the layer cache.
+
+    Returns:
+        List of LayerHandle (path-like; they also carry the decoded BGRA layer)
+    """
+    client = client or get_fal_client()
+    result = client.result(job)
     
     print("DEBUG: Raw result from API:")
     print(result)
 
     images = result.get("images", [])
+    save_paths = [layer_save_path(output_dir, idx) for idx in range(len(images))]
+    print(f"Downloading {len(images)} layers...")
+    # Streamed to disk; the bytes are also decoded here so cleaning can use the
+    # arrays directly instead of re-reading and re-decoding each file
+    layer_bytes = client.download_many([img_obj["url"] for img_obj in images], save_paths, keep_bytes=True)
     saved_paths = []
-
-    for idx, img_obj in enumerate(images):
-        url = img_obj["url"]
-        name = f"layer_{idx}"
-            
-        save_path = output_dir / f"{idx}_{name}.png"
-        download_image(url, save_path)
+    for save_path, data in zip(save_paths, layer_bytes):
         print(f"Saved: {save_path}")
-        saved_paths.append(str(save_path))
+        saved_paths.append(LayerHandle(save_path, decode_layer(data)))
+
+    store_layers(image_path, saved_paths, num_layers)
+    return saved_paths
+
+def run_qwen_layered(image_path: str, output_dir: Path = None, num_layers: int = 2):
+    """
+    Layer one image: cache lookup -> submit -> poll -> download.
+    For many images, fal_scheduler_v4 overlaps the jobs instead.
+
+    Returns:
+        List of LayerHandle (path-like; they also carry the decoded BGRA layer)
+    """
+    if output_dir is None:
+        output_dir = OUTPUT_DIR
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # Same input + parameters layered before -> reuse (see layer_cache_v4)
+    restored = cached_layers(image_path, output_dir, num_layers)
+    if restored:
+        return restored
+
+    # Pooled session + backoff polling (see fal_client_v4)
+    client = get_fal_client()
+    print("Submitting job to fal.ai...")
+    job = submit_qwen_job(image_path, num_layers, client)
+    client.wait(job)
+    saved_paths = fetch_qwen_layers(job, image_path, output_dir, num_layers, client)
 
     print("\n✅ Qwen Image Layered completed successfully.")
     return saved_paths
 
+# -------------------------------------------------------
+# ASYNC
+# -------------------------------------------------------
+
+async def run_qwen_layered_async(image_path: str, output_dir: Path = None, client: httpx.AsyncClient = None,
+                                 num_layers: int = 2):
+    """
+    asyncio version of run_qwen_layered (same payload, output files and LayerHandles).
+
+    Submission, status polling and downloads are non-blocking, so one event loop
+    can keep many fal.ai jobs in flight. Pass a shared `client` to reuse its
+    connection pool across jobs; otherwise a private one is opened and closed.
+    Endpoint, auth, status handling and the job deadline are FalClient's, so
+    both paths behave the same.
+    """
+    if output_dir is None:
+        output_dir = OUTPUT_DIR
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    if client is None:
+        async with httpx.AsyncClient(timeout=httpx.Timeout(60.0)) as own_client:
+            return await run_qwen_layered_async(image_path, output_dir, own_client, num_layers)
+
+    restored = await asyncio.to_thread(cached_layers, image_path, output_dir, num_layers)
+    if restored:
+        return restored
+
+    fal = get_fal_client()
+    # Upload (or resize/encode) is blocking -> keep it off the event loop
+    image_url = await asyncio.to_thread(input_image_url, image_path, fal)
+
+    job = submit_response(await client.post(fal.endpoint(QWEN_LAYERED_APP), headers=fal.headers,
+                                            json=build_payload(image_url, num_layers)))
+    request_id = job["request_id"]
+    print(f"  [Qwen] Submitted {Path(image_path).name} (request {request_id})")
+
+    deadline = JobDeadline(fal.job_timeout)
+    for interval in poll_intervals():
+        status_resp = await client.get(job["status_url"], headers=fal.headers)
+        status_resp.raise_for_status()
+        if job_done(job, status_resp.json(), deadline, wait=interval):
+            break
+        await asyncio.sleep(interval)
+
+    result_resp = await client.get(job["response_url"], headers=fal.headers)
+    result_resp.raise_for_status()
+    images = result_resp.json().get("images", [])
+
+    async def download(idx, img_obj):
+        # Result URLs are public CDN links (no auth header, like FalClient.download);
+        # streamed to disk chunk by chunk, the bytes are kept for decoding
+        save_path = layer_save_path(output_dir, idx)
+        data = bytearray()
+        async with client.stream("GET", img_obj["url"]) as r:
+            r.raise_for_status()
+            with open(save_path, "wb") as f:
+                async for chunk in r.aiter_bytes(DOWNLOAD_CHUNK):
+                    f.write(chunk)
+                    data.extend(chunk)
+        image = await asyncio.to_thread(decode_layer, bytes(data))
+        return LayerHandle(save_path, image)
+
+    saved_paths = list(await asyncio.gather(*(download(idx, img_obj) for idx, img_obj in enumerate(images))))
+    print(f"  [Qwen] {request_id}: saved {len(saved_paths)} layers")
+    await asyncio.to_thread(store_layers, image_path, saved_paths, num_layers)
+    return saved_paths
+
 # -------------------------------------------------------
 # ENTRY
 # -------------------------------------------------------
@@ -0,0 +1,172 @@
+"""
+Stage Checkpoints V4
+====================
+Per-stage checkpoint files for a run directory, so a rerun on the same input
+resumes from the last completed stage instead of paying for CRAFT, Gemini and
+Qwen again after a transient failure.
+
+Layout:
+    <run_dir>/checkpoints/manifest.json     input image, input content hash, run key
+    <run_dir>/checkpoints/<stage>.json      one file per completed stage
+
+Each stage file stores:
+    data        JSON-serialisable stage output
+    data_hash   sha256 of the canonical JSON of `data`
+    deps        content hashes of everything the stage was computed from
+                (input image, upstream stage data, config)
+    files       sha256 of every file the stage produced (crops, layers, ...)
+
+A checkpoint is only reused when its deps match the current ones and all of
+its files still exist unchanged; otherwise the stage is recomputed and its
+checkpoint replaced.
+"""
+
+import os
+import json
+import time
+import hashlib
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+CHECKPOINT_DIRNAME = "checkpoints"
+MANIFEST_NAME = "manifest.json"
+
+
+def file_digest(path, chunk_size: int = 1 << 20) -> str:
+    """sha256 of a file's bytes."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def json_digest(data: Any) -> str:
+    """sha256 of the canonical JSON encoding of `data`."""
+    encoded = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def _write_json_atomic(path: Path, payload: Dict[str, Any]):
+    tmp = path.with_name(path.name + f".{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(payload, f, indent=2)
+    os.replace(tmp, path)
+
+
+class StageCheckpoints:
+    """
+    Checkpoint store for one run directory.
+
+    File paths are recorded relative to the run directory, so a run dir can be
+    moved or copied and still resume.
+    """
+
+    def __init__(self, run_dir, input_hash: str = None):
+        self.run_dir = Path(run_dir)
+        self.dir = self.run_dir / CHECKPOINT_DIRNAME
+        self.input_hash = input_hash
+
+    def _stage_path(self, stage: str) -> Path:
+        return self.dir / f"{stage}.json"
+
+    def _rel(self, path) -> str:
+        path = Path(path)
+        try:
+            return str(path.resolve().relative_to(self.run_dir.resolve()))
+        except ValueError:
+            return str(path.resolve())
+
+    def _abs(self, rel: str) -> Path:
+        path = Path(rel)
+        return path if path.is_absolute() else self.run_dir / path
+
+    # -- manifest -------------------------------------------------------------
+
+    def write_manifest(self, input_image: str, extra: Dict[str, Any] = None):
+        """Record which input this run belongs to (used to find resumable runs)."""
+        self.dir.mkdir(parents=True, exist_ok=True)
+        manifest = {"input_image": str(input_image), "input_hash": self.input_hash, **(extra or {})}
+        _write_json_atomic(self.dir / MANIFEST_NAME, manifest)
+
+    def read_manifest(self) -> Optional[Dict[str, Any]]:
+        path = self.dir / MANIFEST_NAME
+        if not path.exists():
+            return None
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # -- stages ---------------------------------------------------------------
+
+    def save(self, stage: str, data: Any, files: Iterable = (), deps: Dict[str, Any] = None) -> str:
+        """
+        Write the checkpoint for `stage`.
+
+        Returns:
+            data_hash of the stored data (usable as a dep of downstream stages)
+        """
+        self.dir.mkdir(parents=True, exist_ok=True)
+        data_hash = json_digest(data)
+        payload = {
+            "stage": stage,
+            "created_at": time.time(),
+            "input_hash": self.input_hash,
+            "deps": deps or {},
+            "data_hash": data_hash,
+            "files": {self._rel(p): file_digest(p) for p in files if Path(p).exists()},
+            "data": data,
+        }
+        _write_json_atomic(self._stage_path(stage), payload)
+        print(f"  [Checkpoint] Saved '{stage}'")
+        return data_hash
+
+    def load(self, stage: str, deps: Dict[str, Any] = None) -> Optional[Dict[str, Any]]:
+        """
+        Return {"data", "data_hash", "files"} for a valid checkpoint, else None.
+
+        Valid means: same input hash, same deps, intact data and unchanged files.
+        """
+        path = self._stage_path(stage)
+        if not path.exists():
+            return None
+        try:
+            with open(path, "r") as f:
+                payload = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"  [Checkpoint] Ignoring unreadable '{stage}': {e}")
+            return None
+
+        reason = None
+        if self.input_hash and payload.get("input_hash") != self.input_hash:
+            reason = "input changed"
+        elif json_digest(payload.get("deps", {})) != json_digest(deps or {}):
+            reason = "upstream changed"
+        elif json_digest(payload.get("data")) != payload.get("data_hash"):
+            reason = "data corrupted"
+        else:
+            for rel, digest in payload.get("files", {}).items():
+                file_path = self._abs(rel)
+                if not file_path.exists() or file_digest(file_path) != digest:
+                    reason = f"file changed: {rel}"
+                    break
+
+        if reason:
+            print(f"  [Checkpoint] '{stage}' is stale ({reason}), recomputing")
+            return None
+
+        print(f"  [Checkpoint] Resuming '{stage}' from {path.name}")
+        return {
+            "data": payload["data"],
+            "data_hash": payload["data_hash"],
+            "files": [str(self._abs(rel)) for rel in payload.get("files", {})],
+        }
+
+    def invalidate(self, *stages: str):
+        for stage in stages:
+            path = self._stage_path(stage)
+            if path.exists():
+                path.unlink()
+
@@ -0,0 +1,109 @@
+"""
+Tests for the v4 pipeline modules.
+
+The modules import each other as top-level names (pipeline_v4 on sys.path),
+so the tests do the same.
+
+Run from the project root:
+    python -m pytest -q pipeline_v4/tests
+"""
+
+import sys
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+class FalStub(ThreadingHTTPServer):
+    """
+    Local stand-in for fal.ai's queue and storage APIs.
+
+    Every job reports `statuses` in turn (the last one repeats) and completes
+    with one image per entry in `layers` (name -> bytes, served from /files/).
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _FalStubHandler)
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+        self.statuses = ["IN_QUEUE", "IN_PROGRESS", "COMPLETED"]
+        self.layers = {}
+        self.files = {}
+        self.fail_uploads = False
+        self.log = []  # (method, path, headers, body)
+        self.polls = {}  # request_id -> number of status requests
+        self.jobs = 0
+        self.lock = threading.Lock()
+
+
+class _FalStubHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code, body, content_type="application/json"):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _record(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        with self.server.lock:
+            self.server.log.append((self.command, self.path, dict(self.headers), body))
+        return body
+
+    def do_POST(self):
+        stub, body = self.server, self._record()
+        path = self.path.split("?")[0]
+        if path == "/storage/upload/initiate":
+            if stub.fail_uploads:
+                return self._send(500, {"error": "storage unavailable"})
+            name = json.loads(body)["file_name"]
+            return self._send(200, {"upload_url": f"{stub.url}/upload/{name}", "file_url": f"{stub.url}/files/{name}"})
+        with stub.lock:
+            stub.jobs += 1
+            request_id = f"req-{stub.jobs}"
+        self._send(200, {"request_id": request_id, "status_url": f"{stub.url}/requests/{request_id}/status",
+                         "response_url": f"{stub.url}/requests/{request_id}"})
+
+    def do_PUT(self):
+        body = self._record()
+        self.server.files[self.path.rsplit("/", 1)[-1]] = body
+        self._send(200, {})
+
+    def do_GET(self):
+        stub = self.server
+        self._record()
+        parts = self.path.strip("/").split("/")
+        if parts[0] == "requests" and parts[-1] == "status":
+            with stub.lock:
+                n = stub.polls.get(parts[1], 0)
+                stub.polls[parts[1]] = n + 1
+            return self._send(200, {"status": stub.statuses[min(n, len(stub.statuses) - 1)]})
+        if parts[0] == "requests":
+            return self._send(200, {"images": [{"url": f"{stub.url}/files/{name}"} for name in stub.layers]})
+        if parts[0] == "files":
+            data = stub.layers.get(parts[1], stub.files.get(parts[1]))
+            if data is not None:
+                return self._send(200, data, "application/octet-stream")
+        self._send(404, {"error": self.path})
+
+
+@pytest.fixture
+def fal_stub():
+    stub = FalStub()
+    thread = threading.Thread(target=stub.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield stub
+    stub.shutdown()
+    stub.server_close()
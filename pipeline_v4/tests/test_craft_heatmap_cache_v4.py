@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from craft_heatmap_cache_v4 import HeatmapCache
+
+
+def _maps(value, shape=(128, 128)):
+    return np.full(shape, value, dtype=np.float32), np.full(shape, -value, dtype=np.float32)
+
+
+def test_memory_only_by_default(tmp_path):
+    cache = HeatmapCache()
+    cache.put("k", *_maps(1.0), 0.5)
+    text, link, ratio = cache.get("k")
+    assert text[0, 0] == 1.0 and link[0, 0] == -1.0 and ratio == 0.5
+
+
+def test_small_heatmaps_stay_in_memory(tmp_path):
+    cache = HeatmapCache(cache_dir=tmp_path)
+    cache.put("small", *_maps(1.0, shape=(16, 16)), 1.0)
+    cache.put("large", *_maps(1.0), 1.0)
+    assert sorted(p.name for p in tmp_path.glob("*.json")) == ["large.json"]
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    entry_bytes = 2 * (128 * 128 * 4 + 128)  # two float32 maps + npy headers, roughly
+    cache = HeatmapCache(cache_dir=tmp_path, max_disk_bytes=int(2.5 * entry_bytes))
+    for i, key in enumerate(["a", "b"]):
+        cache.put(key, *_maps(float(i)), 1.0)
+        os.utime(tmp_path / f"{key}.json", (i, i))
+
+    # A disk hit on "a" makes "b" the least recently used entry
+    cache.clear()
+    assert cache.get("a") is not None
+    cache.put("c", *_maps(2.0), 1.0)
+
+    assert sorted(p.stem for p in tmp_path.glob("*.json")) == ["a", "c"]
+    assert not (tmp_path / "b_text.npy").exists()
+    cache.clear()
+    assert cache.get("b") is None
+
+
+def test_memory_tier_is_bounded_by_bytes():
+    entry_bytes = 2 * 128 * 128 * 4
+    cache = HeatmapCache(max_memory_bytes=int(2.5 * entry_bytes))
+    cache.put("a", *_maps(1.0), 1.0)
+    cache.put("b", *_maps(2.0), 1.0)
+    assert cache.get("a") is not None  # "b" is now the least recently used entry
+    cache.put("c", *_maps(3.0), 1.0)
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache._memory_bytes == 2 * entry_bytes
+
+    # Maps larger than the whole budget are not held at all
+    cache.put("huge", *_maps(4.0, shape=(256, 256)), 1.0)
+    assert cache.get("huge") is None
+    assert cache._memory_bytes <= cache.max_memory_bytes
@@ -0,0 +1,163 @@
+import threading
+import warnings
+from multiprocessing import shared_memory
+
+import pytest
+import requests
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchvision")
+pytest.importorskip("skimage")
+
+import craft_service_v4
+from craft_service_v4 import CraftService, RemoteCraftTextDetector, make_server
+from text_detector_craft_v4 import CraftTextDetector
+from craft_backends_v4 import EagerBackend
+from craft import CRAFT
+
+# Low thresholds so the random-weight model still finds regions
+CONFIG = {"canvas_size": 320, "mag_ratio": 1.0, "text_threshold": 0.05, "link_threshold": 0.03, "low_text": 0.03}
+
+
+@pytest.fixture(scope="module")
+def backend():
+    torch.manual_seed(0)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return EagerBackend(CRAFT().eval())
+
+
+@pytest.fixture(scope="module")
+def local(backend):
+    d = CraftTextDetector(use_heatmap_cache=False, **CONFIG)
+    d.net = backend
+    return d
+
+
+@pytest.fixture(scope="module")
+def service(backend):
+    """CraftService on the random-weight model, served on an ephemeral port."""
+    def detector_cls(**kwargs):
+        d = CraftTextDetector(use_heatmap_cache=False, **kwargs)
+        d.net = backend
+        return d
+
+    # Long batch_wait so concurrent requests end up in one worker batch
+    svc = CraftService(workers=1, max_batch=8, batch_wait=0.3)
+    svc._detector_cls = detector_cls
+    svc.start()
+    server = make_server(svc, port=0)
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    svc.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield svc
+    server.shutdown()
+    server.server_close()
+    svc.stop()
+
+
+def _text_image(rng, h, w):
+    image = np.full((h, w, 3), 255, dtype=np.uint8)
+    for _ in range(6):
+        y, x = int(rng.integers(0, h - 20)), int(rng.integers(0, w - 40))
+        cv2.putText(image, "TEXT", (x, y + 15), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 2)
+    return image
+
+
+@pytest.fixture(scope="module")
+def images():
+    rng = np.random.default_rng(0)
+    return [_text_image(rng, h, w) for h, w in [(100, 150), (200, 90), (100, 150), (64, 300)]]
+
+
+@pytest.fixture
+def created_segments(monkeypatch):
+    """Names of the shared memory segments created by the client."""
+    names = []
+
+    class RecordingSharedMemory(shared_memory.SharedMemory):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            if kwargs.get("create"):
+                names.append(self.name)
+
+    monkeypatch.setattr(craft_service_v4.shared_memory, "SharedMemory", RecordingSharedMemory)
+    return names
+
+
+def _assert_unlinked(names):
+    assert names
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+
+
+@pytest.mark.parametrize("use_shm", [True, False], ids=["shm", "png_b64"])
+def test_remote_detect_many_matches_local(service, local, images, use_shm):
+    remote = RemoteCraftTextDetector(service.url, use_shared_memory=use_shm, **CONFIG)
+
+    expected = local.detect_many(images)
+    assert any(result["regions"] for result in expected)
+    assert remote.detect_many(images) == expected
+    assert remote.detect_text(images[1]) == local.detect_text(images[1])
+
+
+def test_remote_detect_matches_local(service, local, images, tmp_path):
+    path = tmp_path / "img.png"
+    cv2.imwrite(str(path), images[0])
+    remote = RemoteCraftTextDetector(service.url, **CONFIG)
+
+    expected = local.detect(str(path))
+    assert expected["text_regions"]
+    assert remote.detect(str(path)) == expected
+    assert remote.detect(str(path), crop_mode="none") == local.detect(str(path), crop_mode="none")
+
+
+def test_queued_requests_with_mixed_shapes_get_their_own_results(service, local, images, monkeypatch):
+    groups = []
+    run_group = service._run_group
+
+    def recording_run_group(group):
+        groups.append(len(group))
+        run_group(group)
+
+    monkeypatch.setattr(service, "_run_group", recording_run_group)
+    batches = [[images[0]], [images[1], images[3]], [images[3]], [images[2], images[1]]]
+    results = [None] * len(batches)
+
+    def call(i):
+        results[i] = RemoteCraftTextDetector(service.url, **CONFIG).detect_many(batches[i])
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(len(batches))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert max(groups) > 1  # Requests were batched together...
+    for batch, result in zip(batches, results):
+        assert result == [local.detect_text(image) for image in batch]  # ...and split back per request
+
+
+def test_shared_memory_unlinked_after_request(service, images, created_segments):
+    RemoteCraftTextDetector(service.url, use_shared_memory=True, **CONFIG).detect_many(images)
+    _assert_unlinked(created_segments)
+
+
+def test_shared_memory_unlinked_on_service_error(service, images, created_segments, monkeypatch):
+    def failing_detector(config):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(service, "get_detector", failing_detector)
+    with pytest.raises(RuntimeError, match="boom"):
+        RemoteCraftTextDetector(service.url, use_shared_memory=True, **CONFIG).detect_many(images)
+    _assert_unlinked(created_segments)
+
+
+def test_shared_memory_unlinked_when_service_unreachable(images, created_segments):
+    remote = RemoteCraftTextDetector("http://127.0.0.1:9", use_shared_memory=True, timeout=2)
+    with pytest.raises(requests.RequestException):
+        remote.detect_many(images)
+    _assert_unlinked(created_segments)
@@ -0,0 +1,113 @@
+import itertools
+import json
+import os
+
+import pytest
+
+pytest.importorskip("requests")
+
+import fal_client_v4
+from fal_client_v4 import FalClient, FalJobError, poll_intervals
+
+
+@pytest.fixture
+def client(fal_stub):
+    with FalClient(key="test-key", base_url=fal_stub.url, storage_url=fal_stub.url, job_timeout=5) as c:
+        yield c
+
+
+def test_poll_intervals_back_off_to_cap():
+    assert list(itertools.islice(poll_intervals(0.25, 2.0, 2.0), 6)) == [0.25, 0.5, 1.0, 2.0, 2.0, 2.0]
+
+
+def test_submit_posts_payload_with_auth(client, fal_stub):
+    job = client.submit("fal-ai/some-app", {"prompt": "x"})
+
+    assert job["request_id"] == "req-1"
+    assert job["status_url"] == f"{fal_stub.url}/requests/req-1/status"
+    method, path, headers, body = fal_stub.log[-1]
+    assert (method, path) == ("POST", "/fal-ai/some-app")
+    assert headers["Authorization"] == "Key test-key"
+    assert json.loads(body) == {"prompt": "x"}
+
+
+def test_wait_backs_off_between_polls(client, fal_stub, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(fal_client_v4.time, "sleep", sleeps.append)
+    fal_stub.statuses = ["IN_QUEUE"] * 4 + ["IN_PROGRESS", "COMPLETED"]
+
+    job = client.submit("app", {})
+    assert client.wait(job)["status"] == "COMPLETED"
+
+    assert fal_stub.polls["req-1"] == 6
+    expected = list(itertools.islice(poll_intervals(), 5))
+    assert sleeps == expected
+    assert sleeps == sorted(sleeps) and sleeps[0] < sleeps[-1]
+
+
+def test_wait_raises_on_failed_job(client, fal_stub, monkeypatch):
+    monkeypatch.setattr(fal_client_v4.time, "sleep", lambda s: None)
+    fal_stub.statuses = ["IN_QUEUE", "FAILED"]
+    with pytest.raises(FalJobError, match="req-1 failed"):
+        client.wait(client.submit("app", {}))
+
+
+def test_wait_enforces_job_deadline(client, fal_stub):
+    client.job_timeout = 0.5
+    fal_stub.statuses = ["IN_QUEUE"]
+    with pytest.raises(FalJobError, match="not done after"):
+        client.wait(client.submit("app", {}))
+    # Gave up instead of sleeping past the deadline
+    assert fal_stub.polls["req-1"] <= 3
+
+
+def test_run_returns_result(client, fal_stub, monkeypatch):
+    monkeypatch.setattr(fal_client_v4.time, "sleep", lambda s: None)
+    fal_stub.layers = {"a.png": b"A"}
+    assert client.run("app", {}) == {"images": [{"url": f"{fal_stub.url}/files/a.png"}]}
+
+
+def test_upload_initiates_then_puts(client, fal_stub):
+    url = client.upload(b"image-bytes", "image/png", "input.png")
+
+    assert url == f"{fal_stub.url}/files/input.png"
+    assert fal_stub.files["input.png"] == b"image-bytes"
+    (m1, p1, h1, b1), (m2, p2, h2, b2) = fal_stub.log
+    assert m1 == "POST" and p1.startswith("/storage/upload/initiate")
+    assert h1["Authorization"] == "Key test-key"
+    assert json.loads(b1) == {"content_type": "image/png", "file_name": "input.png"}
+    assert (m2, p2, b2) == ("PUT", "/upload/input.png", b"image-bytes")
+    assert h2["Content-Type"] == "image/png"
+
+
+@pytest.fixture
+def served_files(fal_stub):
+    # One file larger than a download chunk; sizes differ so completion order varies
+    fal_stub.layers = {f"f{i}.bin": os.urandom(size)
+                       for i, size in enumerate([3 * fal_client_v4.DOWNLOAD_CHUNK + 7, 10, 5000, 1])}
+    return fal_stub.layers
+
+
+def test_download_streams_to_disk(client, fal_stub, served_files, tmp_path):
+    data = served_files["f0.bin"]
+    assert client.download(f"{fal_stub.url}/files/f0.bin", tmp_path / "f0.bin") == tmp_path / "f0.bin"
+    assert (tmp_path / "f0.bin").read_bytes() == data
+    assert client.download(f"{fal_stub.url}/files/f0.bin", tmp_path / "again.bin", keep_bytes=True) == data
+    assert (tmp_path / "again.bin").read_bytes() == data
+
+
+@pytest.mark.parametrize("keep_bytes", [False, True])
+def test_download_many_keeps_input_order(client, fal_stub, served_files, tmp_path, keep_bytes):
+    names = list(reversed(list(served_files)))
+    paths = [tmp_path / f"out_{name}" for name in names]
+
+    results = client.download_many([f"{fal_stub.url}/files/{n}" for n in names], paths, keep_bytes=keep_bytes)
+
+    assert results == ([served_files[n] for n in names] if keep_bytes else paths)
+    assert [p.read_bytes() for p in paths] == [served_files[n] for n in names]
+
+
+def test_download_raises_on_http_error(client, fal_stub, tmp_path):
+    import requests
+    with pytest.raises(requests.HTTPError):
+        client.download(f"{fal_stub.url}/files/missing.bin", tmp_path / "missing.bin")
@@ -0,0 +1,123 @@
+import base64
+import json
+from io import BytesIO
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("requests")
+Image = pytest.importorskip("PIL.Image")
+
+from fal_client_v4 import FalClient
+from fal_input_cache_v4 import UploadCache, encode_input, inline_image_url, input_image_url
+
+
+@pytest.fixture
+def client(fal_stub):
+    with FalClient(key="test-key", base_url=fal_stub.url, storage_url=fal_stub.url) as c:
+        yield c
+
+
+def _save(path, mode, color):
+    Image.new(mode, (40, 30), color).save(path)
+    return path
+
+
+@pytest.fixture
+def rgb_image(tmp_path):
+    return _save(tmp_path / "rgb.png", "RGB", (200, 10, 10))
+
+
+@pytest.fixture
+def rgba_image(tmp_path):
+    return _save(tmp_path / "rgba.png", "RGBA", (200, 10, 10, 64))
+
+
+def _decode_data_uri(uri):
+    header, payload = uri.split(",", 1)
+    return header, Image.open(BytesIO(base64.b64decode(payload)))
+
+
+def _upload_requests(stub):
+    return [entry for entry in stub.log if entry[1].startswith("/storage/upload/initiate")]
+
+
+def test_upload_miss_then_hit(client, fal_stub, rgb_image, tmp_path):
+    cache = UploadCache(tmp_path / "uploads.json", ttl=60)
+
+    url = input_image_url(rgb_image, client, cache)
+    assert url.startswith(f"{fal_stub.url}/files/") and url.endswith(".png")
+    assert Image.open(BytesIO(fal_stub.files[url.rsplit("/", 1)[-1]])).size == (40, 30)
+
+    # Same content (even under another path) -> cached URL, no second upload
+    copy = tmp_path / "copy.png"
+    copy.write_bytes(rgb_image.read_bytes())
+    assert input_image_url(copy, client, cache) == url
+    assert len(_upload_requests(fal_stub)) == 1
+
+
+def test_expired_upload_is_uploaded_again(client, fal_stub, rgb_image, tmp_path):
+    cache = UploadCache(tmp_path / "uploads.json", ttl=60)
+    url = input_image_url(rgb_image, client, cache)
+
+    entries = json.loads(cache.path.read_text())
+    for entry in entries.values():
+        entry["uploaded_at"] -= 120
+    cache.path.write_text(json.dumps(entries))
+
+    assert cache.get(next(iter(entries))) is None
+    assert input_image_url(rgb_image, client, cache) == url
+    assert len(_upload_requests(fal_stub)) == 2
+    # The rewrite dropped the expired entry and stored a fresh one
+    assert len(json.loads(cache.path.read_text())) == 1
+
+
+def test_failed_upload_falls_back_to_inline_png(client, fal_stub, rgba_image, tmp_path):
+    fal_stub.fail_uploads = True
+    cache = UploadCache(tmp_path / "uploads.json", ttl=60)
+
+    uri = input_image_url(rgba_image, client, cache)
+
+    header, img = _decode_data_uri(uri)
+    assert header == "data:image/png;base64" and img.mode == "RGBA"
+    assert img.getpixel((0, 0)) == (200, 10, 10, 64)
+    assert not cache.path.exists()
+
+
+def test_upload_disabled_inlines_without_requests(client, fal_stub, rgb_image, tmp_path):
+    uri = input_image_url(rgb_image, client, UploadCache(tmp_path / "uploads.json"), upload=False)
+    assert uri.startswith("data:image/") and fal_stub.log == []
+
+
+def test_inline_is_memoized(rgb_image):
+    assert inline_image_url(rgb_image, "jpeg", 80) is inline_image_url(rgb_image, "jpeg", 80)
+
+
+def test_lossy_formats_keep_alpha_lossless(rgb_image, rgba_image):
+    data, content_type = encode_input(rgb_image, "jpeg", 90)
+    assert content_type == "image/jpeg"
+
+    data, content_type = encode_input(rgba_image, "jpeg", 90)
+    assert content_type == "image/png"
+    assert Image.open(BytesIO(data)).getpixel((0, 0)) == (200, 10, 10, 64)
+
+    data, content_type = encode_input(rgba_image, "webp", 50)
+    assert content_type == "image/webp"
+    assert Image.open(BytesIO(data)).convert("RGBA").getpixel((0, 0)) == (200, 10, 10, 64)
+
+
+def test_uploads_are_not_shared_across_accounts_or_endpoints(client, fal_stub, rgb_image, tmp_path):
+    cache = UploadCache(tmp_path / "uploads.json", ttl=60)
+    input_image_url(rgb_image, client, cache)
+
+    with FalClient(key="other-key", base_url=fal_stub.url, storage_url=fal_stub.url) as other_account:
+        input_image_url(rgb_image, other_account, cache)
+    # Same stub reached under another storage URL
+    other_url = fal_stub.url.replace("127.0.0.1", "localhost")
+    with FalClient(key="test-key", base_url=fal_stub.url, storage_url=other_url) as other_endpoint:
+        input_image_url(rgb_image, other_endpoint, cache)
+    assert len(_upload_requests(fal_stub)) == 3
+
+    # Back under the first scope -> its URL is reused
+    input_image_url(rgb_image, client, cache)
+    assert len(_upload_requests(fal_stub)) == 3
@@ -0,0 +1,53 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("PIL")
+pytest.importorskip("dotenv")
+pytest.importorskip("requests")
+pytest.importorskip("httpx")
+
+
+def _png(value):
+    ok, data = cv2.imencode(".png", np.full((8, 8, 4), value, dtype=np.uint8))
+    return data.tobytes()
+
+
+@pytest.fixture
+def no_fal_key(monkeypatch, tmp_path):
+    """No FAL_KEY, no shared client yet, a private layer cache."""
+    monkeypatch.delenv("FAL_KEY", raising=False)
+    monkeypatch.chdir(tmp_path)
+    import fal_client_v4
+    import layer_cache_v4
+    cache = layer_cache_v4.LayerCache(tmp_path / "layer_cache", max_bytes=1 << 20)
+    monkeypatch.setattr(fal_client_v4, "_default_client", None)
+    monkeypatch.setattr(layer_cache_v4, "_default_cache", cache)
+    return cache
+
+
+def test_cache_hits_need_no_fal_key(no_fal_key, tmp_path):
+    from fal_scheduler_v4 import QwenJobScheduler
+    from run_qwen_layered_v4 import store_layers
+
+    image = tmp_path / "input.png"
+    image.write_bytes(_png(0))
+    layer = tmp_path / "0_layer_0.png"
+    layer.write_bytes(_png(7))
+    store_layers(str(image), [layer])
+
+    with QwenJobScheduler() as scheduler:
+        layers = scheduler.submit(image, tmp_path / "out").result(timeout=10)
+    assert [p.name for p in layers] == ["0_layer_0.png"]
+    assert (tmp_path / "out" / "0_layer_0.png").read_bytes() == layer.read_bytes()
+
+
+def test_missing_key_fails_the_job_not_the_scheduler(no_fal_key, tmp_path):
+    from fal_scheduler_v4 import QwenJobScheduler
+
+    image = tmp_path / "input.png"
+    image.write_bytes(_png(0))
+    with QwenJobScheduler() as scheduler:
+        future = scheduler.submit(image, tmp_path / "out")
+        with pytest.raises(RuntimeError, match="FAL_KEY"):
+            future.result(timeout=10)
@@ -0,0 +1,92 @@
+import os
+import time
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from layer_cache_v4 import LayerCache, META_NAME, STALE_SECONDS
+
+
+def _layers(tmp_path, name, sizes):
+    src = tmp_path / f"src_{name}"
+    src.mkdir()
+    paths = []
+    for idx, size in enumerate(sizes):
+        path = src / f"{idx}_layer_{idx}.png"
+        path.write_bytes(bytes([idx]) * size)
+        paths.append(path)
+    return paths
+
+
+def test_put_then_get_restores_layers_in_order(tmp_path):
+    cache = LayerCache(tmp_path / "cache", max_bytes=1 << 20)
+    layers = _layers(tmp_path, "a", [10, 20])
+    cache.put("key", layers, {"num_layers": 2})
+
+    out = tmp_path / "out"
+    out.mkdir()
+    restored = cache.get("key", out)
+
+    assert restored == [out / "0_layer_0.png", out / "1_layer_1.png"]
+    assert [p.read_bytes() for p in restored] == [p.read_bytes() for p in layers]
+    assert sorted(p.name for p in out.iterdir()) == ["0_layer_0.png", "1_layer_1.png"]
+    assert cache.get("missing", out) is None
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = LayerCache(tmp_path / "cache", max_bytes=2500)
+    out = tmp_path / "out"
+    out.mkdir()
+    cache.put("a", _layers(tmp_path, "a", [1000]))
+    cache.put("b", _layers(tmp_path, "b", [1000]))
+    os.utime(tmp_path / "cache" / "a" / META_NAME, (1, 1))
+    os.utime(tmp_path / "cache" / "b" / META_NAME, (2, 2))
+    assert cache.get("a", out)  # "b" is now the least recently used
+
+    cache.put("c", _layers(tmp_path, "c", [1000]))
+
+    assert cache.get("b", out) is None
+    assert cache.get("a", out) and cache.get("c", out)
+
+
+def test_eviction_skips_puts_in_progress(tmp_path):
+    cache = LayerCache(tmp_path / "cache", max_bytes=0)
+    cache.cache_dir.mkdir()
+    # A concurrent put: staging dir (even with files) and a renamed entry without meta.json yet
+    staging = cache.cache_dir / ".k1.123.456.tmp"
+    staging.mkdir()
+    (staging / "0_layer_0.png").write_bytes(b"x" * 100)
+    (staging / META_NAME).write_text("{}")
+    renamed = cache.cache_dir / "k2"
+    renamed.mkdir()
+    (renamed / "0_layer_0.png").write_bytes(b"x" * 100)
+
+    cache.evict()
+
+    assert staging.exists() and renamed.exists()
+    assert cache.get("k2", tmp_path) is None  # not complete -> not served
+
+
+def test_eviction_removes_stale_leftovers(tmp_path):
+    cache = LayerCache(tmp_path / "cache", max_bytes=1 << 20)
+    cache.cache_dir.mkdir()
+    stale = cache.cache_dir / ".dead.1.2.tmp"
+    stale.mkdir()
+    old = time.time() - STALE_SECONDS - 10
+    os.utime(stale, (old, old))
+
+    cache.evict()
+
+    assert not stale.exists()
+
+
+def test_failed_restore_leaves_no_partial_layers(tmp_path):
+    cache = LayerCache(tmp_path / "cache", max_bytes=1 << 20)
+    cache.put("key", _layers(tmp_path, "a", [10, 20]))
+    (tmp_path / "cache" / "key" / "1_layer_1.png").unlink()  # entry damaged after the fact
+
+    out = tmp_path / "out"
+    out.mkdir()
+    assert cache.get("key", out) is None
+    assert list(out.iterdir()) == []
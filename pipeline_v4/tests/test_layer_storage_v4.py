@@ -0,0 +1,28 @@
+from pathlib import Path
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+pytest.importorskip("PIL")
+
+from layer_storage_v4 import layer_path, write_layer, read_layer
+
+
+@pytest.mark.parametrize("path, fmt, expected", [
+    ("layers/0_layer_0_cleaned", "png", "layers/0_layer_0_cleaned.png"),
+    ("layers/0_layer_0.png", "webp", "layers/0_layer_0.webp"),
+    ("layers/0_layer_0.NPY", "png", "layers/0_layer_0.png"),
+    ("layers/img.v2_layer_0", "png", "layers/img.v2_layer_0.png"),
+    ("layers/img.v2_layer_0_cleaned", "npy", "layers/img.v2_layer_0_cleaned.npy"),
+])
+def test_layer_path(path, fmt, expected):
+    assert layer_path(path, fmt) == Path(expected)
+
+
+def test_dotted_stems_do_not_collide(tmp_path):
+    image = np.zeros((4, 4, 3), dtype=np.uint8)
+    a = write_layer(tmp_path / "img.v1_layer_0", image, "png")
+    b = write_layer(tmp_path / "img.v2_layer_0", image + 1, "png")
+    assert a != b
+    assert read_layer(a)[0, 0, 0] == 0 and read_layer(b)[0, 0, 0] == 1
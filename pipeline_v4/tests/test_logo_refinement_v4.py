@@ -0,0 +1,96 @@
+import copy
+import random
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from logo_refinement_v4 import refine_logo_roles
+
+
+def region(rid, x, y, w, h):
+    return {"id": rid, "bbox": {"x": x, "y": y, "width": w, "height": h}}
+
+
+def reference_refine(regions, g_map):
+    """The pre-vectorization nested loop (run_pipeline_layered V4.7), on a deep copy."""
+    updated_map = copy.deepcopy(g_map)
+    logos = [r for r in regions if g_map.get(str(r["id"]), {}).get("role", "") == "logo"]
+    for logo_r in logos:
+        lx, ly, lw, lh = (logo_r["bbox"][k] for k in ("x", "y", "width", "height"))
+        for other_r in regions:
+            other_rid = str(other_r["id"])
+            if other_rid == str(logo_r["id"]):
+                continue
+            if updated_map.get(other_rid, {}).get("role", "") == "logo":
+                continue
+            ox, oy, ow, oh = (other_r["bbox"][k] for k in ("x", "y", "width", "height"))
+            if oy > ly + lh:
+                gap = oy - (ly + lh)
+            elif ly > oy + oh:
+                gap = ly - (oy + oh)
+            else:
+                gap = 0
+            if gap > 20:
+                continue
+            if abs((lx + lw / 2) - (ox + ow / 2)) > max(lw, ow) * 0.5:
+                continue
+            if oh > lh * 2:
+                continue
+            if other_rid in updated_map:
+                updated_map[other_rid]["role"] = "logo"
+    return updated_map
+
+
+def test_promotes_text_next_to_logo():
+    regions = [
+        region(0, 100, 100, 200, 40),   # logo
+        region(1, 120, 150, 160, 20),   # tagline right under it -> logo
+        region(2, 100, 400, 200, 40),   # far below -> unchanged
+        region(3, 600, 100, 200, 40),   # same row, far right -> unchanged
+        region(4, 110, 145, 180, 120),  # too tall -> unchanged
+    ]
+    g_map = {str(i): {"role": "body"} for i in range(5)}
+    g_map["0"]["role"] = "logo"
+    before = copy.deepcopy(g_map)
+
+    result = refine_logo_roles(regions, g_map)
+
+    assert [result[str(i)]["role"] for i in range(5)] == ["logo", "logo", "body", "body", "body"]
+    assert g_map == before  # input map is not mutated
+    assert result["1"] is not g_map["1"]
+
+
+@pytest.mark.parametrize("seed", range(25))
+def test_matches_nested_loop_on_random_boxes(seed):
+    rng = random.Random(seed)
+    n = rng.randint(1, 30)
+    regions = [region(i + 1, rng.randint(0, 400), rng.randint(0, 400), rng.randint(5, 200), rng.randint(5, 80))
+               for i in range(n)]
+    roles = ["logo", "heading", "body", "cta", "label"]
+    # Some ids are left out of g_map on purpose
+    g_map = {str(r["id"]): {"role": rng.choice(roles), "text": f"t{r['id']}"}
+             for r in regions if rng.random() < 0.85}
+    before = copy.deepcopy(g_map)
+
+    assert refine_logo_roles(regions, g_map) == reference_refine(regions, g_map)
+    assert g_map == before
+
+
+def test_empty_inputs():
+    assert refine_logo_roles([], {}) == {}
+    g_map = {"1": {"role": "logo"}}
+    assert refine_logo_roles([], g_map) == g_map
+
+
+def test_no_logos_returns_equal_copy():
+    regions = [region(1, 0, 0, 100, 20), region(2, 0, 25, 100, 20)]
+    g_map = {"1": {"role": "heading"}, "2": {"role": "body"}}
+    result = refine_logo_roles(regions, g_map)
+    assert result == g_map and result is not g_map
+
+
+def test_ids_missing_from_g_map_are_not_added():
+    regions = [region(1, 100, 100, 200, 40), region(2, 120, 150, 160, 20)]
+    g_map = {"1": {"role": "logo"}}
+    assert refine_logo_roles(regions, g_map) == {"1": {"role": "logo"}}
@@ -0,0 +1,69 @@
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+pytest.importorskip("dotenv")
+pytest.importorskip("google.genai")
+pytest.importorskip("requests")
+pytest.importorskip("httpx")
+
+
+@pytest.fixture
+def layered(monkeypatch):
+    monkeypatch.setenv("FAL_KEY", "test-key")
+    monkeypatch.delenv("CRAFT_SERVICE_URL", raising=False)
+    import run_pipeline_layered_v4
+    return run_pipeline_layered_v4
+
+
+def _run_key(layered):
+    from run_index_v4 import make_run_key
+    return make_run_key("input-hash", layered.layered_pipeline_config())
+
+
+@pytest.mark.parametrize("env, value", [("CRAFT_BACKEND", "int8"), ("CRAFT_TILE_SIZE", "1024")])
+def test_run_key_follows_craft_runtime(layered, monkeypatch, env, value):
+    monkeypatch.delenv(env, raising=False)
+    before = _run_key(layered)
+    monkeypatch.setenv(env, value)
+    assert _run_key(layered) != before
+
+
+def test_run_key_follows_qwen_and_gemini_settings(layered, monkeypatch):
+    import run_qwen_layered_v4
+    import gemini_text_analysis_pro_v4
+    before = _run_key(layered)
+
+    monkeypatch.setattr(run_qwen_layered_v4, "QWEN_LAYERED_APP", "fal-ai/other-layered")
+    qwen_changed = _run_key(layered)
+    monkeypatch.undo()
+    monkeypatch.setenv("FAL_KEY", "test-key")
+    monkeypatch.setattr(gemini_text_analysis_pro_v4, "MODEL_NAME", "gemini-other")
+    gemini_changed = _run_key(layered)
+
+    assert len({before, qwen_changed, gemini_changed}) == 3
+
+
+def test_mock_runs_ignore_qwen_settings(layered):
+    config = layered.layered_pipeline_config("mock/layers")
+    assert config["qwen"] is None and config["mock_layers"] == "mock/layers"
+
+
+def test_lossy_inline_input_changes_layer_keys(layered, monkeypatch, tmp_path):
+    import fal_input_cache_v4
+    import run_qwen_layered_v4
+    image = tmp_path / "in.png"
+    image.write_bytes(b"not decoded")
+
+    def keys():
+        return (run_qwen_layered_v4.qwen_cache_key(str(image))[0], layered.layers_checkpoint_deps("input-hash"),
+                _run_key(layered))
+
+    lossless = keys()
+    monkeypatch.setattr(fal_input_cache_v4, "INLINE_FORMAT", "jpeg")
+    jpeg = keys()
+    monkeypatch.setattr(fal_input_cache_v4, "INLINE_QUALITY", 80)
+    jpeg_q80 = keys()
+
+    for a, b, c in zip(lossless, jpeg, jpeg_q80):
+        assert len({str(a), str(b), str(c)}) == 3
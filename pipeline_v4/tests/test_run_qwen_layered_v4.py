@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("PIL")
+pytest.importorskip("dotenv")
+pytest.importorskip("requests")
+pytest.importorskip("httpx")
+
+
+def _png(value):
+    ok, data = cv2.imencode(".png", np.full((8, 8, 4), value, dtype=np.uint8))
+    return data.tobytes()
+
+
+@pytest.fixture
+def qwen(fal_stub, monkeypatch, tmp_path):
+    """run_qwen_layered_v4 pointed at the stub (no upload, no layer cache)."""
+    monkeypatch.setenv("FAL_KEY", "test-key")
+    monkeypatch.chdir(tmp_path)
+    import fal_client_v4
+    import layer_cache_v4
+    import run_qwen_layered_v4
+
+    client = fal_client_v4.FalClient(key="test-key", base_url=fal_stub.url, storage_url=fal_stub.url,
+                                     job_timeout=5)
+    monkeypatch.setattr(fal_client_v4, "_default_client", client)
+    monkeypatch.setattr(layer_cache_v4, "_default_cache", None)
+    monkeypatch.setenv("QWEN_LAYER_CACHE_DIR", "")
+    monkeypatch.setattr(run_qwen_layered_v4, "input_image_url", lambda path, client=None: "data:image/png;base64,")
+
+    fal_stub.layers = {"a.png": _png(10), "b.png": _png(200)}
+    image = tmp_path / "input.png"
+    image.write_bytes(_png(0))
+    return run_qwen_layered_v4, client, image
+
+
+@pytest.fixture
+def fal_job_error():
+    from fal_client_v4 import FalJobError
+    return FalJobError
+
+
+def test_async_run_streams_layers_in_order(qwen, fal_stub, tmp_path):
+    module, _, image = qwen
+    layers = asyncio.run(module.run_qwen_layered_async(str(image), tmp_path / "out"))
+
+    assert [layer.name for layer in layers] == ["0_layer_0.png", "1_layer_1.png"]
+    assert [layer.image[0, 0, 0] for layer in layers] == [10, 200]
+    assert (tmp_path / "out" / "1_layer_1.png").read_bytes() == fal_stub.layers["b.png"]
+    submit = next(entry for entry in fal_stub.log if entry[0] == "POST")
+    assert submit[1] == "/" + module.QWEN_LAYERED_APP and submit[2]["Authorization"] == "Key test-key"
+
+
+def test_async_run_enforces_job_deadline(qwen, fal_stub, tmp_path, fal_job_error):
+    module, client, image = qwen
+    client.job_timeout = 0.5
+    fal_stub.statuses = ["IN_QUEUE"]
+    with pytest.raises(fal_job_error, match="not done after"):
+        asyncio.run(module.run_qwen_layered_async(str(image), tmp_path / "out"))
+
+
+def test_async_run_raises_on_failed_job(qwen, fal_stub, tmp_path, fal_job_error):
+    module, _, image = qwen
+    fal_stub.statuses = ["IN_PROGRESS", "FAILED"]
+    with pytest.raises(fal_job_error, match="failed"):
+        asyncio.run(module.run_qwen_layered_async(str(image), tmp_path / "out"))
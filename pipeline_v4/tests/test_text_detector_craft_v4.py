@@ -0,0 +1,130 @@
+import warnings
+from pathlib import Path
+
+import pytest
+
+np = pytest.importorskip("numpy")
+cv2 = pytest.importorskip("cv2")
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchvision")
+pytest.importorskip("skimage")
+
+from text_detector_craft_v4 import CraftTextDetector
+from craft_backends_v4 import EagerBackend
+from craft import CRAFT
+
+
+@pytest.fixture(scope="module")
+def detector():
+    """Detector on a randomly initialized CRAFT (no weights download), low thresholds so regions appear."""
+    torch.manual_seed(0)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        net = CRAFT().eval()
+    d = CraftTextDetector(use_heatmap_cache=False, canvas_size=320, mag_ratio=1.0,
+                          text_threshold=0.05, link_threshold=0.03, low_text=0.03)
+    d.net = EagerBackend(net)
+    return d
+
+
+def _text_image(rng, h, w):
+    image = np.full((h, w, 3), 255, dtype=np.uint8)
+    for _ in range(6):
+        y, x = int(rng.integers(0, h - 20)), int(rng.integers(0, w - 40))
+        cv2.putText(image, "TEXT", (x, y + 15), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 2)
+    return image
+
+
+@pytest.fixture(scope="module")
+def mixed_images():
+    rng = np.random.default_rng(0)
+    # Different resized shapes, plus two images sharing one (batched together)
+    return [_text_image(rng, h, w) for h, w in [(100, 150), (200, 90), (100, 150), (64, 300), (130, 170)]]
+
+
+def test_detect_many_matches_detect_text_on_mixed_sizes(detector, mixed_images):
+    assert detector.detect_many(mixed_images) == [detector.detect_text(x) for x in mixed_images]
+
+
+def test_batched_heatmaps_match_single_image(detector, mixed_images):
+    batched = detector._compute_heatmaps(mixed_images)
+    for image, (text, link, ratio) in zip(mixed_images, batched):
+        single_text, single_link, single_ratio = detector._compute_heatmaps([image])[0]
+        assert ratio == single_ratio
+        np.testing.assert_array_equal(text, single_text)
+        np.testing.assert_array_equal(link, single_link)
+
+
+def test_chunks_respect_batch_size(detector, mixed_images):
+    calls = []
+    net = detector.net
+
+    def counting_net(x):
+        calls.append(x.shape)
+        return net(x)
+
+    detector.net, detector.batch_size = counting_net, 1
+    try:
+        detector._compute_heatmaps(mixed_images)
+    finally:
+        detector.net, detector.batch_size = net, 8
+    assert len(calls) == len(mixed_images)
+
+
+def test_detect_batch_file_mode_writes_crops_per_image(detector, mixed_images, tmp_path):
+    folder = tmp_path / "images"
+    folder.mkdir()
+    for i, image in enumerate(mixed_images[:2]):
+        cv2.imwrite(str(folder / f"img{i}.png"), image)
+
+    results = detector.detect_batch(str(folder), crop_mode="file", crops_dir=str(tmp_path / "crops"))
+
+    assert len(results) == 2
+    for result in results:
+        assert "error" not in result and result["text_regions"]
+        for region in result["text_regions"]:
+            crop_path = tmp_path / "crops" / result["image_name"] / f"region_{region['id']}.png"
+            assert region["crop_path"] == str(crop_path) and crop_path.exists()
+
+
+def test_detect_batch_file_mode_keeps_same_stem_images_apart(detector, mixed_images, tmp_path):
+    folder = tmp_path / "images"
+    folder.mkdir()
+    cv2.imwrite(str(folder / "a.png"), mixed_images[0])
+    cv2.imwrite(str(folder / "a.jpg"), mixed_images[3], [cv2.IMWRITE_JPEG_QUALITY, 100])
+
+    results = detector.detect_batch(str(folder), crop_mode="file", crops_dir=str(tmp_path / "crops"))
+
+    assert sorted(r["image_name"] for r in results) == ["a.jpg", "a.png"]
+    for result in results:
+        regions = result["text_regions"]
+        assert regions and all(Path(r["crop_path"]).parent.name == result["image_name"] for r in regions)
+        # Each crop file still holds this image's crop (not overwritten by the other image)
+        expected = detector.detect(result["source_image"], crop_mode="array")["text_regions"]
+        assert len(expected) == len(regions)
+        for region, reference in zip(regions, expected):
+            assert np.array_equal(cv2.imread(region["crop_path"]), reference["crop"])
+
+
+def test_detect_batch_file_mode_requires_crops_dir(detector, tmp_path):
+    with pytest.raises(ValueError):
+        detector.detect_batch(str(tmp_path), crop_mode="file")
+
+
+def test_heatmap_key_depends_on_backend_artifact(tmp_path, mixed_images):
+    fp32, int8 = tmp_path / "craft.torchscript.pt", tmp_path / "craft.int8.torchscript.pt"
+    fp32.write_bytes(b"fp32")
+    int8.write_bytes(b"int8 model")
+    image = mixed_images[0]
+
+    def key(**kwargs):
+        return CraftTextDetector(model_path=str(tmp_path / "craft.pth"), **kwargs)._heatmap_key(image)
+
+    assert key(backend="torchscript", backend_path=str(fp32)) != key(backend="torchscript", backend_path=str(int8))
+    assert key(backend="torchscript", backend_path=str(fp32)) == key(backend="torchscript", backend_path=str(fp32))
+    # Same default artifact path, re-exported -> new key
+    default = tmp_path / "craft.onnx"
+    default.write_bytes(b"v1")
+    before = key(backend="onnx")
+    default.write_bytes(b"v2 export")
+    assert key(backend="onnx") != before
@@ -14,9 +14,11 @@ import sys
 import json
 import base64
 import argparse
+import threading
+import concurrent.futures
 from io import BytesIO
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 
 import cv2
 import numpy as np
@@ -28,14 +30,69 @@ CRAFT_DIR = Path(__file__).parent.parent / "CRAFT-pytorch"
 sys.path.insert(0, str(CRAFT_DIR))
 
 import torch
-import torch.backends.cudnn as cudnn
-from torch.autograd import Variable
 
 # Import CRAFT modules
-from craft import CRAFT
 from craft_utils import getDetBoxes, adjustResultCoordinates
 from imgproc import resize_aspect_ratio, normalizeMeanVariance
 
+try:
+    from craft_heatmap_cache_v4 import get_default_heatmap_cache, make_heatmap_key
+    from craft_backends_v4 import default_artifact_path, load_backend
+    from line_grouping_v4 import merge_close_polys
+except ImportError:
+    from pipeline_v4.craft_heatmap_cache_v4 import get_default_heatmap_cache, make_heatmap_key
+    from pipeline_v4.craft_backends_v4 import default_artifact_path, load_backend
+    from pipeline_v4.line_grouping_v4 import merge_close_polys
+
+# The v4 scripts import this module both as `text_detector_craft_v4` (pipeline_v4 on
+# sys.path) and as `pipeline_v4.text_detector_craft_v4` (project root on sys.path).
+# Register one module object under both names so the model registry below is truly
+# process-wide instead of one copy per import style.
+for _alias in ("text_detector_craft_v4", "pipeline_v4.text_detector_craft_v4"):
+    sys.modules.setdefault(_alias, sys.modules[__name__])
+
+
+# -----------------------------------------------------------------------------
+# MODEL REGISTRY
+# -----------------------------------------------------------------------------
+# One loaded CRAFT runtime per (weights path, device, backend), shared by every
+# CraftTextDetector in the process. Detectors only differ in thresholds, so
+# there is no reason to re-read craft_mlt_25k.pth for each pipeline stage.
+_MODEL_REGISTRY: Dict[Tuple[str, str, str, str], Any] = {}
+_MODEL_REGISTRY_LOCK = threading.Lock()
+
+
+def get_craft_backend(model_path: str, cuda: bool = False, backend: str = "eager", artifact_path: str = None):
+    """
+    Return the shared CRAFT runtime (see craft_backends_v4) for this weights
+    path/device/backend, loading it on first use.
+
+    Thread-safe: concurrent callers for the same key wait for a single load.
+    """
+    # ONNX Runtime and int8 backends are CPU-only
+    device = "cuda" if cuda and backend not in ("onnx", "int8") else "cpu"
+    key = (os.path.abspath(model_path), device, backend, os.path.abspath(artifact_path) if artifact_path else "")
+    with _MODEL_REGISTRY_LOCK:
+        runner = _MODEL_REGISTRY.get(key)
+        if runner is None:
+            runner = load_backend(backend, model_path, device == "cuda", artifact_path)
+            _MODEL_REGISTRY[key] = runner
+    return runner
+
+
+def get_craft_model(model_path: str, cuda: bool = False) -> torch.nn.Module:
+    """Return the shared eager CRAFT nn.Module for (model_path, device)."""
+    return get_craft_backend(model_path, cuda, "eager").net
+
+
+def clear_model_registry():
+    """Drop all cached CRAFT runtimes (e.g. to free memory between batch jobs)."""
+    with _MODEL_REGISTRY_LOCK:
+        _MODEL_REGISTRY.clear()
+
+
+CROP_MODES = ("base64", "array", "file", "none")
+
 
 class CraftTextDetector:
     """
@@ -54,7 +111,16 @@ class CraftTextDetector:
         mag_ratio: float = 1.5,
         poly: bool = False,
         padding_percentage: float = 0.035,
-        merge_lines: bool = True
+        merge_lines: bool = True,
+        batch_size: int = 8,
+        batch_max_pixels: int = None,
+        use_heatmap_cache: bool = True,
+        heatmap_cache=None,
+        backend: str = None,
+        backend_path: str = None,
+        tile_size: int = None,
+        tile_overlap: int = 128,
+        tile_workers: int = None
     ):
         """
         Initialize CRAFT detector.
@@ -70,6 +136,17 @@ class CraftTextDetector:
             poly: Use polygon output
             padding_percentage: Percentage of width/height to add as padding (default 0.035 = 3.5%)
             merge_lines: Whether to merge close words into single lines
+            batch_size: Max images stacked into one forward pass (detect_many/detect_batch)
+            batch_max_pixels: Max input pixels per forward pass (default: canvas_size^2)
+            use_heatmap_cache: Reuse score maps for identical image + resize params
+            heatmap_cache: HeatmapCache to use (default: process-wide shared cache)
+            backend: Inference runtime: "eager", "torchscript", "onnx" or "int8" (static int8
+                quantization, CPU) (default: $CRAFT_BACKEND or eager)
+            backend_path: Compiled TorchScript/ONNX/int8 file (default: next to the weights, exported if missing)
+            tile_size: If set, images larger than canvas_size are detected at native resolution on
+                overlapping tiles of this size instead of being downscaled (e.g. 1024; default: $CRAFT_TILE_SIZE)
+            tile_overlap: Overlap between neighbouring tiles in pixels (should exceed the tallest text line)
+            tile_workers: Threads running tile batches in parallel (default: CPU count, max 4)
         """
         self.text_threshold = text_threshold
         self.link_threshold = link_threshold
@@ -80,6 +157,15 @@ class CraftTextDetector:
         self.poly = poly
         self.padding_percentage = padding_percentage
         self.merge_lines = merge_lines
+        self.batch_size = max(1, batch_size)
+        self.batch_max_pixels = batch_max_pixels or canvas_size * canvas_size
+        self.use_heatmap_cache = use_heatmap_cache
+        self._heatmap_cache = heatmap_cache
+        self.backend = backend or os.getenv("CRAFT_BACKEND", "eager")
+        self.backend_path = backend_path
+        self.tile_size = tile_size or int(os.getenv("CRAFT_TILE_SIZE", "0")) or None
+        self.tile_overlap = tile_overlap
+        self.tile_workers = tile_workers or min(4, os.cpu_count() or 1)
         
         # Default model path
         if model_path is None:
@@ -89,58 +175,9 @@ class CraftTextDetector:
         self.net = None
         
     def _load_model(self):
-        """Load CRAFT model."""
+        """Attach the shared CRAFT runtime for this weights path/device/backend (loads once per process)."""
         if self.net is None:
-            print("Loading CRAFT model...")
-            self.net = CRAFT()
-            
-            print(f"Loading weights from: {self.model_path}")
-            
-            # Check if model exists, download if not
-            if not os.path.exists(self.model_path):
-                print(f"Model not found at {self.model_path}. Downloading...")
-                try:
-                    import requests
-                    # Public reliable URL for CRAFT weights (using keras-ocr release mirror which is reliable)
-                    url = "https://github.com/faustomorales/keras-ocr/releases/download/v0.8.4/craft_mlt_25k.pth"
-                    print(f"Downloading from {url}...")
-                    response = requests.get(url, stream=True)
-                    response.raise_for_status()
-                    
-                    os.makedirs(os.path.dirname(self.model_path), exist_ok=True)
-                    
-                    with open(self.model_path, "wb") as f:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            f.write(chunk)
-                    print(f"Downloaded model to {self.model_path}")
-                except Exception as e:
-                    raise RuntimeError(f"Failed to download model: {e}")
-
-            # Load state dict
-            if self.cuda:
-                state_dict = torch.load(self.model_path)
-            else:
-                state_dict = torch.load(self.model_path, map_location='cpu')
-            
-            # Handle DataParallel saved weights (remove 'module.' prefix)
-            from collections import OrderedDict
-            new_state_dict = OrderedDict()
-            for k, v in state_dict.items():
-                if k.startswith('module.'):
-                    name = k[7:]  # remove 'module.' prefix
-                else:
-                    name = k
-                new_state_dict[name] = v
-            
-            self.net.load_state_dict(new_state_dict)
-            
-            if self.cuda:
-                self.net = self.net.cuda()
-                self.net = torch.nn.DataParallel(self.net)
-                cudnn.benchmark = False
-            
-            self.net.eval()
-            print("CRAFT model loaded successfully!")
+            self.net = get_craft_backend(self.model_path, self.cuda, self.backend, self.backend_path)
     
     def _crop_polygon(self, image: np.ndarray, polygon: np.ndarray) -> np.ndarray:
         """
@@ -269,122 +306,28 @@ class CraftTextDetector:
     def _merge_close_regions(self, polys: List[np.ndarray]) -> List[np.ndarray]:
         """
         Merge close polygons that are likely on the same line.
+
+        Delegates to line_grouping_v4 (running-mean line clustering + single
+        sweep merge per line); output is identical to the old per-region loop.
         """
         if not polys or len(polys) == 0:
             return []
-            
-        # 1. Convert to detailed objects
-        regions = []
-        for p in polys:
-            if p is None: continue
-            xs, ys = p[:, 0], p[:, 1]
-            regions.append({
-                "poly": p,
-                "x1": xs.min(), "x2": xs.max(),
-                "y1": ys.min(), "y2": ys.max(),
-                "cy": (ys.min() + ys.max()) / 2,
-                "height": ys.max() - ys.min()
-            })
-        
-        if not regions:
-            return []
-            
-        # 2. Group by lines (simple Y clustering)
-        regions.sort(key=lambda r: r["cy"])
-        lines = []
-        current_line = [regions[0]]
-        
-        for r in regions[1:]:
-            # Compare with average cy of current line
-            avg_cy = sum(item["cy"] for item in current_line) / len(current_line)
-            
-            # Use max height of current line as reference
-            avg_h = sum(item["height"] for item in current_line) / len(current_line)
-            
-            # If cy diff is small relative to height (0.5 * h)
-            if abs(r["cy"] - avg_cy) < (0.5 * avg_h):
-                current_line.append(r)
-            else:
-                lines.append(current_line)
-                current_line = [r]
-        lines.append(current_line)
-        
-        # 3. Merge within lines
-        final_polys = []
-        
-        for line in lines:
-            # Sort by x1 (left to right)
-            line.sort(key=lambda r: r["x1"])
-            
-            merged_line = [line[0]]
-            for r in line[1:]:
-                prev = merged_line[-1]
-                
-                # Horizontal gap check
-                # Limit gap to 1.5 * max height of the pair
-                max_h = max(prev["height"], r["height"])
-                gap = r["x1"] - prev["x2"]
-                
-                if gap < (1.5 * max_h): 
-                    # Merge them
-                    new_x1 = min(prev["x1"], r["x1"])
-                    new_x2 = max(prev["x2"], r["x2"])
-                    new_y1 = min(prev["y1"], r["y1"])
-                    new_y2 = max(prev["y2"], r["y2"])
-                    
-                    # Create simple rect poly for merged region
-                    new_poly = np.array([
-                        [new_x1, new_y1], [new_x2, new_y1],
-                        [new_x2, new_y2], [new_x1, new_y2]
-                    ], dtype=np.float32)
-                    
-                    # Update prev (the last item in merged_line)
-                    merged_line[-1] = {
-                        "poly": new_poly,
-                        "x1": new_x1, "x2": new_x2,
-                        "y1": new_y1, "y2": new_y2,
-                        "cy": (new_y1 + new_y2) / 2,
-                        "height": new_y2 - new_y1
-                    }
-                else:
-                    merged_line.append(r)
-            
-            final_polys.extend([m["poly"] for m in merged_line])
-            
-        return final_polys
+        return merge_close_polys(polys)
     
-    def _run_craft(self, image: np.ndarray):
+    def _postprocess(self, score_text: np.ndarray, score_link: np.ndarray, target_ratio: float):
         """
-        Run CRAFT detection on image.
+        Turn CRAFT score maps into boxes/polys in original image coordinates.
         
         Args:
-            image: Image as numpy array (RGB)
+            score_text: Region score map (heatmap resolution)
+            score_link: Affinity score map (heatmap resolution)
+            target_ratio: Resize ratio returned by resize_aspect_ratio
             
         Returns:
-            boxes, polys, score_text
+            boxes, polys
         """
-        # Resize
-        img_resized, target_ratio, size_heatmap = resize_aspect_ratio(
-            image, self.canvas_size, interpolation=cv2.INTER_LINEAR, mag_ratio=self.mag_ratio
-        )
         ratio_h = ratio_w = 1 / target_ratio
         
-        # Preprocessing
-        x = normalizeMeanVariance(img_resized)
-        x = torch.from_numpy(x).permute(2, 0, 1)  # [h, w, c] to [c, h, w]
-        x = Variable(x.unsqueeze(0))  # [c, h, w] to [b, c, h, w]
-        
-        if self.cuda:
-            x = x.cuda()
-        
-        # Forward pass
-        with torch.no_grad():
-            y, feature = self.net(x)
-        
-        # Make score and link map
-        score_text = y[0, :, :, 0].cpu().data.numpy()
-        score_link = y[0, :, :, 1].cpu().data.numpy()
-        
         # Post-processing
         boxes, polys = getDetBoxes(
             score_text, score_link, 
@@ -403,52 +346,207 @@ class CraftTextDetector:
             if polys[k] is None:
                 polys[k] = boxes[k]
         
-        return boxes, polys, score_text
+        return boxes, polys
     
-    def detect(self, image_path: str) -> Dict[str, Any]:
+    def _get_heatmap_cache(self):
+        if not self.use_heatmap_cache:
+            return None
+        if self._heatmap_cache is None:
+            self._heatmap_cache = get_default_heatmap_cache()
+        return self._heatmap_cache
+
+    def _needs_tiling(self, image: np.ndarray) -> bool:
+        return bool(self.tile_size) and max(image.shape[:2]) > self.canvas_size
+
+    def _model_tag(self) -> str:
+        """Identity of the network file actually run: weights (eager) or the compiled artifact."""
+        path = self.model_path
+        if self.backend != "eager":
+            path = self.backend_path or default_artifact_path(self.model_path, self.backend)
+        try:
+            stat = os.stat(path)
+            version = f"{stat.st_size}/{stat.st_mtime_ns}"
+        except OSError:
+            version = "missing"  # Not exported yet
+        return f"{self.model_path}|{self.backend}|{os.path.abspath(path)}@{version}"
+
+    def _heatmap_key(self, image: np.ndarray) -> str:
+        model_tag = self._model_tag()
+        if self._needs_tiling(image):
+            model_tag += f"|tiles={self.tile_size}/{self.tile_overlap}"
+        return make_heatmap_key(image, self.canvas_size, self.mag_ratio, model_tag=model_tag)
+
+    def _compute_heatmaps_tiled(self, image: np.ndarray) -> Tuple[np.ndarray, np.ndarray, float]:
         """
-        Detect text regions in an image.
+        Compute native-resolution score maps for a large image from overlapping tiles.
+        
+        Tiles are run at scale 1 (no canvas downscale, no magnification) in batches
+        spread over `tile_workers` threads, so memory per forward pass stays bounded
+        by the tile size regardless of the input size. Tile score maps are stitched
+        into one half-resolution map with an element-wise max, which de-duplicates
+        text in the overlaps: a word cut at one tile's seam is whole in its
+        neighbour, and the components merge before box extraction.
         
         Args:
-            image_path: Path to the image file
+            image: Image as numpy array (RGB)
             
         Returns:
-            Dict with image info and detected text regions
+            (score_text, score_link, target_ratio=1.0)
+        """
+        h, w = image.shape[:2]
+        tile = max(64, int(self.tile_size))
+        # Even origins keep tiles aligned with the half-resolution heatmap grid
+        stride = max(32, (tile - self.tile_overlap) // 2 * 2)
+        
+        def origins(length):
+            starts = list(range(0, max(length - tile, 0) + 1, stride))
+            last = max(0, length - tile) // 2 * 2
+            if starts[-1] < last:
+                starts.append(last)
+            return starts
+        
+        boxes = []
+        for y0 in origins(h):
+            for x0 in origins(w):
+                # Tiles at the bottom/right edge run to the image border
+                y1 = h if y0 + tile >= h - 1 else y0 + tile
+                x1 = w if x0 + tile >= w - 1 else x0 + tile
+                boxes.append((y0, y1, x0, x1))
+        
+        score_text = np.zeros(((h + 1) // 2, (w + 1) // 2), dtype=np.float32)
+        score_link = np.zeros_like(score_text)
+        
+        def run_group(group):
+            tiles = [image[y0:y1, x0:x1] for y0, y1, x0, x1 in group]
+            # canvas > tile size and mag 1.0 => resize ratio is exactly 1
+            return self._compute_heatmaps(tiles, canvas_size=tile + 2, mag_ratio=1.0)
+        
+        groups = [boxes[i:i + self.batch_size] for i in range(0, len(boxes), self.batch_size)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.tile_workers) as executor:
+            for group, maps in zip(groups, executor.map(run_group, groups)):
+                for (y0, y1, x0, x1), (tile_text, tile_link, _) in zip(group, maps):
+                    mh, mw = (y1 - y0 + 1) // 2, (x1 - x0 + 1) // 2
+                    my, mx = y0 // 2, x0 // 2
+                    region = (slice(my, my + mh), slice(mx, mx + mw))
+                    np.maximum(score_text[region], tile_text[:mh, :mw], out=score_text[region])
+                    np.maximum(score_link[region], tile_link[:mh, :mw], out=score_link[region])
+        
+        return score_text, score_link, 1.0
+
+    def _compute_heatmaps(self, images: List[np.ndarray], canvas_size: int = None,
+                          mag_ratio: float = None) -> List[Tuple[np.ndarray, np.ndarray, float]]:
+        """
+        Run the CRAFT network on several images, one forward pass per chunk.
+        
+        Each image is resized (and padded to a multiple of 32) exactly as in the
+        single-image path. Only inputs with identical resized shapes share a chunk:
+        padding an image further to a larger neighbour would feed CRAFT extra
+        border input and change its scores near the image edges, so batched
+        results are the same as one detect_text() call per image. A chunk never
+        exceeds `batch_size` images or `batch_max_pixels` input pixels.
+        
+        Args:
+            images: List of images as numpy arrays (RGB)
+            canvas_size: Override self.canvas_size (used for tiles)
+            mag_ratio: Override self.mag_ratio (used for tiles)
+            
+        Returns:
+            List of (score_text, score_link, target_ratio) in input order
         """
-        # Load model if not loaded
         self._load_model()
+        canvas_size = canvas_size or self.canvas_size
+        mag_ratio = mag_ratio or self.mag_ratio
         
-    def detect_text(self, image: np.ndarray) -> Dict[str, Any]:
+        prepared = []
+        for image in images:
+            img_resized, target_ratio, _ = resize_aspect_ratio(
+                image, canvas_size, interpolation=cv2.INTER_LINEAR, mag_ratio=mag_ratio
+            )
+            prepared.append((img_resized, target_ratio))
+        
+        # Build chunks of identically shaped inputs
+        order = sorted(range(len(prepared)), key=lambda i: prepared[i][0].shape[:2])
+        chunks = []
+        for i in order:
+            h, w = prepared[i][0].shape[:2]
+            current = chunks[-1] if chunks else None
+            if (current and prepared[current[0]][0].shape[:2] == (h, w) and len(current) < self.batch_size
+                    and (len(current) + 1) * h * w <= self.batch_max_pixels):
+                current.append(i)
+            else:
+                chunks.append([i])
+        
+        heatmaps = [None] * len(prepared)
+        for chunk in chunks:
+            batch = np.stack([prepared[i][0] for i in chunk])
+            x = normalizeMeanVariance(batch).transpose(0, 3, 1, 2)  # [b, h, w, c] to [b, c, h, w]
+            
+            # Forward pass (backend returns [b, h/2, w/2, 2] numpy)
+            y = self.net(x)
+            
+            # Split score maps back out
+            for j, i in enumerate(chunk):
+                heatmaps[i] = (y[j, :, :, 0], y[j, :, :, 1], prepared[i][1])
+        
+        return heatmaps
+
+    def _run_craft_batch(self, images: List[np.ndarray]) -> List[Tuple[Any, Any, np.ndarray]]:
         """
-        Detect text using in-memory numpy array.
+        Run CRAFT detection on several images (batched, heatmap-cached).
+        
+        Score maps are looked up in the heatmap cache first (keyed by image hash +
+        canvas_size/mag_ratio + model); only misses go through the network, so
+        changing thresholds alone re-runs just the post-processing. With
+        tile_size set, images larger than canvas_size use tiled inference.
         
         Args:
-            image: Image array (RGB or BGR - autodetected)
+            images: List of images as numpy arrays (RGB)
             
         Returns:
-            Dict with 'regions' containing bboxes and polygons
+            List of (boxes, polys, score_text) in input order
         """
-        # Load model if not loaded
-        self._load_model()
+        cache = self._get_heatmap_cache()
+        heatmaps = [None] * len(images)
+        keys = [None] * len(images)
         
-        height, width = image.shape[:2]
+        if cache is not None:
+            for i, image in enumerate(images):
+                keys[i] = self._heatmap_key(image)
+                heatmaps[i] = cache.get(keys[i])
         
-        # Convert to RGB for CRAFT if needed
-        # CRAFT usually expects RGB. OpenCV is BGR.
-        # Simple heuristic: if it looks like BGR (e.g. loaded via cv2), swap.
-        # However, caller might pass RGB. 
-        # Safest is to assume BGR if coming from cv2, or just rely on caller?
-        # Let's standardize on assuming BGR (standard OpenCV format) and converting to RGB.
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        missing = [i for i in range(len(images)) if heatmaps[i] is None]
+        tiled = [i for i in missing if self._needs_tiling(images[i])]
+        direct = [i for i in missing if not self._needs_tiling(images[i])]
         
-        # Run CRAFT detection
-        boxes, polys, _ = self._run_craft(image_rgb)
+        computed = list(zip(tiled, [self._compute_heatmaps_tiled(images[i]) for i in tiled]))
+        if direct:
+            computed += list(zip(direct, self._compute_heatmaps([images[i] for i in direct])))
         
-        # Merge if requested
-        if self.merge_lines:
-            polys = self._merge_close_regions(polys)
+        for i, entry in computed:
+            heatmaps[i] = entry
+            if cache is not None:
+                cache.put(keys[i], *entry)
         
-        # Process each detected region
+        results = []
+        for score_text, score_link, target_ratio in heatmaps:
+            boxes, polys = self._postprocess(score_text, score_link, target_ratio)
+            results.append((boxes, polys, score_text))
+        return results
+    
+    def _run_craft(self, image: np.ndarray):
+        """
+        Run CRAFT detection on image.
+        
+        Args:
+            image: Image as numpy array (RGB)
+            
+        Returns:
+            boxes, polys, score_text
+        """
+        return self._run_craft_batch([image])[0]
+    
+    def _polys_to_regions(self, polys: List[np.ndarray]) -> List[Dict[str, Any]]:
+        """Build bbox/polygon region dicts (no crops), skipping tiny regions."""
         text_regions = []
         for idx, poly in enumerate(polys):
             polygon = np.array(poly, dtype=np.float32)
@@ -466,15 +564,77 @@ class CraftTextDetector:
                 "polygon": polygon.astype(int).tolist()
             }
             text_regions.append(region)
+        return text_regions
+        
+    def detect_text(self, image: np.ndarray) -> Dict[str, Any]:
+        """
+        Detect text using in-memory numpy array.
+        
+        Args:
+            image: Image array (RGB or BGR - autodetected)
+            
+        Returns:
+            Dict with 'regions' containing bboxes and polygons
+        """
+        return self.detect_many([image])[0]
+    
+    def detect_many(self, images: List[np.ndarray]) -> List[Dict[str, Any]]:
+        """
+        Detect text in several in-memory images using batched CRAFT inference.
+        
+        Intended for many small inputs (box crops, residue ROIs) where per-call
+        overhead dominates.
+        
+        Args:
+            images: List of image arrays (BGR, as loaded by OpenCV)
             
-        return {"regions": text_regions, "width": width, "height": height}
+        Returns:
+            List of dicts in input order, each shaped like detect_text() output
+        """
+        if not images:
+            return []
+        
+        # Let's standardize on assuming BGR (standard OpenCV format) and converting to RGB.
+        images_rgb = [cv2.cvtColor(image, cv2.COLOR_BGR2RGB) for image in images]
+        
+        # Run CRAFT detection
+        craft_outputs = self._run_craft_batch(images_rgb)
+        
+        return [self._build_regions_result(image, polys)
+                for image, (boxes, polys, _) in zip(images, craft_outputs)]
 
-    def detect(self, image_path: str) -> Dict[str, Any]:
+    def _build_regions_result(self, image: np.ndarray, polys: List[np.ndarray]) -> Dict[str, Any]:
+        """Merge (if requested) and package polygons into the detect_text() result dict."""
+        height, width = image.shape[:2]
+        
+        # Merge if requested
+        if self.merge_lines:
+            polys = self._merge_close_regions(polys)
+        
+        return {"regions": self._polys_to_regions(polys), "width": width, "height": height}
+
+    def _load_image(self, image_path: Path) -> np.ndarray:
+        """Load an image from disk as BGR, raising on missing/unreadable files."""
+        if not image_path.exists():
+            raise FileNotFoundError(f"Image not found: {image_path}")
+        
+        image = cv2.imread(str(image_path))
+        if image is None:
+            raise ValueError(f"Failed to load image: {image_path}")
+        return image
+
+    def detect(self, image_path: str, crop_mode: str = "base64", crops_dir: str = None) -> Dict[str, Any]:
         """
         Detect text regions in an image.
         
         Args:
             image_path: Path to the image file
+            crop_mode: How region crops are returned:
+                "base64" - PNG data URI in "cropped_base64" (default)
+                "array"  - numpy BGR view into the loaded image in "crop"
+                "file"   - PNG written to crops_dir/region_<id>.png, path in "crop_path"
+                "none"   - no crops
+            crops_dir: Output folder for crop_mode="file"
             
         Returns:
             Dict with image info and detected text regions
@@ -484,14 +644,7 @@ class CraftTextDetector:
         
         # Load image
         image_path = Path(image_path)
-        if not image_path.exists():
-            raise FileNotFoundError(f"Image not found: {image_path}")
-        
-        image = cv2.imread(str(image_path))
-        if image is None:
-            raise ValueError(f"Failed to load image: {image_path}")
-        
-        height, width = image.shape[:2]
+        image = self._load_image(image_path)
         
         # Convert to RGB for CRAFT
         image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
@@ -500,6 +653,21 @@ class CraftTextDetector:
         print(f"Processing: {image_path.name}")
         boxes, polys, _ = self._run_craft(image_rgb)
         
+        return self._build_detection_result(image, image_path, polys, crop_mode, crops_dir)
+
+    def _build_detection_result(self, image: np.ndarray, image_path: Path, polys: List[np.ndarray],
+                                crop_mode: str = "base64", crops_dir: str = None) -> Dict[str, Any]:
+        """Merge, crop and package CRAFT polygons into the detect() result dict."""
+        if crop_mode not in CROP_MODES:
+            raise ValueError(f"Unknown crop_mode '{crop_mode}'. Choose from {CROP_MODES}")
+        if crop_mode == "file":
+            if crops_dir is None:
+                raise ValueError("crop_mode='file' requires crops_dir")
+            crops_dir = Path(crops_dir)
+            crops_dir.mkdir(parents=True, exist_ok=True)
+        
+        height, width = image.shape[:2]
+        
         # Merge if requested
         if self.merge_lines:
             print("Merging close regions (line mode)...")
@@ -531,26 +699,31 @@ class CraftTextDetector:
             if cropped.size == 0:
                 continue
             
-            # Convert to base64
-            cropped_base64 = self._image_to_base64(cropped)
-            
             # Create region info
             region = {
                 "id": idx + 1,
                 "bbox": bbox,
                 "polygon": polygon.astype(int).tolist(),
-                "cropped_base64": cropped_base64,
                 "area": bbox["width"] * bbox["height"]
             }
             
-            text_regions.append(region)
+            text_regions.append((region, cropped))
         
         # Sort by position (top-to-bottom, left-to-right)
-        text_regions.sort(key=lambda r: (r["bbox"]["y"], r["bbox"]["x"]))
+        text_regions.sort(key=lambda rc: (rc[0]["bbox"]["y"], rc[0]["bbox"]["x"]))
         
-        # Re-assign IDs after sorting
-        for idx, region in enumerate(text_regions):
+        # Re-assign IDs after sorting, then attach crops (file names use final IDs)
+        for idx, (region, cropped) in enumerate(text_regions):
             region["id"] = idx + 1
+            if crop_mode == "base64":
+                region["cropped_base64"] = self._image_to_base64(cropped)
+            elif crop_mode == "array":
+                region["crop"] = cropped
+            elif crop_mode == "file":
+                crop_path = crops_dir / f"region_{region['id']}.png"
+                cv2.imwrite(str(crop_path), cropped)
+                region["crop_path"] = str(crop_path)
+        text_regions = [region for region, _ in text_regions]
         
         # Build result
         result = {
@@ -566,19 +739,29 @@ class CraftTextDetector:
         
         return result
     
-    def detect_batch(self, folder_path: str, extensions: List[str] = None) -> List[Dict[str, Any]]:
+    def detect_batch(self, folder_path: str, extensions: List[str] = None,
+                     crop_mode: str = "base64", crops_dir: str = None) -> List[Dict[str, Any]]:
         """
         Detect text in all images in a folder.
         
+        Images are loaded `batch_size` at a time and run through batched CRAFT
+        inference (see _run_craft_batch).
+        
         Args:
             folder_path: Path to folder containing images
             extensions: List of file extensions to process
+            crop_mode: "base64", "array", "file" or "none" (see detect)
+            crops_dir: Output folder for crop_mode="file"; each image's crops go to
+                crops_dir/<image file name>/region_<id>.png (the full name, so a.png and
+                a.jpg don't share a folder)
             
         Returns:
             List of detection results
         """
         if extensions is None:
             extensions = ['.png', '.jpg', '.jpeg', '.webp', '.bmp']
+        if crop_mode == "file" and crops_dir is None:
+            raise ValueError("crop_mode='file' requires crops_dir")
         
         folder = Path(folder_path)
         if not folder.exists():
@@ -592,19 +775,44 @@ class CraftTextDetector:
         
         print(f"Found {len(image_files)} images in {folder_path}")
         
-        # Process each image
-        results = []
-        for image_path in image_files:
+        def error_result(image_path, e):
+            print(f"Error processing {image_path.name}: {e}")
+            return {
+                "source_image": str(image_path.absolute()),
+                "image_name": image_path.name,
+                "error": str(e)
+            }
+        
+        # Process images chunk by chunk
+        results = [None] * len(image_files)
+        for start in range(0, len(image_files), self.batch_size):
+            loaded = []
+            for i in range(start, min(start + self.batch_size, len(image_files))):
+                try:
+                    loaded.append((i, self._load_image(image_files[i])))
+                except Exception as e:
+                    results[i] = error_result(image_files[i], e)
+            
+            if not loaded:
+                continue
+            
             try:
-                result = self.detect(str(image_path))
-                results.append(result)
+                craft_outputs = self._run_craft_batch(
+                    [cv2.cvtColor(image, cv2.COLOR_BGR2RGB) for _, image in loaded]
+                )
             except Exception as e:
-                print(f"Error processing {image_path.name}: {e}")
-                results.append({
-                    "source_image": str(image_path.absolute()),
-                    "image_name": image_path.name,
-                    "error": str(e)
-                })
+                for i, _ in loaded:
+                    results[i] = error_result(image_files[i], e)
+                continue
+            
+            for (i, image), (boxes, polys, _) in zip(loaded, craft_outputs):
+                try:
+                    print(f"Processing: {image_files[i].name}")
+                    image_crops_dir = Path(crops_dir) / image_files[i].name if crops_dir else None
+                    results[i] = self._build_detection_result(image, image_files[i], polys, crop_mode,
+                                                              image_crops_dir)
+                except Exception as e:
+                    results[i] = error_result(image_files[i], e)
         
         return results
     
@@ -824,6 +1032,18 @@ def main():
         action="store_true",
         help="Merge close words into single lines"
     )
+    parser.add_argument(
+        "--tile-size", 
+        type=int, 
+        default=None,
+        help="Detect large images at native resolution on overlapping tiles of this size"
+    )
+    parser.add_argument(
+        "--backend", 
+        choices=["eager", "torchscript", "onnx", "int8"],
+        default=None,
+        help="CRAFT inference runtime (default: $CRAFT_BACKEND or eager)"
+    )
     
     args = parser.parse_args()
     
@@ -836,7 +1056,9 @@ def main():
         link_threshold=args.link_threshold,
         cuda=args.cuda,
         padding_percentage=args.padding_percentage,
-        merge_lines=args.merge_lines
+        merge_lines=args.merge_lines,
+        backend=args.backend,
+        tile_size=args.tile_size
     )
     
     # Process single image or batch
@@ -270,7 +270,7 @@ def main():
                 full_path = Path(data["run_dir"]) / extracted_path
                 if full_path.exists():
                     # ... (Load Image) ...
-                    box_img = Image.open(full_path).convert("RGBA")
+                    box_img = backend.open_layer_pil(full_path).convert("RGBA")
                     box_b64 = image_to_base64(box_img)
                     
                     if "layer_bbox" in bg_box:
@@ -1,5 +1,6 @@
 
 import os
+import sys
 import json
 from pathlib import Path
 from PIL import Image
@@ -7,6 +8,10 @@ import cv2
 import numpy as np
 from dotenv import load_dotenv
 
+# Layer storage policy (png / webp / npy layers) shared with the v4 pipeline
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from pipeline_v4.layer_storage_v4 import list_layers, open_layer_pil, save_layer_pil
+
 # Base path for pipeline outputs
 PIPELINE_OUTPUTS_DIR = Path("pipeline_outputs")
 
@@ -66,23 +71,23 @@ def load_run_data(run_id):
         report = json.load(f)
         
     # 2. Composite Background (Cleaned Layers)
-    # Logic: Merge all *_cleaned.png images in order
+    # Logic: Merge all *_cleaned layers (any storage format) in order
     layers_dir = run_dir / "layers"
     bg_image = None
     
-    layer_files = sorted(list(layers_dir.glob("*_cleaned.png")))
+    layer_files = list_layers(layers_dir, "*_cleaned")
     
     if not layer_files:
         # Fallback: Try loading 0_layer_0.png if no cleaned ones (unlikely for completed run)
-        layer_files = sorted(list(layers_dir.glob("*.png")))
+        layer_files = list_layers(layers_dir)
         # Filter out extracted boxes
         layer_files = [f for f in layer_files if "box_region" not in f.name and "layer" in f.name]
     
     if layer_files:
         # Composite
-        base = Image.open(layer_files[0]).convert("RGBA")
+        base = open_layer_pil(layer_files[0]).convert("RGBA")
         for layer_path in layer_files[1:]:
-            overlay = Image.open(layer_path).convert("RGBA")
+            overlay = open_layer_pil(layer_path).convert("RGBA")
             if overlay.size != base.size:
                 overlay = overlay.resize(base.size)
             base = Image.alpha_composite(base, overlay)
@@ -297,8 +302,7 @@ def render_with_pipeline(run_dir, text_updates=None, bbox_updates=None):
     final_img = render_text_layer(final_img, report)
     
     # Save and return
-    out_path = run_path / "final_composed.png"
-    final_img.save(out_path)
+    out_path = save_layer_pil(final_img, run_path / "final_composed.png", fmt="png")
     print(f"[Backend] Saved: {out_path}")
     
     return final_img